@@ -1,6 +1,51 @@
+import json
+
+from django.conf import settings
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+from .models import Publishing, Book, Order, Comments, DeliveryAddress, OrderedBook, Author, ArchivedOrder, \
+    BookViewCounter, SlowQuery
+from .service import sync_book_authors
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Counts rows exactly up to ADMIN_EXACT_COUNT_LIMIT and takes the planner estimate for larger results,
+    so that a changelist page of a large table does not scan the whole table
+    """
+
+    @cached_property
+    def count(self):
+        limit = settings.ADMIN_EXACT_COUNT_LIMIT
+        queryset = self.object_list.order_by()
+        exact = queryset[:limit + 1].count()
+        if exact <= limit:
+            return exact
+        return max(self.estimate_count(queryset), exact)
 
-from .models import Publishing, Book, Order, Comments, DeliveryAddress, OrderedBook
+    @staticmethod
+    def estimate_count(queryset):
+        connection = connections[queryset.db]
+        if not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                               [queryset.model._meta.db_table])
+                row = cursor.fetchone()
+            return row[0] if row else 0
+        plan = json.loads(queryset.explain(format='json'))
+        return int(plan[0]['Plan']['Plan Rows'])
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Admin for tables with millions of rows: no exact COUNT(*) of the whole table on every changelist page
+    """
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
 @admin.register(Publishing)
@@ -8,33 +53,80 @@ class PublishingAdmin(admin.ModelAdmin):
     search_fields = ['name']
 
 
+@admin.register(Author)
+class AuthorAdmin(admin.ModelAdmin):
+    list_display = ['id', 'surname', 'name']
+    search_fields = ['^surname', '^name']
+
+
 @admin.register(Book)
-class BookAdmin(admin.ModelAdmin):
+class BookAdmin(LargeTableAdmin):
     list_display = ['id', 'title', 'author', 'publishing', 'publication_date', 'price', 'count_in_stock']
-    search_fields = ['title', 'publishing__name', 'author']
-    list_filter = ['publishing__name', 'publication_date']
+    list_select_related = ['publishing']
+    search_fields = ['=id', '^title', '^authors__surname']
+    list_filter = ['publishing', 'publication_date']
+    autocomplete_fields = ['publishing']
+    exclude = ['authors']
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        sync_book_authors(form.instance)
 
 
 @admin.register(DeliveryAddress)
-class DeliveryAddressAdmin(admin.ModelAdmin):
+class DeliveryAddressAdmin(LargeTableAdmin):
     list_display = ['order', 'address', 'phone_number']
-    search_fields = ['order']
+    list_select_related = ['order']
+    search_fields = ['=order__id']
+    raw_id_fields = ['order']
 
 
 @admin.register(OrderedBook)
-class OrderedBookAdmin(admin.ModelAdmin):
-    list_display = ['order', 'ord_book', 'quantity', 'price']
-    search_fields = ['order', 'ord_book']
+class OrderedBookAdmin(LargeTableAdmin):
+    list_display = ['order', 'title', 'quantity', 'price']
+    list_select_related = ['order']
+    search_fields = ['=order__id', '=ord_book__id']
+    raw_id_fields = ['order', 'ord_book']
 
 
 @admin.register(Order)
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(LargeTableAdmin):
     list_display = ['id', 'customer', 'order_date', 'status', 'is_paid', 'shipping_cost', 'total_cost']
-    search_fields = ['customer', 'status']
+    list_select_related = ['customer']
+    search_fields = ['=id', '=customer__username']
+    list_filter = ['status', 'is_paid']
+    raw_id_fields = ['customer']
+
+
+@admin.register(ArchivedOrder)
+class ArchivedOrderAdmin(LargeTableAdmin):
+    list_display = ['id', 'customer', 'order_date', 'status', 'is_paid', 'total_cost', 'archived_at']
+    list_select_related = ['customer']
+    search_fields = ['=id', '=customer__username']
     list_filter = ['status']
+    raw_id_fields = ['customer']
 
 
 @admin.register(Comments)
-class CommentsAdmin(admin.ModelAdmin):
+class CommentsAdmin(LargeTableAdmin):
     list_display = ['comment_author', 'rating', 'book', 'date']
-    search_fields = ['comment_author__user', 'recipe__name']
\ No newline at end of file
+    list_select_related = ['comment_author', 'book']
+    search_fields = ['=comment_author__username', '=book__id']
+    raw_id_fields = ['comment_author', 'book']
+
+
+@admin.register(BookViewCounter)
+class BookViewCounterAdmin(LargeTableAdmin):
+    list_display = ['book', 'day', 'views']
+    list_select_related = ['book']
+    search_fields = ['=book__id']
+    list_filter = ['day']
+    raw_id_fields = ['book']
+
+
+@admin.register(SlowQuery)
+class SlowQueryAdmin(admin.ModelAdmin):
+    list_display = ['fingerprint', 'view', 'calls', 'total_time', 'max_time', 'last_seen']
+    search_fields = ['=fingerprint', 'view', 'sql']
+    readonly_fields = ['fingerprint', 'sql', 'view', 'call_site', 'calls', 'total_time', 'max_time', 'plan',
+                       'first_seen', 'last_seen']
@@ -0,0 +1,104 @@
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import connections
+from django.urls import Resolver404, resolve
+
+BATCH_PATH_PREFIX = '/api/v1/'
+
+logger = logging.getLogger(__name__)
+
+SKIPPED_META_KEYS = ('wsgi.input', 'CONTENT_TYPE', 'CONTENT_LENGTH', 'QUERY_STRING', 'HTTP_ACCEPT_ENCODING')
+
+
+class BatchRequestError(Exception):
+    """
+    Raised when a sub-request of the batch can not be dispatched
+    """
+
+    def __init__(self, status_code, detail):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def _build_sub_request(request, spec):
+    url = urlsplit(spec['path'])
+    if not url.path.startswith(BATCH_PATH_PREFIX):
+        raise BatchRequestError(400, f'Поддерживаются только адреса {BATCH_PATH_PREFIX}')
+
+    try:
+        match = resolve(url.path)
+    except Resolver404:
+        raise BatchRequestError(404, 'Страница не найдена')
+    if match.url_name == 'batch':
+        raise BatchRequestError(400, 'Вложенные пакетные запросы не поддерживаются')
+
+    body = json.dumps(spec['body']).encode() if spec.get('body') is not None else b''
+    environ = {key: value for key, value in request.META.items() if key not in SKIPPED_META_KEYS}
+    environ.update({
+        'REQUEST_METHOD': spec['method'],
+        'PATH_INFO': url.path,
+        'QUERY_STRING': url.query,
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': BytesIO(body),
+    })
+    sub_request = WSGIRequest(environ)
+    sub_request.resolver_match = match
+    if request.user.is_authenticated:
+        sub_request._force_auth_user = request.user
+        sub_request._force_auth_token = request.auth
+    return sub_request, match
+
+
+def _response_body(response):
+    if getattr(response, 'data', None) is not None:
+        return response.data
+    if hasattr(response, 'render'):
+        response.render()
+    content = b''.join(response.streaming_content) if response.streaming else response.content
+    if not content:
+        return None
+    if response.get('Content-Type', '').startswith('application/json'):
+        return json.loads(content)
+    return content.decode(response.charset or 'utf-8', errors='replace')
+
+
+def _dispatch(request, spec):
+    try:
+        sub_request, match = _build_sub_request(request, spec)
+    except BatchRequestError as error:
+        return {'status': error.status_code, 'body': {'detail': error.detail}}
+
+    try:
+        response = match.func(sub_request, *match.args, **match.kwargs)
+        return {'status': response.status_code, 'body': _response_body(response)}
+    except Exception:
+        logger.exception('Batch sub-request %s %s failed', spec['method'], spec['path'])
+        return {'status': 500, 'body': {'detail': 'Ошибка сервера'}}
+
+
+def _dispatch_in_thread(request, spec):
+    try:
+        return _dispatch(request, spec)
+    finally:
+        connections.close_all()
+
+
+def execute_batch(request, specs, parallel=False):
+    """
+    Dispatches sub-requests of the batch in-process, sharing authentication of the batch request.
+    Sub-requests run one by one over the same database connection. Independent GET requests may run
+    in parallel threads, each with its own connection.
+    Returns list of sub-responses consisting status code and response body in order of sub-requests
+    """
+    if parallel and len(specs) > 1 and all(spec['method'] == 'GET' for spec in specs):
+        with ThreadPoolExecutor(max_workers=settings.BOOKSHOP_BATCH_MAX_WORKERS) as executor:
+            return list(executor.map(lambda spec: _dispatch_in_thread(request, spec), specs))
+    return [_dispatch(request, spec) for spec in specs]
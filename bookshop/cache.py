@@ -0,0 +1,140 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .metrics import record_cache
+from .models import Publishing
+
+
+class ObjectCache:
+    """
+    Cache-aside store of model instances by primary key with two tiers: a small per-process LRU in front of
+    the shared Django cache. Every object has a version in the shared cache which is replaced on invalidation,
+    so entries loaded before a change are never read again. The per-process tier trusts its entries for
+    BOOKSHOP_OBJECT_CACHE_LOCAL_TIMEOUT seconds. Concurrent misses of the same object in one process
+    are loaded from the database once
+    """
+
+    def __init__(self, name, model):
+        self.name = name
+        self.model = model
+        self._local = OrderedDict()
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def get(self, pk):
+        """
+        Returns the object with the primary key, or None if it does not exist
+        """
+        return self.get_many([pk]).get(pk)
+
+    def get_many(self, pks):
+        """
+        Returns a mapping of primary key to object for existing objects, loading all misses with one query
+        """
+        pks = list(dict.fromkeys(pks))
+        found = self._get_local(pks)
+        missing = [pk for pk in pks if pk not in found]
+        if missing:
+            found.update(self._load(missing))
+        return found
+
+    def invalidate(self, *pks):
+        """
+        Makes the cached copies of the objects stale in the shared cache and drops them in this process
+        """
+        cache.set_many({self._version_key(pk): uuid.uuid4().hex for pk in pks}, None)
+        with self._lock:
+            for pk in pks:
+                self._local.pop(pk, None)
+
+    def clear_local(self):
+        with self._lock:
+            self._local.clear()
+
+    def load_from_db(self, pks):
+        return self.model.objects.in_bulk(pks)
+
+    def _version_key(self, pk):
+        return f'bookshop:object:{self.name}:{pk}:version'
+
+    def _object_key(self, pk, version):
+        return f'bookshop:object:{self.name}:{pk}:{version}'
+
+    def _get_local(self, pks):
+        found = {}
+        now = time.monotonic()
+        with self._lock:
+            for pk in pks:
+                entry = self._local.get(pk)
+                if entry is not None and entry[0] > now:
+                    self._local.move_to_end(pk)
+                    found[pk] = entry[1]
+        for pk in pks:
+            record_cache(f'{self.name}-local', pk in found)
+        return found
+
+    def _set_local(self, objects):
+        expires = time.monotonic() + settings.BOOKSHOP_OBJECT_CACHE_LOCAL_TIMEOUT
+        with self._lock:
+            for pk, obj in objects.items():
+                self._local[pk] = (expires, obj)
+                self._local.move_to_end(pk)
+            while len(self._local) > settings.BOOKSHOP_OBJECT_CACHE_LOCAL_SIZE:
+                self._local.popitem(last=False)
+
+    def _load(self, pks):
+        with self._lock:
+            flight = threading.Event()
+            waiting = {pk: self._loading[pk] for pk in pks if pk in self._loading}
+            own = [pk for pk in pks if pk not in waiting]
+            for pk in own:
+                self._loading[pk] = flight
+
+        found = {}
+        try:
+            if own:
+                found.update(self._load_shared(own))
+        finally:
+            with self._lock:
+                for pk in own:
+                    self._loading.pop(pk, None)
+            flight.set()
+
+        for event in set(waiting.values()):
+            event.wait()
+        if waiting:
+            found.update(self._get_local(list(waiting)))
+            late = [pk for pk in waiting if pk not in found]
+            if late:
+                found.update(self._load_shared(late))
+        return found
+
+    def _load_shared(self, pks):
+        version_keys = {self._version_key(pk): pk for pk in pks}
+        versions = {version_keys[key]: version for key, version in cache.get_many(version_keys).items()}
+        for pk in pks:
+            if pk not in versions:
+                cache.add(self._version_key(pk), uuid.uuid4().hex, None)
+                versions[pk] = cache.get(self._version_key(pk))
+
+        object_keys = {self._object_key(pk, versions[pk]): pk for pk in pks}
+        found = {object_keys[key]: obj for key, obj in cache.get_many(object_keys).items()}
+        for pk in pks:
+            record_cache(self.name, pk in found)
+
+        missing = [pk for pk in pks if pk not in found]
+        if missing:
+            loaded = self.load_from_db(missing)
+            cache.set_many({self._object_key(pk, versions[pk]): obj for pk, obj in loaded.items()},
+                           settings.BOOKSHOP_OBJECT_CACHE_TIMEOUT)
+            found.update(loaded)
+        self._set_local(found)
+        return found
+
+
+publishing_cache = ObjectCache('publishing', Publishing)
@@ -0,0 +1,93 @@
+import atexit
+import logging
+import os
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from .models import Book, BookViewCounter
+
+logger = logging.getLogger(__name__)
+
+
+def add_book_views(views):
+    """
+    Adds views given as {(book id, day): number of views} to the counters with one INSERT ... ON CONFLICT statement.
+    Views of deleted books are skipped
+    """
+    if not views:
+        return
+    keys = sorted(views)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {BookViewCounter._meta.db_table} (book_id, day, views) '
+            f'SELECT v.book_id, v.day, v.views FROM unnest(%s::bigint[], %s::date[], %s::bigint[]) '
+            f'AS v(book_id, day, views) JOIN {Book._meta.db_table} b ON b.id = v.book_id '
+            f'ORDER BY v.book_id, v.day '
+            f'ON CONFLICT (book_id, day) DO UPDATE SET views = {BookViewCounter._meta.db_table}.views + EXCLUDED.views',
+            [[book_id for book_id, _ in keys], [day for _, day in keys], [views[key] for key in keys]],
+        )
+
+
+class ViewCounterBuffer:
+    """
+    Counts views of books in memory of the process and writes them to the database from a background thread
+    every BOOKSHOP_VIEW_FLUSH_INTERVAL seconds, when BOOKSHOP_VIEW_BUFFER_SIZE books are buffered and at exit.
+    Views buffered by a killed process are lost
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = Counter()
+        self._wake = threading.Event()
+        self._pid = None
+
+    def record(self, book_id):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._start()
+            self._views[(book_id, timezone.localdate())] += 1
+            if len(self._views) >= settings.BOOKSHOP_VIEW_BUFFER_SIZE:
+                self._wake.set()
+
+    def pending(self):
+        with self._lock:
+            return sum(self._views.values())
+
+    def flush(self):
+        """
+        Writes the buffered views to the database. Returns number of written views
+        """
+        with self._lock:
+            views, self._views = self._views, Counter()
+        try:
+            add_book_views(views)
+        except Exception:
+            logger.exception('Could not write %s book views', sum(views.values()))
+            with self._lock:
+                if len(self._views) < settings.BOOKSHOP_VIEW_BUFFER_SIZE:
+                    self._views.update(views)
+            return 0
+        return sum(views.values())
+
+    def _start(self):
+        # A forked worker starts its own thread and does not write views buffered by the parent process
+        if self._pid is None:
+            atexit.register(self.flush)
+        self._pid = os.getpid()
+        self._views.clear()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            self._wake.wait(settings.BOOKSHOP_VIEW_FLUSH_INTERVAL)
+            self._wake.clear()
+            connection.close_if_unusable_or_obsolete()
+            self.flush()
+
+
+view_counter = ViewCounterBuffer()
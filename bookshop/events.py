@@ -0,0 +1,111 @@
+import asyncio
+import threading
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.dispatch import Signal
+
+# Sent with book_ids after stock or prices were changed by a queryset update, which does not send post_save
+stock_changed = Signal()
+
+
+def book_state(count_in_stock, price):
+    """
+    Returns the state of the book sent to clients consisting number of books in stock, book price
+    """
+    return {'count_in_stock': count_in_stock, 'price': f'{Decimal(price):.2f}'}
+
+
+class Subscription:
+    """
+    Keeps the latest state of the subscribed books changed since the client read them last time.
+    A slow client never queues more than one state per book
+    """
+
+    def __init__(self, book_ids):
+        self.book_ids = frozenset(book_ids)
+        self.pending = {}
+        self.ready = asyncio.Event()
+
+    def push(self, changes):
+        for book_id in self.book_ids.intersection(changes):
+            self.pending[book_id] = changes[book_id]
+        if self.pending:
+            self.ready.set()
+
+    async def next(self, timeout):
+        """
+        Returns the changes since the last call, or an empty dict if nothing changed in timeout seconds
+        """
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return {}
+        self.ready.clear()
+        changes, self.pending = self.pending, {}
+        return changes
+
+
+class StockBroadcaster:
+    """
+    Delivers stock and price changes of books to subscriptions of the event loop of this process.
+    Changes can be published from any thread, they are coalesced and delivered once per BOOKSHOP_EVENTS_INTERVAL
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._changes = {}
+        self._subscriptions = defaultdict(set)
+        self._loop = None
+        self._scheduled = False
+
+    def has_subscribers(self):
+        return bool(self._subscriptions)
+
+    def subscribe(self, book_ids):
+        self._loop = asyncio.get_running_loop()
+        subscription = Subscription(book_ids)
+        for book_id in subscription.book_ids:
+            self._subscriptions[book_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        for book_id in subscription.book_ids:
+            subscribers = self._subscriptions.get(book_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscriptions[book_id]
+
+    def publish(self, changes):
+        """
+        Takes a mapping of book id to the new state of the book
+        """
+        if self._loop is None or not self.has_subscribers():
+            return
+        with self._lock:
+            self._changes.update(changes)
+            if self._scheduled:
+                return
+            self._scheduled = True
+        try:
+            self._loop.call_soon_threadsafe(self._loop.call_later, settings.BOOKSHOP_EVENTS_INTERVAL, self._flush)
+        except RuntimeError:
+            with self._lock:
+                self._changes.clear()
+                self._scheduled = False
+            self._loop = None
+
+    def _flush(self):
+        with self._lock:
+            changes, self._changes = self._changes, {}
+            self._scheduled = False
+        subscriptions = set()
+        for book_id in changes:
+            subscriptions.update(self._subscriptions.get(book_id, ()))
+        for subscription in subscriptions:
+            subscription.push(changes)
+
+
+broadcaster = StockBroadcaster()
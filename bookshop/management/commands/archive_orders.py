@@ -0,0 +1,29 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from bookshop.service import archive_orders_batch
+
+
+class Command(BaseCommand):
+    help = 'Moves delivered and cancelled orders older than the given age to the archive tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=settings.BOOKSHOP_ORDER_ARCHIVE_DAYS)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--max-batches', type=int, default=None, help='Stop after this number of batches')
+
+    def handle(self, *args, **options):
+        older_than = timezone.now() - timedelta(days=options['older_than_days'])
+        archived = batches = 0
+        while options['max_batches'] is None or batches < options['max_batches']:
+            number = archive_orders_batch(older_than, options['batch_size'])
+            if not number:
+                break
+            archived += number
+            batches += 1
+            self.stdout.write(f'Archived {archived} order(s)')
+
+        self.stdout.write(self.style.SUCCESS(f'Archived {archived} order(s) placed before {older_than:%Y-%m-%d}'))
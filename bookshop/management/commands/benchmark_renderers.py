@@ -0,0 +1,77 @@
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.http import HttpRequest
+from django.utils import timezone
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from bookshop.models import Book, Order
+from bookshop.parsers import MessagePackParser
+from bookshop.renderers import MessagePackRenderer
+from bookshop.serializers import BookListSerializer, OrderListSerializer
+
+
+def make_books(number):
+    books = []
+    for index in range(number):
+        book = Book(id=index + 1, title=f'Книга {index}', price=Decimal(100 + index % 900) + Decimal('0.99'))
+        book.average_rating, book.reviews_count = 1 + index % 5 * 0.8, index % 40
+        books.append(book)
+    return books
+
+
+def make_orders(number):
+    customer = User(id=1, username='customer', email='customer@example.com')
+    now = timezone.now()
+    return [Order(id=index + 1, customer=customer, order_date=now - timedelta(hours=index), pay_date=now,
+                  status='Доставлен', is_paid=True, total_cost=Decimal(500 + index) + Decimal('0.50'))
+            for index in range(number)]
+
+
+class Command(BaseCommand):
+    help = 'Compares serializing, encoding and decoding of book and order lists in JSON and MessagePack'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=1000, help='Number of books and orders in a list')
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        formats = [('json', JSONRenderer(), JSONParser()),
+                   ('msgpack', MessagePackRenderer(), MessagePackParser())]
+        payloads = [('books', BookListSerializer, make_books(options['items'])),
+                    ('orders', OrderListSerializer, make_orders(options['items']))]
+        for payload_name, serializer_class, instances in payloads:
+            self.stdout.write(self.style.MIGRATE_HEADING(f'{payload_name} x {len(instances)}'))
+            for format_name, renderer, parser in formats:
+                http_request = HttpRequest()
+                http_request.META.update(SERVER_NAME='localhost', SERVER_PORT='80')
+                request = Request(http_request)
+                request.accepted_renderer = renderer
+                context = {'request': request}
+
+                data = serializer_class(instances, many=True, context=context).data
+                content = renderer.render(data)
+                serialize = self.measure(
+                    lambda: serializer_class(instances, many=True, context=context).data, options['repeat'])
+                encode = self.measure(lambda: renderer.render(data), options['repeat'])
+                decode = self.measure(lambda: parser.parse(BytesIO(content)), options['repeat'])
+                self.stdout.write(f'  {format_name:8} {len(content):>9} bytes  serialize {serialize:7.2f} ms  '
+                                  f'encode {encode:7.2f} ms  decode {decode:7.2f} ms')
+
+    @staticmethod
+    def measure(function, repeat):
+        """
+        Returns the best time of the function call in milliseconds
+        """
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            best = min(best, time.perf_counter() - start)
+        return best * 1000
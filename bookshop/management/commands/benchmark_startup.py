@@ -0,0 +1,66 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Runs in a fresh interpreter: loads the WSGI application and times the first requests made to it
+WORKER_SCRIPT = '''
+import io, json, sys, time
+start = time.perf_counter()
+from bookshop_project.wsgi import application
+loaded = time.perf_counter() - start
+timings = []
+for path in sys.argv[1:]:
+    path, _, query = path.partition('?')
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query, 'SERVER_NAME': 'localhost',
+               'SERVER_PORT': '80', 'HTTP_HOST': 'localhost', 'REMOTE_ADDR': '127.0.0.1', 'wsgi.input': io.BytesIO(),
+               'wsgi.errors': sys.stderr, 'wsgi.url_scheme': 'http', 'wsgi.version': (1, 0),
+               'wsgi.multithread': False, 'wsgi.multiprocess': True, 'wsgi.run_once': False}
+    statuses = []
+    start = time.perf_counter()
+    response = application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+    for _ in response:
+        pass
+    response.close()
+    timings.append({'path': path, 'status': statuses[0], 'seconds': time.perf_counter() - start})
+print(json.dumps({'load': loaded, 'requests': timings}))
+'''
+
+DEFAULT_PATHS = ['/api/v1/books/', '/api/v1/books/suggest/?q=a', '/api/v1/publishing-houses/', '/api/v1/authors/']
+
+
+class Command(BaseCommand):
+    help = 'Measures loading of the WSGI application and its first requests in fresh processes, ' \
+           'with and without the warm-up'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', action='append', dest='paths', help='Request path, may be repeated')
+        parser.add_argument('--repeat', type=int, default=3, help='Number of processes started for every mode')
+
+    def handle(self, *args, **options):
+        paths = options['paths'] or DEFAULT_PATHS
+        for warm_up in (False, True):
+            runs = [self.run_worker(paths, warm_up) for _ in range(options['repeat'])]
+            load = statistics.median(run['load'] for run in runs)
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f'Warm-up {"on" if warm_up else "off"}: load {load * 1000:.1f} ms (median of {len(runs)})'))
+            for number, path in enumerate(paths):
+                seconds = statistics.median(run['requests'][number]['seconds'] for run in runs)
+                status = runs[0]['requests'][number]['status']
+                self.stdout.write(f'  {path}  {seconds * 1000:.1f} ms  [{status}]')
+            first_requests = statistics.median(sum(request['seconds'] for request in run['requests']) for run in runs)
+            self.stdout.write(f'  load + first requests: {(load + first_requests) * 1000:.1f} ms, '
+                              f'first requests only: {first_requests * 1000:.1f} ms')
+
+    @staticmethod
+    def run_worker(paths, warm_up):
+        environ = dict(os.environ, BOOKSHOP_WARM_UP=str(warm_up))
+        result = subprocess.run([sys.executable, '-c', WORKER_SCRIPT, *paths], cwd=settings.BASE_DIR, env=environ,
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            raise CommandError(result.stderr)
+        return json.loads(result.stdout.strip().splitlines()[-1])
@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from bookshop.snapshots import build_catalog_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Writes the changed shards of the anonymous catalog snapshot and publishes its new manifest'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', default=settings.BOOKSHOP_CATALOG_SNAPSHOT_DIR)
+        parser.add_argument('--page-size', type=int, default=settings.BOOKSHOP_CATALOG_SNAPSHOT_PAGE_SIZE,
+                            help='Number of book ids in one page shard')
+        parser.add_argument('--force', action='store_true', help='Render all shards again')
+
+    def handle(self, *args, **options):
+        result = build_catalog_snapshot(options['dir'], options['page_size'], options['force'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {result["written"]} shard(s), kept {result["kept"]}, removed {result["removed"]} old file(s) '
+            f'in {options["dir"]}'))
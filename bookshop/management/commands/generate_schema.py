@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from bookshop_project.yasg import get_code_version, write_schema_files
+
+
+class Command(BaseCommand):
+    help = 'Generates the OpenAPI schema files served by /swagger.json and /swagger.yaml'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--code-version', dest='code_version', help='Code version, defaults to APP_VERSION')
+
+    def handle(self, *args, **options):
+        for schema_file in write_schema_files(options['code_version'] or get_code_version()):
+            self.stdout.write(self.style.SUCCESS(f'Written {schema_file}'))
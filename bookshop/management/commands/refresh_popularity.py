@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from bookshop.service import refresh_popularity
+
+
+class Command(BaseCommand):
+    help = 'Recomputes popularity and average rating of books from recent sales and comments'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        updated = refresh_popularity(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Refreshed popularity of {updated} book(s)'))
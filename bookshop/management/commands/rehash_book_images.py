@@ -0,0 +1,47 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from bookshop.models import ArchivedOrderedBook, Book, OrderedBook
+from bookshop.storage import is_content_addressed
+
+
+class Command(BaseCommand):
+    help = 'Moves existing book images to content-addressed names and rewrites image paths of books and order lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--keep-old', action='store_true', help='Do not delete the old files')
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        default_image = Book._meta.get_field('image').default
+        names = Book.objects.exclude(Q(image='') | Q(image=default_image)).order_by().values_list(
+            'image', flat=True).distinct().iterator(chunk_size=options['batch_size'])
+
+        moved = missing = 0
+        for old_name in names:
+            if is_content_addressed(old_name):
+                continue
+            if not default_storage.exists(old_name):
+                missing += 1
+                self.stderr.write(f'Missing file: {old_name}')
+                continue
+            if options['dry_run']:
+                moved += 1
+                continue
+
+            with default_storage.open(old_name) as content:
+                new_name = default_storage.save(old_name, content)
+            with transaction.atomic():
+                Book.objects.filter(image=old_name).update(image=new_name, updated_at=timezone.now())
+                # Order lines keep a copy of the image of the book at the time of the order
+                OrderedBook.objects.filter(image=old_name).update(image=new_name)
+                ArchivedOrderedBook.objects.filter(image=old_name).update(image=new_name)
+            if not options['keep_old'] and new_name != old_name:
+                default_storage.delete(old_name)
+            moved += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Rehashed {moved} image(s), {missing} missing'))
@@ -0,0 +1,32 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from bookshop.models import SlowQuery
+from bookshop.slowlog import SLOW_QUERY_ORDERINGS
+
+
+class Command(BaseCommand):
+    help = 'Prints the slowest query shapes recorded by SlowQueryMiddleware'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--order', choices=SLOW_QUERY_ORDERINGS, default='total_time')
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument('--plans', action='store_true', help='Print the captured query plans')
+        parser.add_argument('--reset', action='store_true', help='Delete the recorded statistics')
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            deleted, _ = SlowQuery.objects.all().delete()
+            self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} slow query shape(s)'))
+            return
+
+        for query in SlowQuery.objects.order_by('-' + options['order'])[:options['limit']]:
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f'{query.fingerprint}  calls={query.calls}  total={query.total_time:.1f} ms  '
+                f'max={query.max_time:.1f} ms  avg={query.total_time / query.calls:.1f} ms'))
+            self.stdout.write(f'  view: {query.view or "-"}')
+            self.stdout.write(f'  call site: {query.call_site or "-"}')
+            self.stdout.write(f'  {query.sql}')
+            if options['plans'] and query.plan is not None:
+                self.stdout.write(json.dumps(query.plan, indent=2, ensure_ascii=False))
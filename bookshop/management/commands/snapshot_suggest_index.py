@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from bookshop.suggest import SuggestIndex
+
+
+class Command(BaseCommand):
+    help = 'Builds the title autocomplete index from the database and writes its snapshot'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=settings.BOOKSHOP_SUGGEST_SNAPSHOT)
+
+    def handle(self, *args, **options):
+        index = SuggestIndex.from_database()
+        index.write_snapshot(options['path'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {len(index.books)} book(s), {len(index.entries)} key(s) to {options["path"]}'))
@@ -0,0 +1,46 @@
+import os
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+
+REQUEST_LATENCY = Histogram(
+    'bookshop_request_duration_seconds', 'Time spent by the view to produce the response',
+    ['view', 'method', 'status'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+
+REQUEST_QUERIES = Histogram(
+    'bookshop_request_db_queries', 'Database queries executed per request', ['view'],
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200),
+)
+
+DB_QUERIES = Counter('bookshop_db_queries_total', 'Database queries executed', ['view'])
+
+CACHE_REQUESTS = Counter('bookshop_cache_requests_total', 'Cache lookups', ['cache', 'result'])
+
+ORDERS_PLACED = Counter('bookshop_orders_placed_total', 'Orders placed by customers')
+
+STOCK_OUTS = Counter('bookshop_stock_outs_total', 'Books sold out by placed orders')
+
+TOKENS_ISSUED = Counter('bookshop_tokens_issued_total', 'JWT tokens issued', ['kind'])
+
+
+def record_cache(cache_name, hit):
+    """
+    Counts a cache lookup as a hit or a miss
+    """
+    CACHE_REQUESTS.labels(cache_name, 'hit' if hit else 'miss').inc()
+
+
+def render_metrics():
+    """
+    Returns metrics in Prometheus text format and its content type.
+    With PROMETHEUS_MULTIPROC_DIR set, metrics of all worker processes are collected from their files
+    """
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
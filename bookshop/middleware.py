@@ -0,0 +1,224 @@
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection
+from django.http import FileResponse
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+
+from .metrics import DB_QUERIES, REQUEST_LATENCY, REQUEST_QUERIES
+from .slowlog import SlowQueryRecorder, save_slow_queries
+
+PROFILE_MODES = ('cprofile', 'sample', 'tracemalloc')
+
+PROFILE_EXTENSIONS = {'cprofile': '.prof', 'sample': '.collapsed', 'tracemalloc': '.txt'}
+
+
+def get_staff_user(request):
+    """
+    Returns the staff user making the request, authenticated by session or JWT, or None
+    """
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated and user.is_staff:
+        return user
+    try:
+        result = JWTAuthentication().authenticate(request)
+    except (AuthenticationFailed, InvalidToken):
+        return None
+    if result is not None and result[0].is_staff:
+        return result[0]
+    return None
+
+
+class _QueryRecorder:
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({'sql': sql, 'time_ms': round((time.perf_counter() - start) * 1000, 3)})
+
+
+class _QueryCounter:
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class _StackSampler(threading.Thread):
+
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.finished = threading.Event()
+
+    def run(self):
+        while not self.finished.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def collapsed(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+
+class RequestProfilerMiddleware:
+    """
+    Profiles one request when a staff user asks for it with the X-Profile header or the _profile query parameter
+    (cprofile, sample or tracemalloc). The profile and SQL timings are stored in PROFILE_ROOT and can be downloaded
+    by the id from the X-Profile-Id response header. Requests without the flag are passed through untouched
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        mode = request.META.get('HTTP_X_PROFILE')
+        if mode is None and '_profile=' in request.META.get('QUERY_STRING', ''):
+            mode = request.GET.get('_profile')
+        if not mode or mode not in PROFILE_MODES or get_staff_user(request) is None:
+            return self.get_response(request)
+        return self.profile(request, mode)
+
+    def profile(self, request, mode):
+        profile_id = uuid.uuid4().hex
+        recorder = _QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            if mode == 'cprofile':
+                import cProfile
+
+                profiler = cProfile.Profile()
+                response = profiler.runcall(self.get_response, request)
+                profiler.dump_stats(self.get_profile_path(profile_id, mode))
+            elif mode == 'sample':
+                sampler = _StackSampler(threading.get_ident(), settings.PROFILE_SAMPLING_INTERVAL)
+                sampler.start()
+                try:
+                    response = self.get_response(request)
+                finally:
+                    sampler.finished.set()
+                    sampler.join()
+                with open(self.get_profile_path(profile_id, mode), 'w') as stream:
+                    stream.write(sampler.collapsed())
+            else:
+                import tracemalloc
+
+                tracemalloc.start()
+                try:
+                    response = self.get_response(request)
+                    snapshot = tracemalloc.take_snapshot()
+                    current, peak = tracemalloc.get_traced_memory()
+                finally:
+                    tracemalloc.stop()
+                with open(self.get_profile_path(profile_id, mode), 'w') as stream:
+                    stream.write(f'current={current} peak={peak}\n')
+                    for statistic in snapshot.statistics('lineno')[:settings.PROFILE_TRACEMALLOC_TOP]:
+                        stream.write(f'{statistic}\n')
+
+        sql_time = sum(query['time_ms'] for query in recorder.queries)
+        with open(os.path.join(settings.PROFILE_ROOT, f'{profile_id}.sql.json'), 'w') as stream:
+            json.dump({'path': request.get_full_path(), 'mode': mode, 'queries': recorder.queries,
+                       'time_ms': round(sql_time, 3)}, stream, indent=2)
+
+        response['X-Profile-Id'] = profile_id
+        response['X-Profile-SQL'] = f'count={len(recorder.queries)}; time_ms={sql_time:.3f}'
+        return response
+
+    @staticmethod
+    def get_profile_path(profile_id, mode):
+        os.makedirs(settings.PROFILE_ROOT, exist_ok=True)
+        return os.path.join(settings.PROFILE_ROOT, profile_id + PROFILE_EXTENSIONS[mode])
+
+
+class MetricsMiddleware:
+    """
+    Measures latency and number of database queries of every request per URL name
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        counter = _QueryCounter()
+        start = time.perf_counter()
+        with connection.execute_wrapper(counter):
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match is not None else 'unmatched'
+        REQUEST_LATENCY.labels(view, request.method, response.status_code).observe(duration)
+        REQUEST_QUERIES.labels(view).observe(counter.count)
+        DB_QUERIES.labels(view).inc(counter.count)
+        return response
+
+
+class SlowQueryMiddleware:
+    """
+    Records database queries slower than SLOW_QUERY_THRESHOLD_MS with the view, call site and query plan,
+    aggregated per normalized SQL. Queries of a streamed response are recorded when the stream is finished
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = SlowQueryRecorder()
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+        if response.streaming and not response.is_async and not isinstance(response, FileResponse):
+            response.streaming_content = self.record_stream(request, response.streaming_content, recorder)
+        else:
+            self.save(request, recorder)
+        return response
+
+    def record_stream(self, request, content, recorder):
+        with connection.execute_wrapper(recorder):
+            yield from content
+        self.save(request, recorder)
+
+    @staticmethod
+    def save(request, recorder):
+        if recorder.queries:
+            match = getattr(request, 'resolver_match', None)
+            save_slow_queries(recorder.queries, match.view_name if match is not None else 'unmatched')
+
+
+class ThrottleHeadersMiddleware:
+    """
+    Adds the request budget left after a throttled API request to the response headers
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        budget = getattr(request, 'throttle_budget', None)
+        if budget is not None:
+            response['X-RateLimit-Limit'] = budget['limit']
+            response['X-RateLimit-Remaining'] = budget['remaining']
+            response['X-RateLimit-Cost'] = budget['cost']
+        return response
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.1 on 2026-10-19 14:31
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookshop', '0002_alter_order_payment_method'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Author',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(blank=True, default='', max_length=100, verbose_name='Имя')),
+                ('surname', models.CharField(max_length=100, verbose_name='Фамилия')),
+            ],
+            options={
+                'verbose_name': 'Автор',
+                'verbose_name_plural': 'Авторы',
+                'ordering': ('surname', 'name'),
+                'indexes': [models.Index(fields=['name'], name='author_name_idx'), models.Index(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('surname'), name='text_pattern_ops'), name='author_surname_prefix_idx'), models.Index(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('name'), name='text_pattern_ops'), name='author_name_prefix_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='author',
+            constraint=models.UniqueConstraint(fields=('surname', 'name'), name='unique_author_full_name'),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='authors',
+            field=models.ManyToManyField(blank=True, related_name='books', to='bookshop.author', verbose_name='Авторы'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+import re
+
+from django.db import migrations
+
+AUTHOR_SEPARATORS = re.compile(r'\s*(?:,|;|&|\s+и\s+|\s+and\s+)\s*', re.IGNORECASE)
+
+BATCH_SIZE = 1000
+
+
+def split_author_names(value):
+    authors = []
+    for part in AUTHOR_SEPARATORS.split(value or ''):
+        tokens = part.split()
+        if not tokens:
+            continue
+        if len(tokens) == 1:
+            authors.append(('', tokens[0]))
+        elif tokens[-1].endswith('.'):
+            authors.append((' '.join(tokens[1:]), tokens[0]))
+        else:
+            authors.append((' '.join(tokens[:-1]), tokens[-1]))
+    return authors
+
+
+def populate_authors(apps, schema_editor):
+    Author = apps.get_model('bookshop', 'Author')
+    Book = apps.get_model('bookshop', 'Book')
+    BookAuthors = Book.authors.through
+
+    authors = {}
+    links = []
+    for book_id, author in Book.objects.exclude(author__isnull=True).exclude(author='').values_list(
+            'id', 'author').iterator(chunk_size=BATCH_SIZE):
+        for full_name in split_author_names(author):
+            if full_name not in authors:
+                authors[full_name] = Author.objects.get_or_create(name=full_name[0], surname=full_name[1])[0].pk
+            links.append(BookAuthors(book_id=book_id, author_id=authors[full_name]))
+        if len(links) >= BATCH_SIZE:
+            BookAuthors.objects.bulk_create(links, ignore_conflicts=True)
+            links = []
+    BookAuthors.objects.bulk_create(links, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookshop', '0003_author'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_authors, migrations.RunPython.noop),
+    ]
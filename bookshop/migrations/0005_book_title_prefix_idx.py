@@ -0,0 +1,19 @@
+# Generated by Django 4.2.1 on 2026-10-19 14:43
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookshop', '0004_populate_authors'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('title'), name='text_pattern_ops'), name='book_title_prefix_idx'),
+        ),
+    ]
@@ -0,0 +1,87 @@
+# Generated by Django 4.2.1 on 2026-10-19 14:44
+
+from django.conf import settings
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('bookshop', '0005_book_title_prefix_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedDeliveryAddress',
+            fields=[
+                ('address', models.TextField(max_length=250, verbose_name='Адрес заказа')),
+                ('phone_number', models.CharField(blank=True, max_length=16, validators=[django.core.validators.RegexValidator(regex='^\\+?1?\\d{8,15}$')], verbose_name='Номер телефона')),
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+            ],
+            options={
+                'verbose_name': 'Архивный адрес доставки',
+                'verbose_name_plural': 'Архивные адреса доставок',
+                'ordering': ('-order',),
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('status', models.CharField(choices=[('В работе', 'В работе'), ('Передан в службу доставки', 'Передан в службу доставки'), ('Доставлен', 'Доставлен'), ('Отменен', 'Отменен')], default='В работе', verbose_name='Статус заказа')),
+                ('is_paid', models.BooleanField(default=False, verbose_name='Статус оплаты')),
+                ('pay_date', models.DateTimeField(blank=True, null=True, verbose_name='Дата оплаты')),
+                ('delivery_date', models.DateTimeField(blank=True, null=True, verbose_name='Дата доставки')),
+                ('shipping_cost', models.DecimalField(decimal_places=2, default=0, max_digits=7, verbose_name='Цена доставки')),
+                ('total_cost', models.DecimalField(decimal_places=2, default=0, max_digits=7, verbose_name='Цена заказа с учетом доставки')),
+                ('payment_method', models.CharField(default='Card', verbose_name='Способ оплаты')),
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('order_date', models.DateTimeField(db_index=True, verbose_name='Дата заказа')),
+                ('archived_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата архивации')),
+            ],
+            options={
+                'verbose_name': 'Архивный заказ',
+                'verbose_name_plural': 'Архивные заказы',
+                'ordering': ('-order_date',),
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedOrderedBook',
+            fields=[
+                ('quantity', models.PositiveSmallIntegerField(verbose_name='Количество')),
+                ('price', models.DecimalField(decimal_places=2, max_digits=7, verbose_name='Цена')),
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+            ],
+            options={
+                'verbose_name': 'Архивная заказанная книга',
+                'verbose_name_plural': 'Архивные заказанные книги',
+                'ordering': ('-order',),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', 'order_date'], name='order_status_date_idx'),
+        ),
+        migrations.AddField(
+            model_name='archivedorderedbook',
+            name='ord_book',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='archived_ordered_books', to='bookshop.book'),
+        ),
+        migrations.AddField(
+            model_name='archivedorderedbook',
+            name='order',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='ord_books', to='bookshop.archivedorder', verbose_name='Номер заказа'),
+        ),
+        migrations.AddField(
+            model_name='archivedorder',
+            name='customer',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_orders', to=settings.AUTH_USER_MODEL, verbose_name='Заказчик'),
+        ),
+        migrations.AddField(
+            model_name='archiveddeliveryaddress',
+            name='order',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='delivery_address', to='bookshop.archivedorder', verbose_name='Номер заказа'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.1 on 2026-10-19 14:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookshop', '0007_catalog_sync'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedorderedbook',
+            name='author',
+            field=models.CharField(blank=True, default='', verbose_name='Автор'),
+        ),
+        migrations.AddField(
+            model_name='archivedorderedbook',
+            name='image',
+            field=models.ImageField(blank=True, upload_to='books/', verbose_name='Фотография книги'),
+        ),
+        migrations.AddField(
+            model_name='archivedorderedbook',
+            name='title',
+            field=models.CharField(default='', max_length=150, verbose_name='Название книги'),
+        ),
+        migrations.AddField(
+            model_name='orderedbook',
+            name='author',
+            field=models.CharField(blank=True, default='', verbose_name='Автор'),
+        ),
+        migrations.AddField(
+            model_name='orderedbook',
+            name='image',
+            field=models.ImageField(blank=True, upload_to='books/', verbose_name='Фотография книги'),
+        ),
+        migrations.AddField(
+            model_name='orderedbook',
+            name='title',
+            field=models.CharField(default='', max_length=150, verbose_name='Название книги'),
+        ),
+    ]
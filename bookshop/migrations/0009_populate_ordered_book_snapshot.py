@@ -0,0 +1,34 @@
+from django.db import migrations, transaction
+from django.db.models import Max, Min, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+BATCH_SIZE = 5000
+
+
+def populate_snapshot(apps, schema_editor):
+    Book = apps.get_model('bookshop', 'Book')
+    for model_name in ('OrderedBook', 'ArchivedOrderedBook'):
+        model = apps.get_model('bookshop', model_name)
+        bounds = model.objects.aggregate(first=Min('id'), last=Max('id'))
+        if bounds['first'] is None:
+            continue
+        book = Book.objects.filter(pk=OuterRef('ord_book_id'))
+        for start in range(bounds['first'], bounds['last'] + 1, BATCH_SIZE):
+            with transaction.atomic():
+                model.objects.filter(id__gte=start, id__lt=start + BATCH_SIZE, title='').update(
+                    title=Subquery(book.values('title')[:1]),
+                    author=Coalesce(Subquery(book.values('author')[:1]), Value('')),
+                    image=Subquery(book.values('image')[:1]),
+                )
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('bookshop', '0008_ordered_book_snapshot'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_snapshot, migrations.RunPython.noop),
+    ]
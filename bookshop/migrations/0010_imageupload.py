@@ -0,0 +1,34 @@
+# Generated by Django 4.2.1 on 2026-10-19 14:53
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('bookshop', '0009_populate_ordered_book_snapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageUpload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('file_name', models.CharField(max_length=255, verbose_name='Имя файла')),
+                ('size', models.PositiveIntegerField(verbose_name='Размер файла')),
+                ('received', models.PositiveIntegerField(default=0, verbose_name='Получено байт')),
+                ('image_format', models.CharField(blank=True, default='', max_length=10, verbose_name='Формат изображения')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата начала загрузки')),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='image_uploads', to='bookshop.book', verbose_name='Книга')),
+                ('uploaded_by', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='image_uploads', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Загрузка изображения',
+                'verbose_name_plural': 'Загрузки изображений',
+            },
+        ),
+    ]
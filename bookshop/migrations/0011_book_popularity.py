@@ -0,0 +1,39 @@
+# Generated by Django 4.2.1 on 2026-10-19 14:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookshop', '0010_imageupload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='average_rating',
+            field=models.FloatField(default=0, verbose_name='Средний рейтинг'),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='popularity',
+            field=models.FloatField(default=0, verbose_name='Популярность'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(condition=models.Q(('count_in_stock__gt', 0)), fields=['-popularity', 'id'], name='book_popularity_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(condition=models.Q(('count_in_stock__gt', 0)), fields=['-average_rating', 'id'], name='book_rating_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(condition=models.Q(('count_in_stock__gt', 0)), fields=['price', 'id'], name='book_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(condition=models.Q(('count_in_stock__gt', 0)), fields=['-publication_date', 'id'], name='book_publication_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.1 on 2026-10-19 14:57
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookshop', '0011_book_popularity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookViewCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День')),
+                ('views', models.PositiveBigIntegerField(default=0, verbose_name='Просмотры')),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='view_counters', to='bookshop.book', verbose_name='Книга')),
+            ],
+            options={
+                'verbose_name': 'Просмотры книги',
+                'verbose_name_plural': 'Просмотры книг',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='bookviewcounter',
+            constraint=models.UniqueConstraint(fields=('book', 'day'), name='book_view_counter_day_uniq'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.1 on 2026-10-19 14:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookshop', '0012_book_view_counter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlowQuery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.CharField(max_length=40, unique=True, verbose_name='Отпечаток запроса')),
+                ('sql', models.TextField(verbose_name='SQL')),
+                ('view', models.CharField(blank=True, default='', max_length=200, verbose_name='Представление')),
+                ('call_site', models.CharField(blank=True, default='', max_length=500, verbose_name='Место вызова')),
+                ('calls', models.PositiveBigIntegerField(default=0, verbose_name='Количество вызовов')),
+                ('total_time', models.FloatField(default=0, verbose_name='Общее время, мс')),
+                ('max_time', models.FloatField(default=0, verbose_name='Максимальное время, мс')),
+                ('plan', models.JSONField(blank=True, null=True, verbose_name='План запроса')),
+                ('first_seen', models.DateTimeField(verbose_name='Первый вызов')),
+                ('last_seen', models.DateTimeField(verbose_name='Последний вызов')),
+            ],
+            options={
+                'verbose_name': 'Медленный запрос',
+                'verbose_name_plural': 'Медленные запросы',
+                'ordering': ('-total_time',),
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.1 on 2026-10-19 15:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookshop', '0013_slow_query'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='reviews_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Количество отзывов'),
+        ),
+    ]
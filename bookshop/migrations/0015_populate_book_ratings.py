@@ -0,0 +1,35 @@
+from django.db import migrations, transaction
+from django.db.models import Avg, Count, FloatField, Max, Min, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+BATCH_SIZE = 5000
+
+
+def populate_ratings(apps, schema_editor):
+    Book = apps.get_model('bookshop', 'Book')
+    Comments = apps.get_model('bookshop', 'Comments')
+    bounds = Book.objects.aggregate(first=Min('id'), last=Max('id'))
+    if bounds['first'] is None:
+        return
+    comments = Comments.objects.filter(book=OuterRef('pk')).order_by().values('book')
+    ratings = comments.filter(rating__isnull=False).annotate(
+        average=Avg('rating', output_field=FloatField())).values('average')
+    reviews = comments.annotate(number=Count('id')).values('number')
+    for start in range(bounds['first'], bounds['last'] + 1, BATCH_SIZE):
+        with transaction.atomic():
+            Book.objects.filter(id__gte=start, id__lt=start + BATCH_SIZE).update(
+                average_rating=Coalesce(Subquery(ratings), Value(0.0)),
+                reviews_count=Coalesce(Subquery(reviews), Value(0)),
+            )
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('bookshop', '0014_book_reviews_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_ratings, migrations.RunPython.noop),
+    ]
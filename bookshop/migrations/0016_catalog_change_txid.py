@@ -0,0 +1,76 @@
+# Generated by Django 4.2.1 on 2026-10-19 15:33
+
+from django.db import migrations, models
+
+# Rows get the id of the transaction that created them or changed their date of change
+CHANGE_TXID_TABLES = {
+    'bookshop_book': 'INSERT OR UPDATE OF updated_at',
+    'bookshop_publishing': 'INSERT OR UPDATE OF updated_at',
+    'bookshop_tombstone': 'INSERT',
+}
+
+CREATE_FUNCTION = '''
+CREATE FUNCTION bookshop_set_change_txid() RETURNS trigger AS $$
+BEGIN
+    NEW.change_txid := txid_current();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookshop', '0015_populate_book_ratings'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='book',
+            name='book_updated_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='publishing',
+            name='publishing_updated_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='tombstone',
+            name='tombstone_deleted_idx',
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='change_txid',
+            field=models.BigIntegerField(default=0, editable=False, verbose_name='Транзакция изменения'),
+        ),
+        migrations.AddField(
+            model_name='publishing',
+            name='change_txid',
+            field=models.BigIntegerField(default=0, editable=False, verbose_name='Транзакция изменения'),
+        ),
+        migrations.AddField(
+            model_name='tombstone',
+            name='change_txid',
+            field=models.BigIntegerField(default=0, editable=False, verbose_name='Транзакция изменения'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['change_txid', 'id'], name='book_change_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='publishing',
+            index=models.Index(fields=['change_txid', 'id'], name='publishing_change_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tombstone',
+            index=models.Index(fields=['change_txid', 'id'], name='tombstone_change_idx'),
+        ),
+        migrations.RunSQL(CREATE_FUNCTION, 'DROP FUNCTION bookshop_set_change_txid();'),
+    ] + [
+        migrations.RunSQL(
+            f'CREATE TRIGGER {table}_change_txid BEFORE {events} ON {table} '
+            f'FOR EACH ROW EXECUTE FUNCTION bookshop_set_change_txid();',
+            f'DROP TRIGGER {table}_change_txid ON {table};',
+        )
+        for table, events in CHANGE_TXID_TABLES.items()
+    ]
@@ -1,6 +1,15 @@
+import os
+import uuid
+
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.db import models
+from django.contrib.postgres.indexes import OpClass
 from django.core.validators import MinValueValidator, RegexValidator, MaxValueValidator
+from django.db.models.functions import Upper
+
+
+IN_STOCK = models.Q(count_in_stock__gt=0)
 
 
 class InStockManager(models.Manager):
@@ -9,7 +18,7 @@ class InStockManager(models.Manager):
     """
 
     def get_queryset(self):
-        return super().get_queryset().filter(count_in_stock__gt=0)
+        return super().get_queryset().filter(IN_STOCK)
 
 
 class Publishing(models.Model):
@@ -18,6 +27,9 @@ class Publishing(models.Model):
     """
 
     name = models.CharField(max_length=50, verbose_name='Издательство')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата изменения')
+    # Set by a database trigger to the id of the transaction that changed the row, see get_catalog_changes
+    change_txid = models.BigIntegerField(default=0, editable=False, verbose_name='Транзакция изменения')
 
     def __str__(self):
         return self.name
@@ -26,17 +38,47 @@ class Publishing(models.Model):
         verbose_name = 'Издательство'
         verbose_name_plural = 'Издательства'
         ordering = ('name',)
+        indexes = [
+            models.Index(fields=['change_txid', 'id'], name='publishing_change_idx'),
+        ]
+
+
+class Author(models.Model):
+    """
+    Represents a book author consisting author name and surname
+    """
+
+    name = models.CharField(max_length=100, blank=True, default='', verbose_name='Имя')
+    surname = models.CharField(max_length=100, verbose_name='Фамилия')
+
+    def __str__(self):
+        return f'{self.name} {self.surname}'.strip()
+
+    class Meta:
+        verbose_name = 'Автор'
+        verbose_name_plural = 'Авторы'
+        ordering = ('surname', 'name')
+        constraints = [
+            models.UniqueConstraint(fields=['surname', 'name'], name='unique_author_full_name'),
+        ]
+        indexes = [
+            models.Index(fields=['name'], name='author_name_idx'),
+            models.Index(OpClass(Upper('surname'), name='text_pattern_ops'), name='author_surname_prefix_idx'),
+            models.Index(OpClass(Upper('name'), name='text_pattern_ops'), name='author_name_prefix_idx'),
+        ]
 
 
 class Book(models.Model):
     """
     Represents a book consisting book title, book image, book author, publishing, publication date,
-    description, book price, number of books in stock
+    description, book price, number of books in stock, popularity refreshed by refresh_popularity,
+    average rating and number of reviews
     """
 
     title = models.CharField(max_length=150, verbose_name='Название книги')
     image = models.ImageField(upload_to='books/', default='/media/books/default.jpg', verbose_name='Фотография книги')
     author = models.CharField(default='', null=True, verbose_name='Автор')
+    authors = models.ManyToManyField(Author, related_name='books', blank=True, verbose_name='Авторы')
     publishing = models.ForeignKey(Publishing, related_name='publishing_books',
                                    on_delete=models.PROTECT, verbose_name='Издательство')
     publication_date = models.PositiveSmallIntegerField(validators=[MinValueValidator(1990)],
@@ -44,6 +86,11 @@ class Book(models.Model):
     description = models.TextField(max_length=1000, verbose_name='Аннотация к книге')
     price = models.DecimalField(max_digits=7, default=0, decimal_places=2, verbose_name='Цена')
     count_in_stock = models.PositiveIntegerField(default=0, verbose_name='Количество на складе')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата изменения')
+    change_txid = models.BigIntegerField(default=0, editable=False, verbose_name='Транзакция изменения')
+    popularity = models.FloatField(default=0, verbose_name='Популярность')
+    average_rating = models.FloatField(default=0, verbose_name='Средний рейтинг')
+    reviews_count = models.PositiveIntegerField(default=0, verbose_name='Количество отзывов')
     objects = models.Manager()
     in_stock_objects = InStockManager()
 
@@ -53,12 +100,118 @@ class Book(models.Model):
     class Meta:
         verbose_name = 'Книга'
         verbose_name_plural = 'Книги'
+        indexes = [
+            models.Index(OpClass(Upper('title'), name='text_pattern_ops'), name='book_title_prefix_idx'),
+            models.Index(fields=['change_txid', 'id'], name='book_change_idx'),
+            models.Index(fields=['-popularity', 'id'], name='book_popularity_idx', condition=IN_STOCK),
+            models.Index(fields=['-average_rating', 'id'], name='book_rating_idx', condition=IN_STOCK),
+            models.Index(fields=['price', 'id'], name='book_price_idx', condition=IN_STOCK),
+            models.Index(fields=['-publication_date', 'id'], name='book_publication_idx', condition=IN_STOCK),
+        ]
 
 
-class Order(models.Model):
+class BookViewCounter(models.Model):
     """
-    Represents an order consisting customer, order date, status of order, payment method, status of payment,
-    payment date, delivery date, shipping cost, total cost of the order.
+    Represents number of views of the book detail page in one day consisting book, day, number of views.
+    Views are buffered by the worker processes and added in batches, so the recent ones are not counted yet
+    """
+
+    book = models.ForeignKey(Book, related_name='view_counters', on_delete=models.CASCADE, verbose_name='Книга')
+    day = models.DateField(verbose_name='День')
+    views = models.PositiveBigIntegerField(default=0, verbose_name='Просмотры')
+
+    def __str__(self):
+        return f'{self.book_id} {self.day}: {self.views}'
+
+    class Meta:
+        verbose_name = 'Просмотры книги'
+        verbose_name_plural = 'Просмотры книг'
+        constraints = [
+            models.UniqueConstraint(fields=['book', 'day'], name='book_view_counter_day_uniq'),
+        ]
+
+
+class SlowQuery(models.Model):
+    """
+    Represents SQL queries of one shape slower than SLOW_QUERY_THRESHOLD_MS consisting fingerprint, normalized SQL,
+    view and call site of the last one, number of calls, total and maximal time, query plan,
+    dates of first and last call
+    """
+
+    fingerprint = models.CharField(max_length=40, unique=True, verbose_name='Отпечаток запроса')
+    sql = models.TextField(verbose_name='SQL')
+    view = models.CharField(max_length=200, blank=True, default='', verbose_name='Представление')
+    call_site = models.CharField(max_length=500, blank=True, default='', verbose_name='Место вызова')
+    calls = models.PositiveBigIntegerField(default=0, verbose_name='Количество вызовов')
+    total_time = models.FloatField(default=0, verbose_name='Общее время, мс')
+    max_time = models.FloatField(default=0, verbose_name='Максимальное время, мс')
+    plan = models.JSONField(null=True, blank=True, verbose_name='План запроса')
+    first_seen = models.DateTimeField(verbose_name='Первый вызов')
+    last_seen = models.DateTimeField(verbose_name='Последний вызов')
+
+    def __str__(self):
+        return self.fingerprint
+
+    class Meta:
+        verbose_name = 'Медленный запрос'
+        verbose_name_plural = 'Медленные запросы'
+        ordering = ('-total_time',)
+
+
+class ImageUpload(models.Model):
+    """
+    Represents an unfinished chunked upload of a book image consisting book, staff user, file name, file size,
+    number of received bytes, image format, date of start
+    """
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    book = models.ForeignKey(Book, related_name='image_uploads', on_delete=models.CASCADE, verbose_name='Книга')
+    uploaded_by = models.ForeignKey(User, related_name='image_uploads', on_delete=models.CASCADE,
+                                    verbose_name='Пользователь')
+    file_name = models.CharField(max_length=255, verbose_name='Имя файла')
+    size = models.PositiveIntegerField(verbose_name='Размер файла')
+    received = models.PositiveIntegerField(default=0, verbose_name='Получено байт')
+    image_format = models.CharField(max_length=10, blank=True, default='', verbose_name='Формат изображения')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата начала загрузки')
+
+    def __str__(self):
+        return f'{self.file_name} ({self.received}/{self.size})'
+
+    @property
+    def temp_path(self):
+        return os.path.join(settings.UPLOAD_TEMP_DIR, f'{self.id}.part')
+
+    class Meta:
+        verbose_name = 'Загрузка изображения'
+        verbose_name_plural = 'Загрузки изображений'
+
+
+class Tombstone(models.Model):
+    """
+    Represents a deleted book or publishing house consisting object type, object id, date of deletion
+    """
+
+    OBJECT_TYPES = [('book', 'Книга'), ('publishing', 'Издательство')]
+
+    object_type = models.CharField(max_length=20, choices=OBJECT_TYPES, verbose_name='Тип объекта')
+    object_id = models.BigIntegerField(verbose_name='Идентификатор объекта')
+    deleted_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата удаления')
+    change_txid = models.BigIntegerField(default=0, editable=False, verbose_name='Транзакция изменения')
+
+    def __str__(self):
+        return f'{self.object_type} {self.object_id}'
+
+    class Meta:
+        verbose_name = 'Удаленный объект'
+        verbose_name_plural = 'Удаленные объекты'
+        indexes = [
+            models.Index(fields=['change_txid', 'id'], name='tombstone_change_idx'),
+        ]
+
+
+class OrderBase(models.Model):
+    """
+    Represents fields shared by current and archived orders
     """
 
     STATUS = [('В работе', 'В работе'),
@@ -66,9 +219,6 @@ class Order(models.Model):
               ('Доставлен', 'Доставлен'),
               ('Отменен', 'Отменен')]
 
-    customer = models.ForeignKey(User, related_name='customer_orders', on_delete=models.CASCADE,
-                                 verbose_name='Заказчик')
-    order_date = models.DateTimeField(auto_now_add=True, verbose_name='Дата заказа')
     status = models.CharField(choices=STATUS, default='В работе', verbose_name='Статус заказа')
     is_paid = models.BooleanField(default=False, verbose_name='Статус оплаты')
     pay_date = models.DateTimeField(null=True, blank=True, verbose_name='Дата оплаты')
@@ -77,23 +227,74 @@ class Order(models.Model):
     total_cost = models.DecimalField(max_digits=7, decimal_places=2, default=0, verbose_name='Цена заказа с учетом доставки')
     payment_method = models.CharField(default='Card', verbose_name='Способ оплаты')
 
+    class Meta:
+        abstract = True
+
+    def __str__(self):
+        return f'Заказ {self.pk}'
+
+
+class Order(OrderBase):
+    """
+    Represents an order consisting customer, order date, status of order, payment method, status of payment,
+    payment date, delivery date, shipping cost, total cost of the order.
+    """
+
+    customer = models.ForeignKey(User, related_name='customer_orders', on_delete=models.CASCADE,
+                                 verbose_name='Заказчик')
+    order_date = models.DateTimeField(auto_now_add=True, verbose_name='Дата заказа')
+
     class Meta:
         verbose_name = 'Заказ'
         verbose_name_plural = 'Заказы'
         ordering = ('-order_date',)
+        indexes = [
+            models.Index(fields=['status', 'order_date'], name='order_status_date_idx'),
+        ]
+
+
+class ArchivedOrder(OrderBase):
+    """
+    Represents a delivered or cancelled order moved to the archive. Keeps the id of the original order
+    """
+
+    id = models.BigIntegerField(primary_key=True)
+    customer = models.ForeignKey(User, related_name='archived_orders', on_delete=models.CASCADE,
+                                 verbose_name='Заказчик')
+    order_date = models.DateTimeField(db_index=True, verbose_name='Дата заказа')
+    archived_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата архивации')
+
+    class Meta:
+        verbose_name = 'Архивный заказ'
+        verbose_name_plural = 'Архивные заказы'
+        ordering = ('-order_date',)
+
+
+class OrderedBookBase(models.Model):
+    """
+    Represents fields shared by books of current and archived orders. Title, author and image are copied from the book
+    when the order is placed, so that the order does not change with the catalog
+    """
+
+    title = models.CharField(max_length=150, default='', verbose_name='Название книги')
+    author = models.CharField(default='', blank=True, verbose_name='Автор')
+    image = models.ImageField(upload_to='books/', blank=True, verbose_name='Фотография книги')
+    quantity = models.PositiveSmallIntegerField(verbose_name='Количество')
+    price = models.DecimalField(max_digits=7, decimal_places=2, verbose_name='Цена')
+
+    class Meta:
+        abstract = True
 
     def __str__(self):
-        return f'Заказ {self.pk}'
+        return self.title
 
 
-class OrderedBook(models.Model):
+class OrderedBook(OrderedBookBase):
     """
     Represents the book added to the order consisting ordered book, quantity of books, book price, order
     """
 
     ord_book = models.ForeignKey(Book, on_delete=models.PROTECT, related_name='ordered_books')
-    quantity = models.PositiveSmallIntegerField(verbose_name='Количество')
-    price = models.DecimalField(max_digits=7, decimal_places=2, verbose_name='Цена')
     order = models.ForeignKey(Order, on_delete=models.CASCADE, null=True, related_name='ord_books',
                               verbose_name='Номер заказа')
 
@@ -102,29 +303,67 @@ class OrderedBook(models.Model):
         verbose_name_plural = 'Заказанные книги'
         ordering = ('-order',)
 
-    def __str__(self):
-        return self.ord_book.title
 
+class ArchivedOrderedBook(OrderedBookBase):
+    """
+    Represents the book of an archived order. Keeps the id of the original ordered book
+    """
+
+    id = models.BigIntegerField(primary_key=True)
+    ord_book = models.ForeignKey(Book, on_delete=models.PROTECT, related_name='archived_ordered_books')
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE, null=True, related_name='ord_books',
+                              verbose_name='Номер заказа')
 
-class DeliveryAddress(models.Model):
+    class Meta:
+        verbose_name = 'Архивная заказанная книга'
+        verbose_name_plural = 'Архивные заказанные книги'
+        ordering = ('-order',)
+
+
+class DeliveryAddressBase(models.Model):
     """
-    Represents a delivery address consisting order, address, phone number of customer
+    Represents fields shared by delivery addresses of current and archived orders
     """
 
-    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='delivery_address', verbose_name='Номер заказа')
     address = models.TextField(max_length=250, verbose_name='Адрес заказа')
     phone_number_regex = RegexValidator(regex=r"^\+?1?\d{8,15}$")
     phone_number = models.CharField(validators=[phone_number_regex], blank=True, max_length=16, verbose_name='Номер телефона')
 
+    class Meta:
+        abstract = True
+
     def __str__(self):
         return f'{self.address}, {self.phone_number}'
 
+
+class DeliveryAddress(DeliveryAddressBase):
+    """
+    Represents a delivery address consisting order, address, phone number of customer
+    """
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='delivery_address', verbose_name='Номер заказа')
+
     class Meta:
         verbose_name = 'Адрес доставки'
         verbose_name_plural = 'Адреса доставок'
         ordering = ('-order',)
 
 
+class ArchivedDeliveryAddress(DeliveryAddressBase):
+    """
+    Represents a delivery address of an archived order. Keeps the id of the original address
+    """
+
+    id = models.BigIntegerField(primary_key=True)
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE, related_name='delivery_address',
+                              verbose_name='Номер заказа')
+
+    class Meta:
+        verbose_name = 'Архивный адрес доставки'
+        verbose_name_plural = 'Архивные адреса доставок'
+        ordering = ('-order',)
+
+
 class Comments(models.Model):
     """
     Represents a user comment consisting commented book, book rating, comment author, comment, date of comment
@@ -0,0 +1,20 @@
+import msgpack
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+from .renderers import decode_msgpack_ext
+
+
+class MessagePackParser(BaseParser):
+    """
+    Parses MessagePack request bodies, decoding decimals of extension type 1 and timestamps to aware datetimes
+    """
+
+    media_type = 'application/msgpack'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), ext_hook=decode_msgpack_ext, timestamp=3, raw=False,
+                                   strict_map_key=False)
+        except (ValueError, TypeError, ArithmeticError, msgpack.UnpackException) as exc:
+            raise ParseError(f'MessagePack parse error - {exc}')
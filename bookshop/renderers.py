@@ -0,0 +1,141 @@
+import datetime
+import uuid
+import zlib
+from decimal import Decimal
+
+import msgpack
+from django.utils.functional import Promise
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STREAM_CHUNK_SIZE = 16 * 1024
+
+MSGPACK_DECIMAL_EXT = 1
+
+
+class StreamingJSONRenderer(JSONRenderer):
+    """
+    Renders a JSON array item by item, so that the response can be sent before the whole list is serialized
+    """
+
+    def render_iter(self, items, renderer_context=None):
+        buffer = bytearray(b'[')
+        separator = b''
+        for item in items:
+            buffer += separator + self.render(item, renderer_context=renderer_context)
+            separator = b','
+            if len(buffer) >= STREAM_CHUNK_SIZE:
+                yield bytes(buffer)
+                buffer.clear()
+        buffer += b']'
+        yield bytes(buffer)
+
+
+def encode_msgpack_ext(value):
+    """
+    Encodes values MessagePack has no type for: Decimal as extension type 1 holding its digits,
+    dates, naive datetimes, UUIDs and lazy strings as strings, the same as in JSON
+    """
+    if isinstance(value, Decimal):
+        return msgpack.ExtType(MSGPACK_DECIMAL_EXT, str(value).encode())
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (uuid.UUID, Promise)):
+        return str(value)
+    raise TypeError(f'Object of type {type(value).__name__} can not be encoded to MessagePack')
+
+
+def decode_msgpack_ext(code, data):
+    if code == MSGPACK_DECIMAL_EXT:
+        return Decimal(data.decode())
+    return msgpack.ExtType(code, data)
+
+
+class MessagePackRenderer(BaseRenderer):
+    """
+    Renders MessagePack for internal services. Decimals are encoded as extension type 1 and aware datetimes
+    as the standard timestamp extension, serializers built on NativeTypesModelSerializer pass them unformatted
+    """
+
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+    native_types = True
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=encode_msgpack_ext, use_bin_type=True, datetime=True)
+
+
+def negotiate_encoding(request):
+    """
+    Returns the best content encoding accepted by the client, or None
+    """
+    accepted = {}
+    for part in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        coding, _, params = part.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                continue
+        accepted[coding.strip().lower()] = quality
+
+    supported = ['br', 'gzip'] if brotli is not None else ['gzip']
+    for coding in supported:
+        if accepted.get(coding, accepted.get('*', 0)) > 0:
+            return coding
+    return None
+
+
+def _gzip_stream(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _brotli_stream(chunks):
+    compressor = brotli.Compressor(quality=4)
+    for chunk in chunks:
+        data = compressor.process(chunk) + compressor.flush()
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+def compress_stream(chunks, encoding, min_size):
+    """
+    Compresses the stream of chunks with the given encoding when it is at least min_size bytes long.
+    Reads ahead only until min_size bytes are buffered.
+    Returns the stream and the encoding really applied, None for an uncompressed stream
+    """
+    chunks = iter(chunks)
+    head = []
+    size = 0
+    for chunk in chunks:
+        head.append(chunk)
+        size += len(chunk)
+        if size >= min_size:
+            break
+    else:
+        return iter(head), None
+
+    def stream():
+        yield from head
+        yield from chunks
+
+    if encoding == 'br':
+        return _brotli_stream(stream()), encoding
+    if encoding == 'gzip':
+        return _gzip_stream(stream()), encoding
+    return stream(), None
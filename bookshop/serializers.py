@@ -1,24 +1,75 @@
+from datetime import datetime
+from decimal import Decimal
+
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.db import models
+from drf_yasg.utils import swagger_serializer_method
 from rest_framework import serializers
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
 from rest_framework_simplejwt.tokens import RefreshToken
 
-from .models import Book, Publishing, Order, OrderedBook, Comments, DeliveryAddress
+from .cache import publishing_cache
+from .metrics import TOKENS_ISSUED
+from .models import Book, Publishing, Order, OrderedBook, Comments, DeliveryAddress, Author, ImageUpload, SlowQuery
+from .service import sync_book_authors
+
+
+def renders_native_types(context):
+    """
+    Returns True if the response is rendered by a renderer encoding decimals and datetimes natively
+    """
+    renderer = getattr(context.get('request'), 'accepted_renderer', None)
+    return getattr(renderer, 'native_types', False)
+
+
+class NativeDecimalField(serializers.DecimalField):
+    """
+    Returns Decimal instead of a string to renderers with native types
+    """
 
+    def to_representation(self, value):
+        representation = super().to_representation(value)
+        if isinstance(representation, str) and renders_native_types(self.context):
+            return Decimal(representation)
+        return representation
 
-class BookListSerializer(serializers.ModelSerializer):
+
+class NativeDateTimeField(serializers.DateTimeField):
     """
-    Returns list of books consisting book id, book title, book image, book price, average rating, number of reviews
+    Returns datetime in the current time zone instead of a formatted string to renderers with native types
+    """
+
+    def to_representation(self, value):
+        if isinstance(value, datetime) and renders_native_types(self.context):
+            return self.enforce_timezone(value)
+        return super().to_representation(value)
+
+
+class NativeTypesModelSerializer(serializers.ModelSerializer):
+    """
+    Model serializer passing decimals and datetimes unformatted to renderers with native types, e.g. MessagePack.
+    JSON output is not changed
+    """
+
+    serializer_field_mapping = {
+        **serializers.ModelSerializer.serializer_field_mapping,
+        models.DecimalField: NativeDecimalField,
+        models.DateTimeField: NativeDateTimeField,
+    }
+
+
+class BookListSerializer(NativeTypesModelSerializer):
+    """
+    Returns list of books consisting book id, book title, book image, book price, average rating, number of reviews.
+    Rating and reviews are the values stored in the book, rating is None for a book without reviews
     """
 
     rating = serializers.SerializerMethodField(read_only=True, required=None)
-    reviews = serializers.SerializerMethodField(read_only=True, required=None)
+    reviews = serializers.IntegerField(source='reviews_count', read_only=True)
 
     def get_rating(self, instance):
-        return instance.rating
-
-    def get_reviews(self, instance):
-        return instance.reviews
+        return instance.average_rating if instance.reviews_count else None
 
     class Meta:
         model = Book
@@ -36,6 +87,17 @@ class BookCreateSerializer(serializers.ModelSerializer):
         fields = ['id', 'title', 'image', 'author', 'publishing', 'publication_date', 'description',
                   'count_in_stock', 'price']
 
+    def create(self, validated_data):
+        book = super().create(validated_data)
+        sync_book_authors(book)
+        return book
+
+    def update(self, instance, validated_data):
+        book = super().update(instance, validated_data)
+        if 'author' in validated_data:
+            sync_book_authors(book)
+        return book
+
 
 class CommentCreateSerializer(serializers.ModelSerializer):
     """
@@ -70,43 +132,112 @@ class PublishingDetailSerializer(serializers.ModelSerializer):
         fields = ['id', 'name']
 
 
-class BookDetailSerializer(serializers.ModelSerializer):
+class BookSyncSerializer(serializers.ModelSerializer):
+    """
+    Returns the changed book for catalog synchronization consisting id, book title, image, author, publishing,
+    publication date, description, book price, number of books in stock, date of change
+    """
+
+    class Meta:
+        model = Book
+        fields = ['id', 'title', 'image', 'author', 'publishing', 'publication_date', 'description', 'price',
+                  'count_in_stock', 'updated_at']
+
+
+class CatalogChangesSerializer(serializers.Serializer):
+    """
+    Returns catalog changes consisting changed books, changed publishing houses, ids of deleted books and publishing
+    houses, the token to ask for next changes, whether more changes are waiting
+    """
+
+    token = serializers.CharField()
+    has_more = serializers.BooleanField()
+    books = BookSyncSerializer(many=True)
+    publishing_houses = PublishingDetailSerializer(many=True)
+    deleted = serializers.DictField(child=serializers.ListField(child=serializers.IntegerField()))
+
+
+class ImageUploadSerializer(serializers.ModelSerializer):
+    """
+    Returns the chunked upload of the book image consisting upload id, book, file name, file size,
+    number of received bytes, image format
+    """
+
+    class Meta:
+        model = ImageUpload
+        fields = ['id', 'book', 'file_name', 'size', 'received', 'image_format']
+        read_only_fields = ['received', 'image_format']
+
+
+class SlowQuerySerializer(serializers.ModelSerializer):
     """
-    Returns information about the book consisting id, book title, image, author, publishing, description, book price,
-    publication date, average rating, number of reviews, book comments, number of books in stock
+    Returns statistics of slow queries of one shape consisting fingerprint, normalized SQL, view and call site
+    of the last query, number of calls, total and maximal time in milliseconds, dates of first and last call
     """
 
-    publishing = PublishingDetailSerializer()
+    class Meta:
+        model = SlowQuery
+        fields = ['fingerprint', 'sql', 'view', 'call_site', 'calls', 'total_time', 'max_time', 'first_seen',
+                  'last_seen']
+
+
+class SlowQueryDetailSerializer(SlowQuerySerializer):
+    """
+    Returns statistics of slow queries of one shape together with the last captured query plan
+    """
+
+    class Meta(SlowQuerySerializer.Meta):
+        fields = SlowQuerySerializer.Meta.fields + ['plan']
+
+
+class AuthorSerializer(serializers.ModelSerializer):
+    """
+    Returns list of authors consisting id, author name, author surname, number of books
+    """
+
+    books_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Author
+        fields = ['id', 'name', 'surname', 'books_count']
+
+
+class BookDetailSerializer(NativeTypesModelSerializer):
+    """
+    Returns information about the book consisting id, book title, image, author, authors, publishing, description,
+    book price, publication date, average rating, number of reviews, book comments, number of books in stock
+    """
+
+    publishing = serializers.SerializerMethodField()
+    authors = AuthorSerializer(many=True, read_only=True)
     book_comments = CommentListSerializer(many=True)
     rating = serializers.SerializerMethodField()
-    reviews = serializers.SerializerMethodField()
+    reviews = serializers.IntegerField(source='reviews_count', read_only=True)
 
-    def get_rating(self, instance):
-        return instance.rating
+    @swagger_serializer_method(serializer_or_field=PublishingDetailSerializer)
+    def get_publishing(self, instance):
+        return PublishingDetailSerializer(publishing_cache.get(instance.publishing_id)).data
 
-    def get_reviews(self, instance):
-        return instance.reviews
+    def get_rating(self, instance):
+        return instance.average_rating if instance.reviews_count else None
 
     class Meta:
         model = Book
-        fields = ['id', 'title', 'rating', 'reviews', 'image', 'author', 'publishing', 'description', 'price',
-                  'book_comments', 'publication_date', 'count_in_stock']
+        fields = ['id', 'title', 'rating', 'reviews', 'image', 'author', 'authors', 'publishing', 'description',
+                  'price', 'book_comments', 'publication_date', 'count_in_stock']
 
 
-class OrderedBookSerializer(serializers.ModelSerializer):
+class OrderedBookSerializer(NativeTypesModelSerializer):
     """
-    Returns list of ordered books consisting ordered book id, book, book title, image, price, quantity of books
+    Returns list of ordered books consisting ordered book id, book, book title, author, image, price,
+    quantity of books as they were when the order was placed
     """
 
-    book_image = serializers.ImageField(source='ord_book.image')
-    title = serializers.SerializerMethodField()
+    book_image = serializers.ImageField(source='image')
 
     class Meta:
         model = OrderedBook
-        fields = ['id', 'title', 'ord_book', 'book_image', 'price', 'quantity']
-
-    def get_title(self, instance):
-        return instance.ord_book.title
+        fields = ['id', 'title', 'author', 'ord_book', 'book_image', 'price', 'quantity']
 
 
 class DeliveryAddressSerializer(serializers.ModelSerializer):
@@ -134,22 +265,22 @@ class CustomerSerializer(serializers.ModelSerializer):
         return instance.is_staff
 
 
-class OrderListSerializer(serializers.ModelSerializer):
+class OrderListSerializer(NativeTypesModelSerializer):
     """
     Returns list of orders consisting order id, customer, order date, payment date, order status,
     payment status, total cost of the order
     """
 
     customer = CustomerSerializer()
-    order_date = serializers.DateTimeField(format='%d/%m/%y', read_only=True)
-    pay_date = serializers.DateTimeField(format='%d/%m/%y', read_only=True)
+    order_date = NativeDateTimeField(format='%d/%m/%y', read_only=True)
+    pay_date = NativeDateTimeField(format='%d/%m/%y', read_only=True)
 
     class Meta:
         model = Order
         fields = ['id', 'customer', 'order_date', 'pay_date', 'status', 'is_paid', 'total_cost']
 
 
-class OrderDetailSerializer(serializers.ModelSerializer):
+class OrderDetailSerializer(NativeTypesModelSerializer):
     """
     Returns information about the order consisting order id, customer, order date, order status, payment status,
     payment date, payment method, delivery date, shipping cost, total cost of the order, delivery address,
@@ -157,11 +288,11 @@ class OrderDetailSerializer(serializers.ModelSerializer):
     """
 
     customer = CustomerSerializer()
-    order_date = serializers.DateTimeField(format='%d/%m/%Y %H:%M', read_only=True)
+    order_date = NativeDateTimeField(format='%d/%m/%Y %H:%M', read_only=True)
     ord_books = OrderedBookSerializer(many=True, read_only=True)
     delivery_address = DeliveryAddressSerializer(many=True)
-    delivery_date = serializers.DateTimeField(format='%d/%m/%y')
-    pay_date = serializers.DateTimeField(format='%d/%m/%y', read_only=True)
+    delivery_date = NativeDateTimeField(format='%d/%m/%y')
+    pay_date = NativeDateTimeField(format='%d/%m/%y', read_only=True)
 
     class Meta:
         model = Order
@@ -169,6 +300,88 @@ class OrderDetailSerializer(serializers.ModelSerializer):
                   'delivery_date', 'shipping_cost', 'total_cost', 'delivery_address', 'ord_books']
 
 
+class OrderBulkUpdateSerializer(serializers.Serializer):
+    """
+    Validates a change of one order in the bulk update consisting order id, order status, payment status
+    """
+
+    id = serializers.IntegerField()
+    status = serializers.ChoiceField(choices=Order.STATUS, required=False)
+    is_paid = serializers.BooleanField(required=False)
+
+    def validate(self, attrs):
+        if 'status' not in attrs and 'is_paid' not in attrs:
+            raise serializers.ValidationError('Не указан статус заказа или статус оплаты')
+        return attrs
+
+
+class BatchSubRequestSerializer(serializers.Serializer):
+    """
+    Validates a sub-request of the batch consisting HTTP method, path with query string, request body
+    """
+
+    method = serializers.ChoiceField(choices=['GET', 'POST', 'PUT', 'PATCH', 'DELETE'], default='GET')
+    path = serializers.CharField()
+    body = serializers.JSONField(required=False, allow_null=True)
+
+
+class BatchSerializer(serializers.Serializer):
+    """
+    Validates the batch consisting list of sub-requests and parallel execution flag
+    """
+
+    requests = BatchSubRequestSerializer(many=True, allow_empty=False,
+                                         max_length=settings.BOOKSHOP_BATCH_MAX_REQUESTS)
+    parallel = serializers.BooleanField(default=False)
+
+
+class OrderItemSerializer(serializers.Serializer):
+    """
+    Validates an item of the cart consisting book id, quantity of books
+    """
+
+    book = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1, max_value=32767)
+
+
+class QuoteRequestSerializer(serializers.Serializer):
+    """
+    Validates the cart consisting list of order items
+    """
+
+    orderItems = OrderItemSerializer(many=True, allow_empty=False,
+                                     error_messages={'empty': 'Товар не выбран'})
+
+
+class QuoteLineSerializer(serializers.Serializer):
+    """
+    Returns a priced order line consisting book id, book title, book price, quantity of books, number of books in stock,
+    line total, availability of the line
+    """
+
+    book = serializers.IntegerField()
+    title = serializers.CharField()
+    price = serializers.DecimalField(max_digits=7, decimal_places=2)
+    quantity = serializers.IntegerField()
+    count_in_stock = serializers.IntegerField()
+    line_total = serializers.DecimalField(max_digits=9, decimal_places=2)
+    is_available = serializers.BooleanField()
+
+
+class QuoteSerializer(serializers.Serializer):
+    """
+    Returns the quote of the cart consisting order lines, items price, shipping price, total price,
+    ids of missing books, availability of the whole cart
+    """
+
+    items = QuoteLineSerializer(many=True)
+    items_price = serializers.DecimalField(max_digits=9, decimal_places=2)
+    shipping_price = serializers.DecimalField(max_digits=7, decimal_places=2)
+    total_price = serializers.DecimalField(max_digits=9, decimal_places=2)
+    missing_books = serializers.ListField(child=serializers.IntegerField())
+    is_available = serializers.BooleanField()
+
+
 class CustomerSerializerWithToken(CustomerSerializer):
     """
     Returns information about the customer consisting customer id, username, email, staff status, JWT token
@@ -197,4 +410,16 @@ class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
         for key, value in serializer.items():
             data[key] = value
 
+        TOKENS_ISSUED.labels('obtain').inc()
+        return data
+
+
+class MyTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Validates refresh token and returns a new access token
+    """
+
+    def validate(self, attrs):
+        data = super().validate(attrs)
+        TOKENS_ISSUED.labels('refresh').inc()
         return data
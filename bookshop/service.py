@@ -1,6 +1,47 @@
-from django_filters.rest_framework import FilterSet, BaseInFilter, CharFilter, NumberFilter, NumericRangeFilter
+import hashlib
+import re
+from datetime import timedelta
+from decimal import Decimal
 
-from .models import Book
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Avg, Case, Count, DateTimeField, F, FloatField, Func, Max, Min, OuterRef, Q, Subquery, Sum, \
+    Value, When
+from django.db.models.functions import Cast, Coalesce, Now, Power
+from django.utils import timezone
+from django_filters import utils
+from django_filters.rest_framework import FilterSet, BaseInFilter, CharFilter, NumberFilter, RangeFilter
+
+from .events import stock_changed
+from .metrics import record_cache
+from .models import (Book, Author, Order, OrderedBook, DeliveryAddress, ArchivedOrder, ArchivedOrderedBook,
+                     ArchivedDeliveryAddress, Publishing, Tombstone, Comments, BookViewCounter, OrderBase)
+
+CATALOG_VERSION_KEY = 'bookshop:catalog-version'
+
+ORDER_DELIVERED_STATUS = 'Доставлен'
+
+ORDER_CANCELLED_STATUS = 'Отменен'
+
+ORDER_ARCHIVE_STATUSES = (ORDER_DELIVERED_STATUS, ORDER_CANCELLED_STATUS)
+
+# The largest total cost an order can store
+ORDER_MAX_TOTAL = Decimal(10) ** (OrderBase._meta.get_field('total_cost').max_digits -
+                                  OrderBase._meta.get_field('total_cost').decimal_places) - Decimal('0.01')
+
+# Position of the catalog changes consisting transaction id, rank of the stream, object id
+SYNC_START = (0, 0, 0)
+
+PRICE_FACET_BUCKETS = ((0, 500), (500, 1000), (1000, 2000), (2000, None))
+
+AUTHOR_SEPARATORS = re.compile(r'\s*(?:,|;|&|\s+и\s+|\s+and\s+)\s*', re.IGNORECASE)
+
+FACET_FILTER_PARAMS = {
+    'publishing': ('publishing',),
+    'publication_date': ('publication_date_min', 'publication_date_max'),
+    'price': ('min_price', 'max_price'),
+}
 
 
 class CharFilterInFilter(BaseInFilter, CharFilter):
@@ -9,13 +50,378 @@ class CharFilterInFilter(BaseInFilter, CharFilter):
 
 class BookFilter(FilterSet):
     title = CharFilterInFilter(field_name='title', lookup_expr='in')
-    author_name = CharFilterInFilter(field_name='author__name', lookup_expr='in')
-    author_surname = CharFilterInFilter(field_name='author__surname', lookup_expr='in')
+    author_name = CharFilterInFilter(field_name='authors__name', lookup_expr='in', distinct=True)
+    author_surname = CharFilterInFilter(field_name='authors__surname', lookup_expr='in', distinct=True)
     publishing = CharFilterInFilter(field_name='publishing__name', lookup_expr='in')
     min_price = NumberFilter(field_name='price', lookup_expr='gte')
     max_price = NumberFilter(field_name='price', lookup_expr='lte')
-    publication_date = NumericRangeFilter()
+    publication_date = RangeFilter()
 
     class Meta:
         model = Book
         fields = ['title', 'author_name', 'author_surname', 'publishing', 'min_price', 'max_price', 'publication_date']
+
+
+def split_author_names(value):
+    """
+    Splits the free-text author of the book into (name, surname) pairs.
+    Supports "Name Surname", "Surname N.N." and a single surname, separated by commas, semicolons or "и"
+    """
+    authors = []
+    for part in AUTHOR_SEPARATORS.split(value or ''):
+        tokens = part.split()
+        if not tokens:
+            continue
+        if len(tokens) == 1:
+            authors.append(('', tokens[0]))
+        elif tokens[-1].endswith('.'):
+            authors.append((' '.join(tokens[1:]), tokens[0]))
+        else:
+            authors.append((' '.join(tokens[:-1]), tokens[-1]))
+    return authors
+
+
+def sync_book_authors(book):
+    """
+    Links the book to the authors listed in its author field, creating missing authors
+    """
+    authors = [Author.objects.get_or_create(name=name, surname=surname)[0]
+               for name, surname in split_author_names(book.author)]
+    book.authors.set(authors)
+
+
+def get_catalog_version():
+    """
+    Returns the current catalog version used to namespace cached catalog data
+    """
+    return cache.get_or_set(CATALOG_VERSION_KEY, 1, timeout=None)
+
+
+def bump_catalog_version():
+    """
+    Invalidates cached catalog data by moving to the next catalog version
+    """
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        cache.set(CATALOG_VERSION_KEY, 2, timeout=None)
+
+
+def _normalize_params(params, scope):
+    items = []
+    for key in sorted(params.keys()):
+        if key == 'facets':
+            continue
+        values = sorted(value for raw in params.getlist(key) for value in raw.split(','))
+        items.append(f'{key}={",".join(values)}')
+    return f'{scope}?{"&".join(items)}'
+
+
+def _filter_for_facet(queryset, params, facet):
+    data = params.copy()
+    for key in FACET_FILTER_PARAMS[facet]:
+        data.pop(key, None)
+    filterset = BookFilter(data=data, queryset=queryset)
+    if not filterset.is_valid():
+        raise utils.translate_validation(filterset.errors)
+    return filterset.qs.order_by()
+
+
+def get_book_facets(queryset, params, scope=''):
+    """
+    Returns numbers of books per publishing house, per publication year and per price bucket.
+    Every facet respects all active filters except its own one, so that the other values stay selectable.
+    """
+    digest = hashlib.sha1(_normalize_params(params, scope).encode()).hexdigest()
+    cache_key = f'bookshop:facets:{get_catalog_version()}:{digest}'
+    facets = cache.get(cache_key)
+    record_cache('facets', facets is not None)
+    if facets is not None:
+        return facets
+
+    publishing = _filter_for_facet(queryset, params, 'publishing').values(
+        'publishing__id', 'publishing__name').annotate(count=Count('id', distinct=True)).order_by('publishing__name')
+    years = _filter_for_facet(queryset, params, 'publication_date').values(
+        'publication_date').annotate(count=Count('id', distinct=True)).order_by('publication_date')
+    price_counts = _filter_for_facet(queryset, params, 'price').aggregate(**{
+        f'bucket_{index}': Count('id', distinct=True, filter=Q(price__gte=low) & (
+            Q(price__lt=high) if high is not None else Q()))
+        for index, (low, high) in enumerate(PRICE_FACET_BUCKETS)
+    })
+
+    facets = {
+        'publishing': [{'id': item['publishing__id'], 'name': item['publishing__name'], 'count': item['count']}
+                       for item in publishing],
+        'publication_date': [{'year': item['publication_date'], 'count': item['count']} for item in years],
+        'price': [{'min': low, 'max': high, 'count': price_counts[f'bucket_{index}']}
+                  for index, (low, high) in enumerate(PRICE_FACET_BUCKETS)],
+    }
+    cache.set(cache_key, facets, settings.BOOKSHOP_FACETS_CACHE_TIMEOUT)
+    return facets
+
+
+def bulk_update_orders(changes):
+    """
+    Applies status and payment changes to many orders with set-based updates inside one transaction.
+    Takes validated changes consisting order id, target status and/or target payment status. When an order
+    is changed several times, the later value of every field wins.
+    Returns a mapping of order id to "updated" or "not_found"
+    """
+    merged = {}
+    for change in changes:
+        merged.setdefault(change['id'], {}).update(change)
+
+    by_status = {}
+    by_payment = {True: [], False: []}
+    for order_id, change in merged.items():
+        if 'status' in change:
+            by_status.setdefault(change['status'], []).append(order_id)
+        if 'is_paid' in change:
+            by_payment[change['is_paid']].append(order_id)
+
+    now = timezone.now()
+    with transaction.atomic():
+        existing = set(Order.objects.select_for_update().filter(id__in=merged).values_list('id', flat=True))
+        for status_value, status_ids in by_status.items():
+            fields = {'status': status_value}
+            if status_value == ORDER_DELIVERED_STATUS:
+                fields['delivery_date'] = Coalesce('delivery_date', Value(now))
+            Order.objects.filter(id__in=status_ids).update(**fields)
+        if by_payment[True]:
+            Order.objects.filter(id__in=by_payment[True]).update(
+                is_paid=True, pay_date=Coalesce('pay_date', Value(now)))
+        if by_payment[False]:
+            Order.objects.filter(id__in=by_payment[False]).update(is_paid=False, pay_date=None)
+
+    return {order_id: 'updated' if order_id in existing else 'not_found' for order_id in merged}
+
+
+def build_quote(order_items, lock=False):
+    """
+    Prices the cart by current book prices and stock with one query.
+    Takes validated order items consisting book id and quantity, locks the books when the quote is used to place
+    an order. Returns order lines consisting book, title, author, image, price, quantity, number of books in stock,
+    line total, availability, and items price, shipping price, total price, ids of missing books, availability of the whole cart
+    """
+    quantities = {}
+    for item in order_items:
+        quantities[item['book']] = quantities.get(item['book'], 0) + item['quantity']
+
+    books = Book.objects.filter(id__in=quantities).order_by('id')
+    if lock:
+        books = books.select_for_update()
+    books = {book.id: book for book in books}
+
+    lines = []
+    for book_id, quantity in quantities.items():
+        book = books.get(book_id)
+        if book is None:
+            continue
+        lines.append({
+            'book': book.id,
+            'title': book.title,
+            'author': book.author or '',
+            'image': book.image.name,
+            'price': book.price,
+            'quantity': quantity,
+            'count_in_stock': book.count_in_stock,
+            'line_total': book.price * quantity,
+            'is_available': quantity <= book.count_in_stock,
+        })
+
+    items_price = sum((line['line_total'] for line in lines), Decimal('0'))
+    if not lines or items_price >= settings.BOOKSHOP_FREE_SHIPPING_FROM:
+        shipping_price = Decimal('0')
+    else:
+        shipping_price = settings.BOOKSHOP_SHIPPING_PRICE
+    missing_books = [book_id for book_id in quantities if book_id not in books]
+
+    return {
+        'items': lines,
+        'items_price': items_price,
+        'shipping_price': shipping_price,
+        'total_price': items_price + shipping_price,
+        'missing_books': missing_books,
+        'is_available': bool(lines) and not missing_books and all(line['is_available'] for line in lines),
+    }
+
+
+def reserve_books(lines):
+    """
+    Decreases number of books in stock for all order lines with one set-based update. Takes priced order lines of
+    books locked by build_quote. Cached catalog data is invalidated only when a book is sold out
+    """
+    ids = [line['book'] for line in lines]
+    Book.objects.filter(id__in=ids).update(
+        count_in_stock=F('count_in_stock') - Case(
+            *[When(id=line['book'], then=Value(line['quantity'])) for line in lines]),
+        updated_at=timezone.now())
+    if any(line['quantity'] >= line['count_in_stock'] for line in lines):
+        transaction.on_commit(bump_catalog_version)
+    transaction.on_commit(lambda: stock_changed.send(sender=Book, book_ids=ids))
+
+
+def _copy_rows(objects, target_model):
+    fields = [field.attname for field in target_model._meta.concrete_fields
+              if field.attname != 'archived_at']
+    return [target_model(**{name: getattr(obj, name) for name in fields}) for obj in objects]
+
+
+def archive_orders_batch(older_than, batch_size):
+    """
+    Moves one batch of delivered and cancelled orders placed before older_than, with their books and
+    delivery addresses, to the archive tables in one transaction. Orders locked by other transactions are skipped.
+    A row already present in the archive raises IntegrityError and rolls the batch back, so nothing is deleted
+    without being copied. Returns number of archived orders, 0 when nothing is left to archive
+    """
+    with transaction.atomic():
+        orders = list(Order.objects.select_for_update(skip_locked=True).filter(
+            status__in=ORDER_ARCHIVE_STATUSES, order_date__lt=older_than).order_by('id')[:batch_size])
+        if not orders:
+            return 0
+        ids = [order.id for order in orders]
+        ArchivedOrder.objects.bulk_create(_copy_rows(orders, ArchivedOrder))
+        ArchivedOrderedBook.objects.bulk_create(
+            _copy_rows(OrderedBook.objects.filter(order_id__in=ids), ArchivedOrderedBook))
+        ArchivedDeliveryAddress.objects.bulk_create(
+            _copy_rows(DeliveryAddress.objects.filter(order_id__in=ids), ArchivedDeliveryAddress))
+        Order.objects.filter(id__in=ids).delete()
+    return len(ids)
+
+
+def parse_sync_token(token):
+    """
+    Returns the catalog position encoded in the sync token, the beginning of the catalog for an empty token,
+    None for an invalid one
+    """
+    if not token:
+        return SYNC_START
+    try:
+        position = tuple(int(part) for part in token.split('.'))
+    except ValueError:
+        return None
+    if len(position) != len(SYNC_START) or min(position) < 0:
+        return None
+    return position
+
+
+def make_sync_token(position):
+    return '.'.join(str(part) for part in position)
+
+
+def get_change_horizon():
+    """
+    Returns the id of the oldest running transaction. Every transaction with a smaller id has already ended,
+    so its changes are visible and no row with a smaller change_txid can appear later
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT txid_snapshot_xmin(txid_current_snapshot())')
+        return cursor.fetchone()[0]
+
+
+def _position_filter(rank, position, lookup):
+    """
+    Returns the filter of rows of the stream with the rank placed at or after (gte) or before (lt) the catalog
+    position. The position consisting transaction id, rank of the stream, object id orders changes of all streams
+    """
+    txid, position_rank, object_id = position
+    if lookup == 'gte':
+        txid_lookup = 'gte' if rank > position_rank else 'gt'
+    else:
+        txid_lookup = 'lte' if rank < position_rank else 'lt'
+    if rank == position_rank:
+        return Q(**{f'change_txid__{txid_lookup}': txid}) | Q(change_txid=txid, **{f'id__{lookup}': object_id})
+    return Q(**{f'change_txid__{txid_lookup}': txid})
+
+
+def get_catalog_changes(since, limit):
+    """
+    Returns books and publishing houses changed and ids of objects deleted since the since position, at most limit
+    of each kind, and the token to ask for the next changes. Rows carry the id of the transaction that changed them,
+    assigned by the database, and only transactions older than every running one are returned, so a change committed
+    late is returned by a later call instead of being skipped. A long running transaction holds back later changes
+    """
+    horizon = get_change_horizon()
+    streams = {
+        'books': Book.objects.select_related('publishing'),
+        'publishing_houses': Publishing.objects.all(),
+        'deleted': Tombstone.objects.all(),
+    }
+    querysets = {name: queryset.filter(_position_filter(rank, since, 'gte'), change_txid__lt=horizon)
+                 .order_by('change_txid', 'id') for rank, (name, queryset) in enumerate(streams.items())}
+
+    until = (horizon, 0, 0)
+    for rank, queryset in enumerate(querysets.values()):
+        overflow = list(queryset.values_list('change_txid', 'id')[limit:limit + 1])
+        if overflow:
+            until = min(until, (overflow[0][0], rank, overflow[0][1]))
+
+    changes = {name: list(queryset.filter(_position_filter(rank, until, 'lt')))
+               for rank, (name, queryset) in enumerate(querysets.items())}
+    deleted = {'books': [], 'publishing_houses': []}
+    for tombstone in changes.pop('deleted'):
+        deleted['books' if tombstone.object_type == 'book' else 'publishing_houses'].append(tombstone.object_id)
+    return {'token': make_sync_token(max(until, since)), 'has_more': until != (horizon, 0, 0), 'deleted': deleted,
+            **changes}
+
+
+def _book_rating_fields():
+    """
+    Returns expressions of the average rating and the number of reviews of the outer book
+    """
+    ratings = Comments.objects.filter(book=OuterRef('pk'), rating__isnull=False).order_by().values('book').annotate(
+        average=Avg('rating', output_field=FloatField())).values('average')
+    reviews = Comments.objects.filter(book=OuterRef('pk')).order_by().values('book').annotate(
+        number=Count('id')).values('number')
+    return Coalesce(Subquery(ratings), Value(0.0)), Coalesce(Subquery(reviews), Value(0))
+
+
+def update_book_rating(book_id):
+    """
+    Recomputes average rating and number of reviews of the book after its comments are changed. The book is locked
+    first, so that the update sees comments of a concurrent transaction which updated the book before
+    """
+    average_rating, reviews_count = _book_rating_fields()
+    with transaction.atomic():
+        list(Book.objects.select_for_update().filter(id=book_id).values_list('id'))
+        Book.objects.filter(id=book_id).update(average_rating=average_rating, reviews_count=reviews_count)
+
+
+class AgeInDays(Func):
+    template = 'EXTRACT(EPOCH FROM (%(expressions)s)) / 86400'
+    output_field = FloatField()
+
+
+def refresh_popularity(batch_size):
+    """
+    Recomputes average rating, number of reviews and popularity of all books in batches of book ids. Popularity is
+    the number of books sold by not cancelled orders in the last BOOKSHOP_POPULARITY_DAYS days, every sale halving
+    its weight each BOOKSHOP_POPULARITY_HALF_LIFE days, plus views of the book page decaying the same way
+    multiplied by BOOKSHOP_POPULARITY_VIEW_WEIGHT, plus the average rating multiplied by
+    BOOKSHOP_POPULARITY_RATING_WEIGHT.
+    Returns number of updated books
+    """
+    since = timezone.now() - timedelta(days=settings.BOOKSHOP_POPULARITY_DAYS)
+    sales = OrderedBook.objects.filter(ord_book=OuterRef('pk'), order__order_date__gte=since).exclude(
+        order__status=ORDER_CANCELLED_STATUS).order_by().values(
+        'ord_book').annotate(score=Sum(F('quantity') * Power(
+            0.5, AgeInDays(Now() - F('order__order_date')) / settings.BOOKSHOP_POPULARITY_HALF_LIFE))).values('score')
+    view_age = AgeInDays(Now() - Cast('day', DateTimeField()))
+    views = BookViewCounter.objects.filter(book=OuterRef('pk'), day__gte=since.date()).order_by().values(
+        'book').annotate(score=Sum(F('views') * Power(0.5, view_age / settings.BOOKSHOP_POPULARITY_HALF_LIFE))).values(
+        'score')
+    view_score = Coalesce(Subquery(views, output_field=FloatField()), Value(0.0))
+    average_rating, reviews_count = _book_rating_fields()
+
+    bounds = Book.objects.aggregate(first=Min('id'), last=Max('id'))
+    if bounds['first'] is None:
+        return 0
+    updated = 0
+    for start in range(bounds['first'], bounds['last'] + 1, batch_size):
+        updated += Book.objects.filter(id__gte=start, id__lt=start + batch_size).update(
+            average_rating=average_rating,
+            reviews_count=reviews_count,
+            popularity=Coalesce(Subquery(sales, output_field=FloatField()), Value(0.0)) +
+            view_score * settings.BOOKSHOP_POPULARITY_VIEW_WEIGHT +
+            average_rating * settings.BOOKSHOP_POPULARITY_RATING_WEIGHT)
+    return updated
@@ -0,0 +1,71 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .cache import publishing_cache
+from .events import book_state, broadcaster, stock_changed
+from .models import Book, Comments, Publishing, Tombstone
+from .service import bump_catalog_version, update_book_rating
+from .suggest import get_loaded_suggest_index
+
+
+@receiver([post_save, post_delete], sender=Book)
+@receiver([post_save, post_delete], sender=Publishing)
+def invalidate_catalog_cache(sender, **kwargs):
+    # A reader running before the commit would cache old data under the new version
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver([post_save, post_delete], sender=Publishing)
+def invalidate_cached_publishing(sender, instance, **kwargs):
+    # A reader running before the commit would cache the old row under a version replaced now
+    pk = instance.pk
+    transaction.on_commit(lambda: publishing_cache.invalidate(pk))
+
+
+@receiver(post_save, sender=Book)
+def publish_book_state(sender, instance, **kwargs):
+    state = {instance.pk: book_state(instance.count_in_stock, instance.price)}
+    transaction.on_commit(lambda: broadcaster.publish(state))
+
+
+@receiver(stock_changed, sender=Book)
+def publish_books_state(sender, book_ids, **kwargs):
+    if broadcaster.has_subscribers():
+        books = Book.objects.filter(id__in=book_ids).values_list('id', 'count_in_stock', 'price')
+        broadcaster.publish({book_id: book_state(count, price) for book_id, count, price in books})
+
+
+@receiver(post_save, sender=Book)
+def update_suggest_index(sender, instance, **kwargs):
+    index = get_loaded_suggest_index()
+    if index is not None:
+        entry = (instance.pk, instance.title, instance.author, instance.count_in_stock > 0)
+        transaction.on_commit(lambda: index.update(*entry))
+
+
+@receiver(post_delete, sender=Book)
+def remove_from_suggest_index(sender, instance, **kwargs):
+    index = get_loaded_suggest_index()
+    if index is not None:
+        pk = instance.pk
+        transaction.on_commit(lambda: index.remove(pk))
+
+
+@receiver(stock_changed, sender=Book)
+def update_suggest_index_stock(sender, book_ids, **kwargs):
+    index = get_loaded_suggest_index()
+    if index is not None:
+        stock = Book.objects.filter(id__in=book_ids).values_list('id', 'count_in_stock')
+        index.update_stock({book_id: count > 0 for book_id, count in stock})
+
+
+@receiver(post_delete, sender=Book)
+@receiver(post_delete, sender=Publishing)
+def create_tombstone(sender, instance, **kwargs):
+    Tombstone.objects.create(object_type='book' if sender is Book else 'publishing', object_id=instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Comments)
+def update_rating(sender, instance, **kwargs):
+    update_book_rating(instance.book_id)
@@ -0,0 +1,120 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+from rest_framework.fields import Field
+
+from .models import SlowQuery
+
+logger = logging.getLogger(__name__)
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Frames of these modules are never reported as the call site of a query
+SKIPPED_MODULES = (os.path.join(PACKAGE_DIR, 'slowlog.py'), os.path.join(PACKAGE_DIR, 'middleware.py'))
+
+SLOW_QUERY_ORDERINGS = ('total_time', 'max_time', 'calls')
+
+SQL_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|%s")
+SQL_VALUE_LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+SQL_SPACES = re.compile(r'\s+')
+
+_explained_at = {}
+
+
+def normalize_sql(sql):
+    """
+    Returns the SQL with literals and parameters replaced by ? and lists of values collapsed to (...),
+    so that queries differing only by their values are normalized the same
+    """
+    sql = SQL_LITERALS.sub('?', sql)
+    sql = SQL_VALUE_LISTS.sub('(...)', sql)
+    return SQL_SPACES.sub(' ', sql).strip()
+
+
+def get_call_site():
+    """
+    Returns the serializer field and the bookshop code line running the current query,
+    e.g. "BookDetailSerializer.publishing; bookshop/serializers.py:152 get_publishing"
+    """
+    field = code_line = None
+    frame = sys._getframe(1)
+    while frame is not None and (field is None or code_line is None):
+        code = frame.f_code
+        if field is None and code.co_name == 'to_representation' and isinstance(frame.f_locals.get('field'), Field):
+            field = f"{type(frame.f_locals['self']).__name__}.{frame.f_locals['field'].field_name}"
+        elif code_line is None and code.co_filename.startswith(PACKAGE_DIR) and code.co_filename not in SKIPPED_MODULES:
+            code_line = f'{os.path.relpath(code.co_filename, settings.BASE_DIR)}:{frame.f_lineno} {code.co_name}'
+        frame = frame.f_back
+    return '; '.join(part for part in (field, code_line) if part)
+
+
+class SlowQueryRecorder:
+    """
+    Database execute wrapper collecting queries slower than SLOW_QUERY_THRESHOLD_MS with their call site.
+    A query read through a server-side cursor (queryset.iterator()) is timed until the cursor is declared
+    """
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        result = execute(sql, params, many, context)
+        duration = (time.perf_counter() - start) * 1000
+        if duration >= settings.SLOW_QUERY_THRESHOLD_MS:
+            self.queries.append({'sql': sql, 'params': None if many else params, 'time_ms': duration,
+                                 'call_site': get_call_site(), 'executed_at': timezone.now()})
+        return result
+
+
+def explain_query(sql, params):
+    """
+    Returns the plan of the query chosen by PostgreSQL, without running the query, or None if it can not be explained
+    """
+    try:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute('EXPLAIN (ANALYZE off, FORMAT JSON) ' + sql, params)
+            plan = cursor.fetchone()[0]
+    except DatabaseError:
+        return None
+    return json.loads(plan) if isinstance(plan, str) else plan
+
+
+def save_slow_queries(queries, view):
+    """
+    Adds the slow queries of the view to the statistics of their fingerprints. Captures the plan of a SELECT
+    unless a query of the same fingerprint was explained by this process in the last SLOW_QUERY_EXPLAIN_INTERVAL seconds
+    """
+    table = SlowQuery._meta.db_table
+    for query in queries:
+        normalized = normalize_sql(query['sql'])
+        fingerprint = hashlib.sha1(normalized.encode()).hexdigest()
+        plan = None
+        explained_at = _explained_at.get(fingerprint)
+        if query['params'] is not None and normalized[:6].upper() == 'SELECT' and (
+                explained_at is None or time.monotonic() - explained_at >= settings.SLOW_QUERY_EXPLAIN_INTERVAL):
+            plan = explain_query(query['sql'], query['params'])
+            _explained_at[fingerprint] = time.monotonic()
+
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(
+                    f'INSERT INTO {table} (fingerprint, sql, view, call_site, calls, total_time, max_time, plan, '
+                    f'first_seen, last_seen) VALUES (%s, %s, %s, %s, 1, %s, %s, %s::jsonb, %s, %s) '
+                    f'ON CONFLICT (fingerprint) DO UPDATE SET view = EXCLUDED.view, call_site = EXCLUDED.call_site, '
+                    f'calls = {table}.calls + 1, total_time = {table}.total_time + EXCLUDED.total_time, '
+                    f'max_time = GREATEST({table}.max_time, EXCLUDED.max_time), '
+                    f'plan = COALESCE(EXCLUDED.plan, {table}.plan), last_seen = EXCLUDED.last_seen',
+                    [fingerprint, normalized, view, query['call_site'][:500], query['time_ms'], query['time_ms'],
+                     None if plan is None else json.dumps(plan), query['executed_at'], query['executed_at']],
+                )
+        except DatabaseError:
+            logger.exception('Could not save the slow query %s', fingerprint)
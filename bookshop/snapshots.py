@@ -0,0 +1,129 @@
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from .models import Book, Publishing
+from .serializers import BookListSerializer, PublishingDetailSerializer
+
+MANIFEST_NAME = 'manifest.json'
+
+PUBLISHING_HOUSES_SHARD = 'publishing-houses'
+
+
+def get_catalog_queryset():
+    """
+    Returns books in stock, as anonymous clients see them
+    """
+    return Book.in_stock_objects.all()
+
+
+def read_manifest(directory):
+    """
+    Returns the published manifest of the snapshot in the directory, or None
+    """
+    try:
+        with open(os.path.join(directory, MANIFEST_NAME), encoding='utf-8') as stream:
+            return json.load(stream)
+    except FileNotFoundError:
+        return None
+
+
+def _write_atomic(path, content):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    descriptor, temp_path = tempfile.mkstemp(dir=directory, prefix='.snapshot-')
+    try:
+        with os.fdopen(descriptor, 'wb') as stream:
+            stream.write(content)
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def get_shard_signatures(page_size, seed):
+    """
+    Returns a mapping of shard name to the digest of everything shown in the shard: ids, change dates, ratings
+    and numbers of reviews of its books. Books are sharded into pages of page_size ids ("books/<page>")
+    and by publishing house ("publishers/<id>"). Shards without books are left out
+    """
+    signatures = defaultdict(lambda: hashlib.sha1(seed.encode()))
+    # The list of publishing houses is published even when it is empty
+    signatures[PUBLISHING_HOUSES_SHARD]
+    for publishing_id, updated_at in Publishing.objects.order_by('id').values_list('id', 'updated_at'):
+        signatures[PUBLISHING_HOUSES_SHARD].update(f'{publishing_id}|{updated_at.isoformat()};'.encode())
+
+    rows = get_catalog_queryset().order_by('id').values_list(
+        'id', 'publishing_id', 'updated_at', 'average_rating', 'reviews_count').iterator(
+        chunk_size=settings.BOOKSHOP_STREAMING_CHUNK_SIZE)
+    for book_id, publishing_id, updated_at, rating, reviews in rows:
+        row = f'{book_id}|{updated_at.isoformat()}|{rating}|{reviews};'.encode()
+        signatures[f'books/{book_id // page_size}'].update(row)
+        signatures[f'publishers/{publishing_id}'].update(row)
+    return {name: digest.hexdigest() for name, digest in signatures.items()}
+
+
+def render_shard(name, page_size):
+    """
+    Returns the JSON content of the shard, the same as the API returns to anonymous clients
+    """
+    if name == PUBLISHING_HOUSES_SHARD:
+        return JSONRenderer().render(PublishingDetailSerializer(Publishing.objects.all(), many=True).data)
+    kind, key = name.split('/')
+    queryset = get_catalog_queryset().order_by('id')
+    if kind == 'books':
+        queryset = queryset.filter(id__gte=int(key) * page_size, id__lt=(int(key) + 1) * page_size)
+    else:
+        queryset = queryset.filter(publishing_id=int(key))
+    return JSONRenderer().render(BookListSerializer(queryset, many=True).data)
+
+
+def build_catalog_snapshot(directory, page_size, force=False):
+    """
+    Writes the anonymous catalog as gzipped JSON shards listed in manifest.json. Only shards whose signature
+    differs from the published manifest are rendered again, under a new file name, then the manifest is replaced
+    atomically. Files referenced by neither the new nor the previous manifest are removed.
+    Returns numbers of written, kept and removed shard files
+    """
+    from bookshop_project.yasg import get_code_version
+
+    previous = read_manifest(directory) or {}
+    previous_shards = previous.get('shards', {})
+    signatures = get_shard_signatures(page_size, f'{get_code_version()}:{page_size}')
+
+    shards = {}
+    written = kept = 0
+    for name, signature in sorted(signatures.items()):
+        old = previous_shards.get(name)
+        if not force and old is not None and old['signature'] == signature and \
+                os.path.exists(os.path.join(directory, old['file'] + '.gz')):
+            shards[name] = old
+            kept += 1
+            continue
+        content = render_shard(name, page_size)
+        file_name = f'{name}-{signature[:16]}.json'
+        _write_atomic(os.path.join(directory, file_name + '.gz'), gzip.compress(content, compresslevel=9, mtime=0))
+        shards[name] = {'file': file_name, 'signature': signature, 'size': len(content)}
+        written += 1
+
+    manifest = {'generated_at': timezone.now().isoformat(), 'page_size': page_size, 'shards': shards}
+    _write_atomic(os.path.join(directory, MANIFEST_NAME), json.dumps(manifest, indent=1).encode())
+
+    used = {shard['file'] + '.gz' for shard in [*shards.values(), *previous_shards.values()]}
+    removed = 0
+    for root, _, files in os.walk(directory):
+        for file_name in files:
+            path = os.path.relpath(os.path.join(root, file_name), directory)
+            if file_name.endswith('.json.gz') and path.replace(os.sep, '/') not in used:
+                os.remove(os.path.join(root, file_name))
+                removed += 1
+    return {'written': written, 'kept': kept, 'removed': removed}
@@ -0,0 +1,66 @@
+import hashlib
+import os
+import posixpath
+import re
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+
+CONTENT_HASH_NAME = re.compile(r'(^|/)[0-9a-f]{2}/[0-9a-f]{64}(\.\w+)?$')
+
+
+def hash_file_content(content):
+    """
+    Returns SHA-256 hex digest of the file content
+    """
+    digest = hashlib.sha256()
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    for chunk in content.chunks():
+        digest.update(chunk)
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    return digest.hexdigest()
+
+
+def is_content_addressed(name):
+    """
+    Returns True if the file name was produced by ContentAddressedStorage
+    """
+    return bool(CONTENT_HASH_NAME.search(name or ''))
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Stores files under names derived from the SHA-256 of their content, e.g. books/3f/3fa4...e1.jpg.
+    Identical uploads are stored once, and a stored name never changes its content, so it can be cached forever
+    """
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def _save(self, name, content):
+        digest = hash_file_content(content)
+        extension = os.path.splitext(name)[1].lower()
+        name = posixpath.join(posixpath.dirname(name), digest[:2], digest + extension)
+        if self.exists(name):
+            return name
+
+        full_path = self.path(name)
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+        if self.directory_permissions_mode is not None:
+            os.chmod(directory, self.directory_permissions_mode)
+
+        descriptor, temp_path = tempfile.mkstemp(dir=directory, prefix='.upload-')
+        try:
+            with os.fdopen(descriptor, 'wb') as temp_file:
+                for chunk in content.chunks():
+                    temp_file.write(chunk)
+            os.chmod(temp_path, self.file_permissions_mode or 0o644)
+            os.replace(temp_path, full_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return name
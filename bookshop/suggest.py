@@ -0,0 +1,220 @@
+import gzip
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from bisect import bisect_left, insort
+
+from django.conf import settings
+
+from .models import Book, Tombstone
+from .service import get_change_horizon
+
+NON_WORD = re.compile(r'[\W_]+')
+
+
+def normalize(text):
+    """
+    Returns the text in lower case with "ё" replaced by "е" and punctuation replaced by single spaces
+    """
+    return NON_WORD.sub(' ', (text or '').casefold().replace('ё', 'е')).strip()
+
+
+def get_book_keys(title, author):
+    """
+    Returns keys the book is found by: its title and author from every word on
+    """
+    keys = set()
+    for text in (title, author):
+        words = normalize(text).split()
+        for index in range(len(words)):
+            keys.add(' '.join(words[index:]))
+    return keys
+
+
+class SuggestIndex:
+    """
+    Prefix index of book titles and authors kept in memory as a sorted list of (key, book id) pairs.
+    A lookup is a binary search followed by a scan of the matching keys. Changes of all transactions with ids
+    below change_txid are in the index
+    """
+
+    def __init__(self, books=(), change_txid=None):
+        self.books = {}
+        self.entries = []
+        self.change_txid = change_txid
+        self.lock = threading.Lock()
+        for book_id, title, author, in_stock in books:
+            self.books[book_id] = (title, author, in_stock)
+            self.entries.extend((key, book_id) for key in get_book_keys(title, author))
+        self.entries.sort()
+
+    @classmethod
+    def from_database(cls):
+        change_txid = get_change_horizon()
+        books = Book.objects.order_by().values_list('id', 'title', 'author', 'count_in_stock').iterator(
+            chunk_size=settings.BOOKSHOP_STREAMING_CHUNK_SIZE)
+        return cls(((book_id, title, author or '', count > 0) for book_id, title, author, count in books),
+                   change_txid)
+
+    @classmethod
+    def from_snapshot(cls, path):
+        with gzip.open(path, 'rt', encoding='utf-8') as stream:
+            snapshot = json.load(stream)
+        return cls(snapshot['books'], snapshot.get('change_txid'))
+
+    def write_snapshot(self, path):
+        """
+        Writes the books of the index to a gzipped JSON file, replacing the old snapshot atomically
+        """
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        with self.lock:
+            books = [[book_id, *book] for book_id, book in self.books.items()]
+            change_txid = self.change_txid
+        descriptor, temp_path = tempfile.mkstemp(dir=directory, prefix='.suggest-')
+        try:
+            with gzip.open(os.fdopen(descriptor, 'wb'), 'wt', encoding='utf-8') as stream:
+                json.dump({'change_txid': change_txid, 'books': books}, stream, separators=(',', ':'))
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def suggest(self, query, limit):
+        """
+        Returns up to limit books whose title or author has a word starting with the query,
+        books in stock first. Books consist id, title, author, availability
+        """
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        found = {}
+        with self.lock:
+            index = bisect_left(self.entries, (prefix,))
+            while index < len(self.entries) and len(found) < limit * 5:
+                key, book_id = self.entries[index]
+                if not key.startswith(prefix):
+                    break
+                found.setdefault(book_id, self.books[book_id])
+                index += 1
+        results = sorted(found.items(), key=lambda item: (not item[1][2], item[1][0]))[:limit]
+        return [{'id': book_id, 'title': title, 'author': author, 'in_stock': in_stock}
+                for book_id, (title, author, in_stock) in results]
+
+    def apply_changes(self):
+        """
+        Applies books changed and deleted by transactions ended since the last call. Returns False without changing
+        the index when its position is unknown or too many books were changed, then the index has to be rebuilt
+        """
+        if self.change_txid is None:
+            return False
+        horizon = get_change_horizon()
+        limit = settings.BOOKSHOP_SUGGEST_MAX_CHANGES
+        window = {'change_txid__gte': self.change_txid, 'change_txid__lt': horizon}
+        books = list(Book.objects.filter(**window).order_by().values_list(
+            'id', 'title', 'author', 'count_in_stock')[:limit + 1])
+        removed = list(Tombstone.objects.filter(object_type='book', **window).order_by().values_list(
+            'object_id', flat=True)[:limit + 1])
+        if len(books) + len(removed) > limit:
+            return False
+        for book_id, title, author, count in books:
+            self.update(book_id, title, author, count > 0)
+        for book_id in removed:
+            self.remove(book_id)
+        self.change_txid = max(self.change_txid, horizon)
+        return True
+
+    def update(self, book_id, title, author, in_stock):
+        with self.lock:
+            self._remove(book_id)
+            self.books[book_id] = (title, author or '', in_stock)
+            for key in get_book_keys(title, author):
+                insort(self.entries, (key, book_id))
+
+    def update_stock(self, stock):
+        """
+        Takes a mapping of book id to availability
+        """
+        with self.lock:
+            for book_id, in_stock in stock.items():
+                if book_id in self.books:
+                    title, author, _ = self.books[book_id]
+                    self.books[book_id] = (title, author, in_stock)
+
+    def remove(self, book_id):
+        with self.lock:
+            self._remove(book_id)
+
+    def _remove(self, book_id):
+        book = self.books.pop(book_id, None)
+        if book is None:
+            return
+        for key in get_book_keys(book[0], book[1]):
+            index = bisect_left(self.entries, (key, book_id))
+            if index < len(self.entries) and self.entries[index] == (key, book_id):
+                del self.entries[index]
+
+
+_index = None
+_index_lock = threading.Lock()
+_checked_at = 0.0
+_refreshing = False
+
+
+def get_suggest_index():
+    """
+    Returns the index of this process. It is loaded from the snapshot or from the database on the first call.
+    Books changed by other processes are applied in the background from the change feed of the database,
+    the index is rebuilt only when the changes cannot be applied one by one
+    """
+    global _index, _checked_at
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = _load_index()
+                _checked_at = time.monotonic()
+    elif time.monotonic() - _checked_at > settings.BOOKSHOP_SUGGEST_REFRESH_INTERVAL:
+        _checked_at = time.monotonic()
+        _start_refresh()
+    return _index
+
+
+def get_loaded_suggest_index():
+    """
+    Returns the index of this process if it is already loaded, otherwise None
+    """
+    return _index
+
+
+def _load_index():
+    path = settings.BOOKSHOP_SUGGEST_SNAPSHOT
+    if os.path.exists(path):
+        index = SuggestIndex.from_snapshot(path)
+        if index.apply_changes():
+            return index
+    return SuggestIndex.from_database()
+
+
+def _start_refresh():
+    global _refreshing
+    with _index_lock:
+        if _refreshing:
+            return
+        _refreshing = True
+
+    def refresh():
+        global _index, _refreshing
+        from django.db import connection
+
+        try:
+            if not _index.apply_changes():
+                _index = SuggestIndex.from_database()
+        finally:
+            connection.close()
+            _refreshing = False
+
+    threading.Thread(target=refresh, daemon=True).start()
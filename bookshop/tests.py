@@ -1,9 +1,48 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
+
+import msgpack
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
 from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import IntegrityError, connection, transaction
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, APITestCase, APITransactionTestCase
 from rest_framework_simplejwt.tokens import AccessToken
-from .models import Order, OrderedBook, Publishing, DeliveryAddress, Book
+from PIL import Image
+from prometheus_client import REGISTRY
+from .renderers import decode_msgpack_ext, encode_msgpack_ext
+from .models import Order, OrderedBook, Publishing, DeliveryAddress, Book, Author, ArchivedOrder, ArchivedOrderedBook, \
+    Comments, BookViewCounter, SlowQuery
+from .service import archive_orders_batch, get_catalog_version, split_author_names, sync_book_authors
+from .cache import publishing_cache
+from .counters import ViewCounterBuffer
+from .events import broadcaster
+from .slowlog import normalize_sql
+from .storage import is_content_addressed
+from .snapshots import build_catalog_snapshot, read_manifest
+from .suggest import SuggestIndex, get_loaded_suggest_index
+from .throttling import AnonCostRateThrottle, CostRateThrottle
+from .warmup import warm_up
+from bookshop_project.yasg import SCHEMA_FORMATS
 
 
 class BookTests(APITestCase):
@@ -19,6 +58,12 @@ class BookTests(APITestCase):
 
         Publishing.objects.create(name='Издательство')
 
+        self.view_counter = ViewCounterBuffer()
+        patcher = mock.patch('bookshop.views.view_counter', self.view_counter)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.view_counter.flush)
+
         self.first_book = Book.objects.create(
             title='Book1',
             author='Author',
@@ -46,10 +91,87 @@ class BookTests(APITestCase):
         self.assertEquals(response.status_code, status.HTTP_200_OK)
         self.assertEquals(len(response.data), 1)
 
+    def test_book_facets(self):
+        other_publishing = Publishing.objects.create(name='Издательство2')
+        Book.objects.create(title='Book3', author='Author', publishing=other_publishing, publication_date='2021',
+                            description='It is a book', price=700, count_in_stock=10)
+        response = self.client.get(reverse('book-list'), {'facets': 1, 'publishing': 'Издательство'})
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+        self.assertEquals(len(response.data['publishing']), 2)
+        self.assertEquals(response.data['publication_date'], [{'year': 2020, 'count': 1}])
+        self.assertEquals([bucket['count'] for bucket in response.data['price']], [1, 0, 0, 0])
+
+    def test_book_facets_invalidated_after_commit(self):
+        self.client.get(reverse('book-list'), {'facets': 1})
+        version = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            Book.objects.create(title='Book3', author='Author', publishing=self.first_book.publishing,
+                                publication_date='2021', description='It is a book', price=700, count_in_stock=10)
+            self.assertEquals(get_catalog_version(), version)
+        self.assertEquals(get_catalog_version(), version + 1)
+        response = self.client.get(reverse('book-list'), {'facets': 1})
+        self.assertEquals(sum(bucket['count'] for bucket in response.data['price']), 2)
+
+    def test_book_list_rating_follows_comments(self):
+        comment = Comments.objects.create(book=self.first_book, rating=5, comment_author=self.user_test,
+                                          comment='Good')
+        response = self.client.get(reverse('book-list'))
+        self.assertEquals([(book['rating'], book['reviews']) for book in response.data], [(5, 1)])
+        comment.delete()
+        response = self.client.get(reverse('book-list'))
+        self.assertEquals([(book['rating'], book['reviews']) for book in response.data], [(None, 0)])
+
+    def test_book_list_ordered_by_popularity(self):
+        second_book = Book.objects.create(title='Book3', author='Author', publishing=self.first_book.publishing,
+                                          publication_date='2021', description='It is a book', price=700,
+                                          count_in_stock=10)
+        order = Order.objects.create(customer=self.user_test)
+        OrderedBook.objects.create(ord_book=second_book, title='Book3', quantity=3, price=700, order=order)
+        cancelled_order = Order.objects.create(customer=self.user_test, status='Отменен')
+        OrderedBook.objects.create(ord_book=second_book, title='Book3', quantity=5, price=700, order=cancelled_order)
+        Comments.objects.create(book=self.first_book, rating=5, comment_author=self.user_test, comment='Good')
+        call_command('refresh_popularity', stdout=StringIO())
+
+        second_book.refresh_from_db()
+        self.assertAlmostEquals(second_book.popularity, 3, places=2)
+        self.assertEquals(Book.objects.get(id=self.first_book.id).average_rating, 5)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('book-list'), {'ordering': '-popularity'})
+        self.assertEquals([(book['title'], book['rating'], book['reviews']) for book in response.data],
+                          [('Book1', 5, 1), ('Book3', None, 0)])
+        self.assertFalse([query for query in queries if 'GROUP BY' in query['sql']])
+        response = self.client.get(reverse('book-list'), {'ordering': '-price'})
+        self.assertEquals([book['title'] for book in response.data], ['Book3', 'Book1'])
+
+    """Book views"""
+
+    def test_book_views_are_written_in_batches(self):
+        for _ in range(2):
+            self.client.get(reverse('book-detail', kwargs={'pk': self.first_book.id}))
+        self.assertEquals(self.view_counter.pending(), 2)
+        self.assertFalse(BookViewCounter.objects.exists())
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEquals(self.view_counter.flush(), 2)
+        self.assertEquals(len(queries), 1)
+        self.view_counter.record(self.first_book.id)
+        self.view_counter.record(self.first_book.id + 1000)
+        self.view_counter.flush()
+
+        counter = BookViewCounter.objects.get()
+        self.assertEquals((counter.book_id, counter.day, counter.views),
+                          (self.first_book.id, timezone.localdate(), 3))
+
+    def test_book_views_raise_popularity(self):
+        BookViewCounter.objects.create(book=self.first_book, day=timezone.localdate(), views=100)
+        call_command('refresh_popularity', stdout=StringIO())
+        self.assertAlmostEquals(Book.objects.get(id=self.first_book.id).popularity,
+                                100 * settings.BOOKSHOP_POPULARITY_VIEW_WEIGHT, delta=0.5)
+
     """Get book detail"""
 
     def test_fail_book_detail(self):
-        response = self.client.get(reverse('book-detail', kwargs={'pk': 50}))
+        response = self.client.get(reverse('book-detail', kwargs={'pk': self.first_book.id + 1000}))
         self.assertEquals(response.status_code, status.HTTP_404_NOT_FOUND)
 
     def test_book_detail(self):
@@ -57,6 +179,13 @@ class BookTests(APITestCase):
         self.assertEquals(response.status_code, status.HTTP_200_OK)
         self.assertEquals(response.json().get('title'), 'Book1')
 
+    def test_book_detail_for_staff(self):
+        Comments.objects.create(book=self.first_book, rating=4, comment_author=self.user_test, comment='Good')
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + str(self.user_staff_test_token))
+        response = self.client.get(reverse('book-detail', kwargs={'pk': self.first_book.id}))
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+        self.assertEquals((response.data['rating'], response.data['reviews']), (4, 1))
+
     """Create book"""
 
     def test_fail_book_create(self):
@@ -74,6 +203,153 @@ class BookTests(APITestCase):
         self.assertEquals(response.status_code, status.HTTP_201_CREATED)
 
 
+class BookImageTests(APITestCase):
+    """
+    Tests uploading book images to the content-addressed storage
+    """
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root,
+                                                   UPLOAD_TEMP_DIR=os.path.join(self.media_root, 'uploads'))
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+        publishing = Publishing.objects.create(name='Издательство')
+        self.books = [Book.objects.create(title=f'Book{index}', author='Author', publishing=publishing,
+                                          publication_date='2020', description='It is a book', price=100,
+                                          count_in_stock=100) for index in range(2)]
+
+    def make_image(self, name):
+        content = BytesIO()
+        Image.new('RGB', (10, 10), color='red').save(content, format='PNG')
+        return SimpleUploadedFile(name, content.getvalue(), content_type='image/png')
+
+    def test_identical_images_are_stored_once(self):
+        for book, name in zip(self.books, ['cover.png', 'other.png']):
+            response = self.client.post(reverse('upload-image'), {'book_id': book.id, 'image': self.make_image(name)},
+                                        format='multipart')
+            self.assertEquals(response.status_code, status.HTTP_200_OK)
+
+        first, second = [Book.objects.get(id=book.id).image.name for book in self.books]
+        self.assertEquals(first, second)
+        self.assertTrue(is_content_addressed(first))
+        self.assertTrue(first.startswith('books/') and first.endswith('.png'))
+
+    def test_rehash_updates_order_lines(self):
+        os.makedirs(os.path.join(self.media_root, 'books'))
+        with open(os.path.join(self.media_root, 'books', 'cover.png'), 'wb') as stream:
+            stream.write(self.make_image('cover.png').read())
+        book = self.books[0]
+        Book.objects.filter(id=book.id).update(image='books/cover.png')
+        customer = User.objects.create(username='User_TEST', password='dina12345')
+        order = Order.objects.create(customer=customer)
+        OrderedBook.objects.create(ord_book=book, order=order, image='books/cover.png', quantity=1, price=100)
+        archived_order = ArchivedOrder.objects.create(id=order.id + 1, customer=customer, order_date=timezone.now())
+        ArchivedOrderedBook.objects.create(id=1, ord_book=book, order=archived_order, image='books/cover.png',
+                                           quantity=1, price=100)
+
+        call_command('rehash_book_images', stdout=StringIO())
+        new_name = Book.objects.get(id=book.id).image.name
+        self.assertTrue(is_content_addressed(new_name))
+        self.assertEquals(OrderedBook.objects.get(order=order).image.name, new_name)
+        self.assertEquals(ArchivedOrderedBook.objects.get(id=1).image.name, new_name)
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, 'books', 'cover.png')))
+
+    """Chunked upload"""
+
+    def start_upload(self, content, book=None):
+        staff = User.objects.create(username='User_TEST_STAFF', password='dina12345', is_staff=True)
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + str(AccessToken.for_user(staff)))
+        response = self.client.post(reverse('image-upload-list'), {
+            'book': (book or self.books[0]).id, 'file_name': 'scan.png', 'size': len(content)})
+        self.assertEquals(response.status_code, status.HTTP_201_CREATED)
+        return reverse('image-upload-detail', kwargs={'upload_id': response.data['id']})
+
+    def send_chunk(self, url, chunk, offset):
+        return self.client.patch(url, chunk, content_type='application/offset+octet-stream',
+                                 HTTP_UPLOAD_OFFSET=str(offset))
+
+    @override_settings(BOOKSHOP_IMAGE_HEADER_SIZE=50)
+    def test_chunked_upload(self):
+        content = self.make_image('scan.png').read()
+        url = self.start_upload(content)
+        self.assertEquals(self.send_chunk(url, content[:60], 0)['Upload-Offset'], '60')
+
+        response = self.send_chunk(url, content[60:], 30)
+        self.assertEquals(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEquals(response['Upload-Offset'], '60')
+        self.assertEquals(self.client.get(url).data['image_format'], 'PNG')
+
+        self.assertEquals(self.send_chunk(url, content[60:], 60).status_code, status.HTTP_200_OK)
+        response = self.client.post(url + 'complete/')
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+        image = Book.objects.get(id=self.books[0].id).image
+        self.assertTrue(is_content_addressed(image.name))
+        self.assertEquals(image.read(), content)
+
+    def test_fail_chunked_upload_not_image(self):
+        content = b'<html>' + b' ' * 100
+        url = self.start_upload(content)
+        response = self.send_chunk(url, content, 0)
+        self.assertEquals(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEquals(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(BOOKSHOP_IMAGE_MAX_SIZE=100)
+    def test_fail_chunked_upload_too_large(self):
+        staff = User.objects.create(username='User_TEST_STAFF', password='dina12345', is_staff=True)
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + str(AccessToken.for_user(staff)))
+        response = self.client.post(reverse('image-upload-list'), {
+            'book': self.books[0].id, 'file_name': 'scan.png', 'size': 101})
+        self.assertEquals(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+
+class AuthorTests(APITestCase):
+    """
+    Tests author views and author filters
+    """
+
+    def setUp(self):
+        self.user_staff_test = User.objects.create(username='User_TEST_STAFF', password='dina12345', is_staff=True)
+        self.user_staff_test_token = AccessToken.for_user(self.user_staff_test)
+
+        publishing = Publishing.objects.create(name='Издательство')
+        self.first_book = Book.objects.create(title='Book1', author='Лев Толстой', publishing=publishing,
+                                              publication_date='2020', description='It is a book', price=100,
+                                              count_in_stock=100)
+        self.second_book = Book.objects.create(title='Book2', author='Ильф И., Петров Е.', publishing=publishing,
+                                               publication_date='2020', description='It is a book', price=100,
+                                               count_in_stock=100)
+        sync_book_authors(self.first_book)
+        sync_book_authors(self.second_book)
+
+    def test_split_author_names(self):
+        self.assertEquals(split_author_names('Лев Толстой'), [('Лев', 'Толстой')])
+        self.assertEquals(split_author_names('Ильф И., Петров Е.'), [('И.', 'Ильф'), ('Е.', 'Петров')])
+        self.assertEquals(split_author_names('Гоголь и Пушкин'), [('', 'Гоголь'), ('', 'Пушкин')])
+
+    def test_filter_books_by_author(self):
+        response = self.client.get(reverse('book-list'), {'author_surname': 'Толстой,Петров'})
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+        self.assertEquals(sorted(book['title'] for book in response.data), ['Book1', 'Book2'])
+
+    def test_author_books(self):
+        author = Author.objects.get(surname='Петров')
+        response = self.client.get(reverse('author-books', kwargs={'pk': author.id}))
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+        self.assertEquals([book['title'] for book in response.data], ['Book2'])
+
+    def test_staff_book_create_links_authors(self):
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + str(self.user_staff_test_token))
+        response = self.client.post(reverse('book-list'), {
+            'title': 'Book3', 'author': 'Лев Толстой', 'publishing': self.first_book.publishing_id,
+            'publication_date': '2021', 'description': 'It is a book', 'price': 100, 'count_in_stock': 1})
+        self.assertEquals(response.status_code, status.HTTP_201_CREATED)
+        author = Author.objects.get(surname='Толстой')
+        self.assertEquals(author.books.count(), 2)
+
+
 class OrderTests(APITestCase):
     """
     Tests order views and order serializers
@@ -103,6 +379,8 @@ class OrderTests(APITestCase):
 
         self.ordered_book = OrderedBook.objects.create(
             ord_book=Book.objects.get(title='Book1'),
+            title='Book1',
+            author='Author',
             quantity=1,
             price=Book.objects.get(title='Book1').price,
             order=self.first_order
@@ -147,6 +425,16 @@ class OrderTests(APITestCase):
         response = self.client.get(reverse('order-list'))
         self.assertEquals(response.status_code, status.HTTP_200_OK)
 
+    @override_settings(BOOKSHOP_STREAMING_COMPRESSION_MIN_SIZE=0)
+    def test_staff_order_list_streamed_with_gzip(self):
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + str(self.user_staff_test_token))
+        response = self.client.get(reverse('order-list'), HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+        self.assertEquals(response['Content-Encoding'], 'gzip')
+        orders = json.loads(gzip.decompress(b''.join(response.streaming_content)))
+        self.assertEquals([order['id'] for order in orders], [self.first_order.id])
+        self.assertEquals(orders[0]['customer']['username'], 'User_TEST')
+
     """Get order detail"""
 
     def test_fail_order_detail(self):
@@ -174,6 +462,154 @@ class OrderTests(APITestCase):
         response = self.client.post(reverse('add-order'), self.data)
         self.assertEquals(response.status_code, status.HTTP_200_OK)
 
+    def test_user_order_create_uses_catalog_prices(self):
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + str(self.user_test_token))
+        self.data['orderItems'][0].update({'price': 1, 'quantity': 2})
+        self.data['totalPrice'] = 1
+        response = self.client.post(reverse('add-order'), self.data)
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+        self.assertEquals(response.data['total_cost'], '500.00')
+        self.assertEquals(response.data['ord_books'][0]['price'], '100.00')
+        self.assertEquals(Book.objects.get(title='Book1').count_in_stock, 98)
+
+    def test_user_order_create_keeps_catalog_version(self):
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + str(self.user_test_token))
+        version = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('add-order'), self.data)
+        self.assertEquals(get_catalog_version(), version)
+
+        self.data['orderItems'][0]['quantity'] = 99
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('add-order'), self.data)
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+        self.assertEquals(get_catalog_version(), version + 1)
+
+    def test_fail_user_order_create_total_too_large(self):
+        Book.objects.filter(title='Book1').update(price=5000)
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + str(self.user_test_token))
+        self.data['orderItems'][0]['quantity'] = 30
+        response = self.client.post(reverse('add-order'), self.data)
+        self.assertEquals(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEquals(response.data['quote']['total_price'], '150000.00')
+        self.assertEquals(Book.objects.get(title='Book1').count_in_stock, 100)
+
+    def test_user_order_keeps_book_snapshot(self):
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + str(self.user_test_token))
+        order_id = self.client.post(reverse('add-order'), self.data).data['id']
+        Book.objects.filter(title='Book1').update(title='Book2', author='Other')
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('order-detail', kwargs={'pk': order_id}))
+        self.assertEquals(response.data['ord_books'][0]['title'], 'Book1')
+        self.assertEquals(response.data['ord_books'][0]['author'], 'Author')
+        self.assertFalse([query for query in context.captured_queries if '"bookshop_book"' in query['sql']])
+
+    def test_fail_order_create_out_of_stock(self):
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + str(self.user_test_token))
+        self.data['orderItems'][0]['quantity'] = 101
+        response = self.client.post(reverse('add-order'), self.data)
+        self.assertEquals(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEquals(Order.objects.count(), 1)
+
+    """Quote order"""
+
+    def test_quote(self):
+        book = Book.objects.get(title='Book1')
+        response = self.client.post(reverse('quote'), {'orderItems': [
+            {'book': book.pk, 'quantity': 20}, {'book': book.pk + 1000, 'quantity': 1}]})
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+        self.assertEquals(response.data['items'][0]['line_total'], '2000.00')
+        self.assertEquals(response.data['shipping_price'], '300.00')
+        self.assertEquals(response.data['total_price'], '2300.00')
+        self.assertEquals(response.data['missing_books'], [book.pk + 1000])
+        self.assertFalse(response.data['is_available'])
+
+    """Bulk update orders"""
+
+    def test_fail_user_bulk_update(self):
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + str(self.user_test_token))
+        response = self.client.post(reverse('order-bulk-update'), [{'id': self.first_order.id, 'is_paid': True}])
+        self.assertEquals(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_staff_bulk_update(self):
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + str(self.user_staff_test_token))
+        response = self.client.post(reverse('order-bulk-update'), [
+            {'id': self.first_order.id, 'status': 'Доставлен', 'is_paid': True},
+            {'id': self.first_order.id + 1000, 'status': 'Отменен'},
+            {'id': self.first_order.id, 'status': 'Потерян'},
+        ])
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+        self.assertEquals([item['result'] for item in response.data], ['updated', 'not_found', 'invalid'])
+        order = Order.objects.get(id=self.first_order.id)
+        self.assertEquals(order.status, 'Доставлен')
+        self.assertTrue(order.is_paid)
+        self.assertIsNotNone(order.delivery_date)
+        self.assertIsNotNone(order.pay_date)
+
+    def test_staff_bulk_update_keeps_request_order(self):
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + str(self.user_staff_test_token))
+        response = self.client.post(reverse('order-bulk-update'), [
+            {'id': self.first_order.id, 'status': 'Потерян'},
+            {'id': self.first_order.id, 'status': 'Отменен'},
+            {'id': self.first_order.id + 1000, 'is_paid': True},
+            {'id': self.first_order.id, 'status': 'Передан в службу доставки'},
+        ])
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+        self.assertEquals([(item['id'], item['result']) for item in response.data], [
+            (self.first_order.id, 'invalid'), (self.first_order.id, 'updated'),
+            (self.first_order.id + 1000, 'not_found'), (self.first_order.id, 'updated')])
+        self.assertEquals(Order.objects.get(id=self.first_order.id).status, 'Передан в службу доставки')
+
+    """Archive orders"""
+
+    def archive_first_order(self):
+        Order.objects.filter(id=self.first_order.id).update(
+            status='Доставлен', order_date=timezone.now() - timedelta(days=settings.BOOKSHOP_ORDER_ARCHIVE_DAYS + 1))
+        call_command('archive_orders', stdout=StringIO())
+
+    def test_archive_orders(self):
+        self.archive_first_order()
+        self.assertFalse(Order.objects.filter(id=self.first_order.id).exists())
+        archived = ArchivedOrder.objects.get(id=self.first_order.id)
+        self.assertEquals(archived.customer, self.user_test)
+        self.assertEquals(archived.ord_books.get().id, self.ordered_book.id)
+        self.assertEquals(archived.delivery_address.get().address, 'Somewhere')
+
+    def test_order_list_with_archive(self):
+        self.archive_first_order()
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + str(self.user_test_token))
+        response = self.client.get(reverse('order-list'))
+        self.assertEquals(json.loads(b''.join(response.streaming_content)), [])
+        response = self.client.get(reverse('order-list'), {'archive': 'include'})
+        self.assertEquals([order['id'] for order in json.loads(b''.join(response.streaming_content))],
+                          [self.first_order.id])
+
+    def test_order_list_with_archive_ordering(self):
+        self.archive_first_order()
+        second_order = Order.objects.create(customer=self.user_test, total_cost=50)
+        third_order = Order.objects.create(customer=self.user_test, total_cost=150)
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + str(self.user_test_token))
+        for ordering, expected in [('order_date', [self.first_order.id, second_order.id, third_order.id]),
+                                   ('-total_cost', [third_order.id, second_order.id, self.first_order.id])]:
+            response = self.client.get(reverse('order-list'), {'archive': 'include', 'ordering': ordering})
+            self.assertEquals([order['id'] for order in json.loads(b''.join(response.streaming_content))], expected)
+
+    def test_archive_conflict_keeps_orders(self):
+        Order.objects.filter(id=self.first_order.id).update(status='Доставлен')
+        ArchivedOrder.objects.create(id=self.first_order.id, customer=self.user_test, order_date=timezone.now())
+        with self.assertRaises(IntegrityError):
+            archive_orders_batch(timezone.now(), 10)
+        self.assertTrue(Order.objects.filter(id=self.first_order.id).exists())
+
+    def test_order_detail_with_archive(self):
+        self.archive_first_order()
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + str(self.user_test_token))
+        url = reverse('order-detail', kwargs={'pk': self.first_order.id})
+        self.assertEquals(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get(url, {'archive': 'include'})
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+        self.assertEquals(response.data['ord_books'][0]['title'], 'Book1')
+
 
 class UserTests(APITestCase):
     """
@@ -234,6 +670,35 @@ class UserTests(APITestCase):
         self.assertEquals(response.status_code, status.HTTP_200_OK)
 
 
+class BatchTests(APITestCase):
+    """
+    Tests batch requests view
+    """
+
+    def setUp(self):
+        self.user_test = User.objects.create(username='User_TEST', password='dina12345')
+        self.user_test_token = AccessToken.for_user(self.user_test)
+        self.publishing = Publishing.objects.create(name='Издательство')
+
+    def test_batch_requests(self):
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + str(self.user_test_token))
+        response = self.client.post(reverse('batch'), {'requests': [
+            {'path': reverse('profile-detail', kwargs={'pk': self.user_test.id})},
+            {'path': reverse('publishing-detail', kwargs={'pk': self.publishing.id}) + '?format=json'},
+            {'method': 'POST', 'path': reverse('publishing-list'), 'body': {'name': 'Издательство2'}},
+            {'path': reverse('batch')},
+            {'path': '/admin/'},
+        ]})
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+        self.assertEquals([item['status'] for item in response.data], [200, 200, 403, 400, 400])
+        self.assertEquals(response.data[0]['body']['username'], 'User_TEST')
+        self.assertEquals(response.data[1]['body']['name'], 'Издательство')
+
+    def test_fail_empty_batch(self):
+        response = self.client.post(reverse('batch'), {'requests': []})
+        self.assertEquals(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
 class PublishingTests(APITestCase):
     """
     Tests publishing views and publishing serializers
@@ -260,7 +725,7 @@ class PublishingTests(APITestCase):
     """Get publishing detail"""
 
     def test_fail_publishing_detail(self):
-        response = self.client.get(reverse('publishing-detail', kwargs={'pk': 50}))
+        response = self.client.get(reverse('publishing-detail', kwargs={'pk': self.first_publishing.id + 1000}))
         self.assertEquals(response.status_code, status.HTTP_404_NOT_FOUND)
 
     def test_publishing_detail(self):
@@ -280,3 +745,611 @@ class PublishingTests(APITestCase):
         self.assertEquals(response.status_code, status.HTTP_201_CREATED)
 
 
+class SchemaTests(APITestCase):
+    """
+    Tests serving of the pregenerated OpenAPI schema
+    """
+
+    def setUp(self):
+        self.schema_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.schema_dir)
+
+    def test_schema_is_generated_once_and_served_with_etag(self):
+        with override_settings(OPENAPI_SCHEMA_DIR=self.schema_dir):
+            response = self.client.get(reverse('schema-json', kwargs={'format': '.json'}))
+            self.assertEquals(response.status_code, status.HTTP_200_OK)
+            self.assertIn('/api/v1/books/', json.loads(response.content)['paths'])
+
+            response = self.client.get(reverse('schema-json', kwargs={'format': '.json'}),
+                                       HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEquals(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEquals(len(os.listdir(self.schema_dir)), len(SCHEMA_FORMATS))
+
+
+class ProfilerTests(APITestCase):
+    """
+    Tests profiling of a single request by staff
+    """
+
+    def setUp(self):
+        self.user_test = User.objects.create(username='User_TEST', password='dina12345')
+        self.user_test_token = AccessToken.for_user(self.user_test)
+
+        self.user_staff_test = User.objects.create(username='User_TEST_STAFF', password='dina12345', is_staff=True)
+        self.user_staff_test_token = AccessToken.for_user(self.user_staff_test)
+
+        self.profile_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.profile_root)
+        self.settings_override = override_settings(PROFILE_ROOT=self.profile_root)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    def test_user_request_is_not_profiled(self):
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + str(self.user_test_token))
+        response = self.client.get(reverse('book-list'), HTTP_X_PROFILE='cprofile')
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('X-Profile-Id', response)
+
+    def test_staff_request_profile(self):
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + str(self.user_staff_test_token))
+        for mode in ['cprofile', 'sample', 'tracemalloc']:
+            response = self.client.get(reverse('publishing-list'), {'_profile': mode})
+            self.assertEquals(response.status_code, status.HTTP_200_OK)
+            self.assertIn('count=', response['X-Profile-SQL'])
+
+            response = self.client.get(reverse('download-profile', kwargs={'profile_id': response['X-Profile-Id']}),
+                                       {'part': 'sql'})
+            self.assertEquals(response.status_code, status.HTTP_200_OK)
+            self.assertEquals(json.loads(b''.join(response.streaming_content))['mode'], mode)
+
+
+@override_settings(SLOW_QUERY_THRESHOLD_MS=0)
+class SlowQueryTests(APITestCase):
+    """
+    Tests recording of slow queries with their call site and plan
+    """
+
+    def setUp(self):
+        self.user_staff_test = User.objects.create(username='User_TEST_STAFF', password='dina12345', is_staff=True)
+        self.user_staff_test_token = AccessToken.for_user(self.user_staff_test)
+        self.book = Book.objects.create(title='Book1', author='Author', publishing=Publishing.objects.create(name='P'),
+                                        publication_date='2020', description='It is a book', price=100,
+                                        count_in_stock=100)
+        view_counter = ViewCounterBuffer()
+        for patcher in [mock.patch.dict('bookshop.slowlog._explained_at', clear=True),
+                        mock.patch('bookshop.views.view_counter', view_counter)]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(view_counter.flush)
+
+    def test_normalize_sql(self):
+        self.assertEquals(normalize_sql('SELECT "t"."id" FROM "t" WHERE "t"."id" IN (%s, %s, %s)\n AND "t"."name" = '
+                                        '\'It\'\'s\' LIMIT 21'),
+                          'SELECT "t"."id" FROM "t" WHERE "t"."id" IN (...) AND "t"."name" = ? LIMIT ?')
+
+    def test_slow_queries_are_aggregated(self):
+        for _ in range(2):
+            self.client.get(reverse('book-detail', kwargs={'pk': self.book.id}))
+
+        query = SlowQuery.objects.get(call_site__startswith='BookDetailSerializer.book_comments')
+        self.assertEquals(query.view, 'book-detail')
+        self.assertEquals(query.calls, 2)
+        self.assertIn('bookshop/', query.call_site)
+        self.assertIn('Plan', query.plan[0])
+
+        self.assertEquals(self.client.get(reverse('slow-query-list')).status_code, status.HTTP_401_UNAUTHORIZED)
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + str(self.user_staff_test_token))
+        response = self.client.get(reverse('slow-query-list'), {'order': 'calls', 'limit': 1})
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+        self.assertEquals(response.data[0]['calls'], 2)
+        response = self.client.get(reverse('slow-query-detail', kwargs={'fingerprint': query.fingerprint}))
+        self.assertIn('plan', response.data)
+
+        out = StringIO()
+        call_command('slow_queries', '--order', 'calls', stdout=out)
+        self.assertIn(query.fingerprint, out.getvalue())
+
+
+class MetricsTests(APITestCase):
+    """
+    Tests Prometheus metrics exposition
+    """
+
+    def test_metrics(self):
+        self.client.get(reverse('book-list'))
+        response = self.client.get(reverse('metrics'))
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+        content = response.content.decode()
+        self.assertIn('bookshop_request_duration_seconds_count{method="GET",status="200",view="book-list"}', content)
+        self.assertIn('bookshop_request_db_queries_count{view="book-list"}', content)
+
+    def test_login_is_counted_once(self):
+        def count_tokens():
+            return [REGISTRY.get_sample_value('bookshop_tokens_issued_total', {'kind': kind}) or 0
+                    for kind in ('obtain', 'profile')]
+
+        User.objects.create_user(username='User_TEST', password='dina12345')
+        obtained, profiles = count_tokens()
+        response = self.client.post(reverse('token_obtain_pair'), {'username': 'User_TEST', 'password': 'dina12345'})
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+        self.assertEquals(count_tokens(), [obtained + 1, profiles])
+
+    @override_settings(METRICS_ALLOWED_IPS=['10.0.0.1'])
+    def test_fail_metrics_from_other_address(self):
+        response = self.client.get(reverse('metrics'))
+        self.assertEquals(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_fail_metrics_through_proxy(self):
+        response = self.client.get(reverse('metrics'), HTTP_X_FORWARDED_FOR='203.0.113.5')
+        self.assertEquals(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(METRICS_ALLOWED_IPS=[], METRICS_TOKEN='secret')
+    def test_metrics_with_token(self):
+        response = self.client.get(reverse('metrics'), HTTP_X_FORWARDED_FOR='203.0.113.5',
+                                   HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer wrong')
+        self.assertEquals(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class AdminTests(APITestCase):
+    """
+    Tests admin changelists of large tables
+    """
+
+    def setUp(self):
+        self.superuser = User.objects.create_superuser(username='User_TEST_ADMIN', password='dina12345')
+        self.client.force_login(self.superuser)
+        self.publishing = Publishing.objects.create(name='Издательство')
+
+    def create_orders(self, number):
+        for index in range(number):
+            order = Order.objects.create(customer=self.superuser)
+            book = Book.objects.create(title=f'Book{index}', author='Author', publishing=self.publishing,
+                                       publication_date='2020', description='It is a book', price=100)
+            OrderedBook.objects.create(ord_book=book, quantity=1, price=100, order=order)
+            DeliveryAddress.objects.create(order=order, address='Somewhere', phone_number='+12345678910')
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+        return len(context.captured_queries)
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        urls = [reverse(f'admin:bookshop_{model}_changelist')
+                for model in ('book', 'order', 'orderedbook', 'deliveryaddress')]
+        self.create_orders(1)
+        queries = [self.count_queries(url) for url in urls]
+        self.create_orders(5)
+        for url, number in zip(urls, queries):
+            with self.assertNumQueries(number):
+                self.client.get(url)
+
+    @override_settings(ADMIN_EXACT_COUNT_LIMIT=2)
+    def test_changelist_estimated_count(self):
+        self.create_orders(3)
+        response = self.client.get(reverse('admin:bookshop_book_changelist'))
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+        self.assertGreaterEqual(response.context['cl'].result_count, 3)
+        response = self.client.get(reverse('admin:bookshop_book_changelist'), {'q': 'Book'})
+        self.assertGreaterEqual(response.context['cl'].result_count, 1)
+
+
+@mock.patch.object(CostRateThrottle, 'THROTTLE_RATES', {'anon': '10/min', 'user': '20/min'})
+class ThrottlingTests(APITestCase):
+    """
+    Tests cost-based request throttling
+    """
+
+    def setUp(self):
+        cache.clear()
+        Publishing.objects.create(name='Издательство')
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_throttle_headers(self):
+        response = self.client.get(reverse('publishing-list'))
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+        self.assertEquals(response['X-RateLimit-Limit'], '10')
+        self.assertEquals(response['X-RateLimit-Remaining'], '9')
+        self.assertEquals(response['X-RateLimit-Cost'], '1')
+
+    def test_fail_expensive_requests(self):
+        for remaining in ('5', '0'):
+            response = self.client.get(reverse('book-list'), {'keyword': 'Book'})
+            self.assertEquals(response.status_code, status.HTTP_200_OK)
+            self.assertEquals(response['X-RateLimit-Remaining'], remaining)
+        response = self.client.get(reverse('book-list'), {'keyword': 'Book'})
+        self.assertEquals(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEquals(response['Retry-After'], '30')
+
+    def test_users_have_own_buckets(self):
+        for _ in range(2):
+            self.client.get(reverse('book-list'), {'keyword': 'Book'})
+        user = User.objects.create(username='User_TEST', password='dina12345')
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + str(AccessToken.for_user(user)))
+        response = self.client.get(reverse('book-list'), {'keyword': 'Book'})
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+        self.assertEquals(response['X-RateLimit-Limit'], '20')
+
+    def test_parallel_requests_share_bucket(self):
+        original_get = LocMemCache.get
+
+        def slow_get(*args, **kwargs):
+            value = original_get(*args, **kwargs)
+            time.sleep(0.01)
+            return value
+
+        results = []
+        with mock.patch.object(LocMemCache, 'get', slow_get):
+            threads = [threading.Thread(target=lambda: results.append(AnonCostRateThrottle().allow_request(
+                Request(APIRequestFactory().get('/')), object()))) for _ in range(15)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        # Requests finding the bucket locked are throttled, the others spend tokens only once
+        tokens, _ = cache.get('throttle_bucket_anon_127.0.0.1')
+        self.assertLessEqual(results.count(True), 10)
+        self.assertEquals(int(tokens), 10 - results.count(True))
+
+    def test_fail_request_while_bucket_is_locked(self):
+        cache.add('throttle_bucket_anon_127.0.0.1_lock', True)
+        started = time.monotonic()
+        response = self.client.get(reverse('publishing-list'))
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEquals(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEquals(response['Retry-After'], '1')
+
+
+class ObjectCacheTests(APITestCase):
+    """
+    Tests two-tier object cache of publishing houses
+    """
+
+    def setUp(self):
+        cache.clear()
+        publishing_cache.clear_local()
+        self.publishing_houses = [Publishing.objects.create(name=f'Издательство{index}') for index in range(3)]
+
+    def test_get_many(self):
+        ids = [publishing.pk for publishing in self.publishing_houses]
+        with self.assertNumQueries(1):
+            self.assertEquals(sorted(publishing_cache.get_many(ids)), ids)
+        publishing_cache.clear_local()
+        with self.assertNumQueries(0):
+            self.assertEquals(publishing_cache.get(ids[0]).name, 'Издательство0')
+
+    def test_invalidate_on_save(self):
+        publishing_cache.get(self.publishing_houses[0].pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.publishing_houses[0].name = 'New name'
+            self.publishing_houses[0].save()
+            publishing_cache.clear_local()
+            # The old version is kept until the transaction commits
+            self.assertEquals(publishing_cache.get(self.publishing_houses[0].pk).name, 'Издательство0')
+        publishing_cache.clear_local()
+        self.assertEquals(publishing_cache.get(self.publishing_houses[0].pk).name, 'New name')
+
+    def test_single_flight(self):
+        publishing = self.publishing_houses[0]
+        loads = []
+
+        def slow_load(pks):
+            loads.append(pks)
+            time.sleep(0.1)
+            return {publishing.pk: publishing}
+
+        results = []
+        with mock.patch.object(publishing_cache, 'load_from_db', side_effect=slow_load):
+            threads = [threading.Thread(target=lambda: results.append(publishing_cache.get(publishing.pk)))
+                       for _ in range(5)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEquals(loads, [[publishing.pk]])
+        self.assertEquals([result.name for result in results], ['Издательство0'] * 5)
+
+
+class BookEventsTests(APITestCase):
+    """
+    Tests server-sent events of stock and price changes
+    """
+
+    def setUp(self):
+        publishing = Publishing.objects.create(name='Издательство')
+        self.book = Book.objects.create(title='Book1', author='Author', publishing=publishing,
+                                        publication_date='2020', description='It is a book', price=100,
+                                        count_in_stock=10)
+
+    @override_settings(BOOKSHOP_EVENTS_MAX_AGE=0)
+    async def test_book_events(self):
+        response = await self.async_client.get(reverse('book-events'), {'books': str(self.book.pk)})
+        self.assertEquals(response['Content-Type'], 'text/event-stream')
+        events = [event async for event in response.streaming_content]
+        self.assertEquals(events, ['event: stock\ndata: [{}]\n\n'.format(json.dumps(
+            {'id': self.book.pk, 'count_in_stock': 10, 'price': '100.00'})).encode()])
+        self.assertFalse(broadcaster.has_subscribers())
+
+    @override_settings(BOOKSHOP_EVENTS_INTERVAL=0.01)
+    async def test_changes_are_coalesced(self):
+        subscription = broadcaster.subscribe([self.book.pk])
+        try:
+            for count in (9, 8, 7):
+                broadcaster.publish({self.book.pk: {'count_in_stock': count, 'price': '100.00'}})
+            broadcaster.publish({self.book.pk + 1: {'count_in_stock': 1, 'price': '100.00'}})
+            self.assertEquals(await subscription.next(1), {self.book.pk: {'count_in_stock': 7, 'price': '100.00'}})
+            self.assertEquals(await subscription.next(0.05), {})
+        finally:
+            broadcaster.unsubscribe(subscription)
+
+    def test_fail_book_events_without_books(self):
+        response = self.client.get(reverse('book-events'), {'books': 'one'})
+        self.assertEquals(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@mock.patch('bookshop.suggest._index', None)
+class SuggestTests(APITestCase):
+    """
+    Tests title autocomplete
+    """
+
+    def setUp(self):
+        publishing = Publishing.objects.create(name='Издательство')
+        self.book = Book.objects.create(title='Война и мир', author='Лев Толстой', publishing=publishing,
+                                        publication_date='2020', description='It is a book', price=100,
+                                        count_in_stock=10)
+        Book.objects.create(title='Мир полудня', author='Стругацкие', publishing=publishing,
+                            publication_date='2020', description='It is a book', price=100)
+
+    def test_suggest(self):
+        response = self.client.get(reverse('book-suggest'), {'q': 'МИР'})
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+        self.assertEquals([book['title'] for book in response.data], ['Война и мир', 'Мир полудня'])
+        self.assertEquals([book['in_stock'] for book in response.data], [True, False])
+        response = self.client.get(reverse('book-suggest'), {'q': 'толс'})
+        self.assertEquals([book['id'] for book in response.data], [self.book.pk])
+
+    def test_suggest_index_is_updated(self):
+        self.client.get(reverse('book-suggest'), {'q': 'мир'})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book.title = 'Анна Каренина'
+            self.book.save()
+        response = self.client.get(reverse('book-suggest'), {'q': 'мир'})
+        self.assertEquals([book['title'] for book in response.data], ['Мир полудня'])
+        response = self.client.get(reverse('book-suggest'), {'q': 'карен'})
+        self.assertEquals([book['id'] for book in response.data], [self.book.pk])
+
+    def test_suggest_index_ignores_rolled_back_changes(self):
+        self.client.get(reverse('book-suggest'), {'q': 'мир'})
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(ValueError), transaction.atomic():
+                self.book.title = 'Анна Каренина'
+                self.book.save()
+                raise ValueError
+        response = self.client.get(reverse('book-suggest'), {'q': 'мир'})
+        self.assertEquals([book['title'] for book in response.data], ['Война и мир', 'Мир полудня'])
+
+    def test_suggest_snapshot(self):
+        path = os.path.join(tempfile.mkdtemp(), 'suggest.json.gz')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        call_command('snapshot_suggest_index', path=path, stdout=StringIO())
+        index = SuggestIndex.from_snapshot(path)
+        self.assertEquals([book['title'] for book in index.suggest('война', 10)], ['Война и мир'])
+
+
+class SuggestRefreshTests(APITransactionTestCase):
+    """
+    Tests refresh of the autocomplete index from the change feed
+    """
+
+    def setUp(self):
+        publishing = Publishing.objects.create(name='Издательство')
+        self.books = [Book.objects.create(title=title, author='Лев Толстой', publishing=publishing,
+                                          publication_date='2020', description='It is a book', price=100)
+                      for title in ('Война и мир', 'Анна Каренина')]
+        self.index = SuggestIndex.from_database()
+
+    def change_books(self):
+        # Changes made by another process do not reach this index through signals
+        Book.objects.filter(pk=self.books[0].pk).update(title='Воскресение', updated_at=timezone.now())
+        self.books[1].delete()
+
+    def test_apply_changes(self):
+        self.change_books()
+        self.assertTrue(self.index.apply_changes())
+        self.assertEquals([book['title'] for book in self.index.suggest('толстой', 10)], ['Воскресение'])
+        self.assertEquals(self.index.suggest('война', 10), [])
+        self.assertTrue(self.index.apply_changes())
+        self.assertEquals([book['title'] for book in self.index.suggest('толстой', 10)], ['Воскресение'])
+
+    @override_settings(BOOKSHOP_SUGGEST_MAX_CHANGES=1)
+    def test_too_many_changes(self):
+        self.change_books()
+        self.assertFalse(self.index.apply_changes())
+        self.assertEquals(len(self.index.suggest('толстой', 10)), 2)
+
+    def test_snapshot_is_brought_up_to_date(self):
+        path = os.path.join(tempfile.mkdtemp(), 'suggest.json.gz')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        self.index.write_snapshot(path)
+        self.change_books()
+        index = SuggestIndex.from_snapshot(path)
+        self.assertTrue(index.apply_changes())
+        self.assertEquals([book['title'] for book in index.suggest('толстой', 10)], ['Воскресение'])
+
+
+class CatalogSyncTests(APITransactionTestCase):
+    """
+    Tests incremental catalog synchronization
+    """
+
+    def setUp(self):
+        self.publishing = Publishing.objects.create(name='Издательство')
+        self.books = [Book.objects.create(title=f'Book{index}', author='Author', publishing=self.publishing,
+                                          publication_date='2020', description='It is a book', price=100)
+                      for index in range(3)]
+
+    def test_changes(self):
+        response = self.client.get(reverse('book-changes'))
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+        self.assertEquals([book['id'] for book in response.data['books']], [book.pk for book in self.books])
+        self.assertEquals([item['name'] for item in response.data['publishing_houses']], ['Издательство'])
+        self.assertFalse(response.data['has_more'])
+
+        self.books[0].price = 200
+        self.books[0].save()
+        deleted_id = self.books[1].pk
+        self.books[1].delete()
+        response = self.client.get(reverse('book-changes'), {'since': response.data['token']})
+        self.assertEquals([book['price'] for book in response.data['books']], ['200.00'])
+        self.assertEquals(response.data['deleted'], {'books': [deleted_id], 'publishing_houses': []})
+        self.assertEquals(response.data['publishing_houses'], [])
+
+    @override_settings(BOOKSHOP_SYNC_PAGE_SIZE=1)
+    def test_changes_pages(self):
+        ids, token, has_more = [], '', True
+        while has_more:
+            response = self.client.get(reverse('book-changes'), {'since': token})
+            ids += [book['id'] for book in response.data['books']]
+            token, has_more = response.data['token'], response.data['has_more']
+        self.assertEquals(ids, [book.pk for book in self.books])
+
+    def test_changes_committed_late(self):
+        changed, commit = threading.Event(), threading.Event()
+
+        def change_book():
+            with transaction.atomic():
+                Book.objects.get(pk=self.books[0].pk).save()
+                changed.set()
+                commit.wait(5)
+            connection.close()
+
+        thread = threading.Thread(target=change_book)
+        thread.start()
+        changed.wait(5)
+        self.books[1].save()
+        response = self.client.get(reverse('book-changes'))
+        self.assertEquals([book['id'] for book in response.data['books']], [self.books[0].pk, self.books[2].pk])
+        commit.set()
+        thread.join()
+
+        response = self.client.get(reverse('book-changes'), {'since': response.data['token']})
+        self.assertEquals([book['id'] for book in response.data['books']], [self.books[0].pk, self.books[1].pk])
+
+    def test_fail_changes_with_invalid_token(self):
+        response = self.client.get(reverse('book-changes'), {'since': 'yesterday'})
+        self.assertEquals(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(reverse('book-changes'), {'since': '1760000000000000'})
+        self.assertEquals(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class WarmUpTests(APITestCase):
+    """
+    Tests warm-up of the process before serving requests
+    """
+
+    def test_warm_up(self):
+        publishing = Publishing.objects.create(name='Издательство')
+        publishing_cache.clear_local()
+        with mock.patch('bookshop.warmup.connections') as connections, mock.patch('bookshop.warmup.gc') as gc, \
+                mock.patch('bookshop.suggest._index', None):
+            timings = warm_up()
+            self.assertIsNotNone(get_loaded_suggest_index())
+
+        self.assertEquals(list(timings), ['urls', 'serializers', 'catalog', 'schemas'])
+        with self.assertNumQueries(0):
+            self.assertEquals(publishing_cache.get(publishing.pk).name, 'Издательство')
+        connections.close_all.assert_called_once_with()
+        gc.freeze.assert_called_once_with()
+
+
+class CatalogSnapshotTests(APITestCase):
+    """
+    Tests prebuilt catalog snapshot for anonymous clients
+    """
+
+    def setUp(self):
+        self.user_test = User.objects.create(username='User_TEST', password='dina12345')
+        self.snapshot_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.snapshot_dir)
+        self.publishing = Publishing.objects.create(name='Издательство')
+        self.books = [Book.objects.create(title=f'Book{index}', author='Author', publishing=self.publishing,
+                                          publication_date='2020', description='It is a book', price=100,
+                                          count_in_stock=index) for index in range(3)]
+
+    def read_shard(self, name):
+        shard = read_manifest(self.snapshot_dir)['shards'][name]
+        with gzip.open(os.path.join(self.snapshot_dir, shard['file'] + '.gz'), 'rt', encoding='utf-8') as stream:
+            return json.load(stream)
+
+    def test_snapshot_matches_api(self):
+        self.assertEquals(build_catalog_snapshot(self.snapshot_dir, 10 ** 9), {'written': 3, 'kept': 0, 'removed': 0})
+        books = sorted(self.client.get(reverse('book-list')).json(), key=lambda book: book['id'])
+        for book in books:
+            book['image'] = book['image'].replace('http://testserver', '')
+        self.assertEquals(self.read_shard('books/0'), books)
+        self.assertEquals(self.read_shard(f'publishers/{self.publishing.pk}'), self.read_shard('books/0'))
+        self.assertEquals(self.read_shard('publishing-houses'), self.client.get(reverse('publishing-list')).json())
+
+    def test_only_changed_shards_are_rebuilt(self):
+        page_size = self.books[2].pk
+        build_catalog_snapshot(self.snapshot_dir, page_size)
+        old_file = read_manifest(self.snapshot_dir)['shards']['books/1']['file']
+        self.assertEquals(build_catalog_snapshot(self.snapshot_dir, page_size), {'written': 0, 'kept': 4, 'removed': 0})
+
+        Comments.objects.create(book=self.books[2], rating=4, comment_author=self.user_test, comment='Good')
+        call_command('refresh_popularity', stdout=StringIO())
+        result = build_catalog_snapshot(self.snapshot_dir, page_size)
+        self.assertEquals((result['written'], result['kept']), (2, 2))
+        self.assertEquals(self.read_shard('books/1')[0]['reviews'], 1)
+        self.assertTrue(os.path.exists(os.path.join(self.snapshot_dir, old_file + '.gz')))
+
+        self.assertEquals(build_catalog_snapshot(self.snapshot_dir, page_size)['removed'], 2)
+        self.assertFalse(os.path.exists(os.path.join(self.snapshot_dir, old_file + '.gz')))
+
+
+class MessagePackTests(APITestCase):
+    """
+    Tests MessagePack renderer and parser
+    """
+
+    def setUp(self):
+        self.user_test = User.objects.create(username='User_TEST', password='dina12345')
+        self.user_test_token = AccessToken.for_user(self.user_test)
+        self.user_staff_test = User.objects.create(username='User_TEST_STAFF', password='dina12345', is_staff=True)
+        self.user_staff_test_token = AccessToken.for_user(self.user_staff_test)
+        Book.objects.create(title='Book1', author='Author', publishing=Publishing.objects.create(name='Издательство'),
+                            publication_date='2020', description='It is a book', price=100, count_in_stock=100)
+        Order.objects.create(customer=self.user_test, total_cost=Decimal('250.50'))
+
+    @staticmethod
+    def unpack(response):
+        return msgpack.unpackb(response.content, ext_hook=decode_msgpack_ext, timestamp=3)
+
+    def test_native_decimals_and_timestamps(self):
+        response = self.client.get(reverse('book-list'), HTTP_ACCEPT='application/msgpack')
+        self.assertEquals(response['Content-Type'], 'application/msgpack')
+        self.assertEquals(self.unpack(response)[0]['price'], Decimal('100.00'))
+        self.assertEquals(self.client.get(reverse('book-list')).json()[0]['price'], '100.00')
+
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + str(self.user_test_token))
+        order = self.unpack(self.client.get(reverse('order-list'), {'format': 'msgpack'}))[0]
+        self.assertEquals(order['total_cost'], Decimal('250.50'))
+        self.assertIsInstance(order['order_date'], datetime)
+        order = json.loads(b''.join(self.client.get(reverse('order-list')).streaming_content))[0]
+        self.assertEquals(order['total_cost'], '250.50')
+        self.assertEquals(order['order_date'], timezone.localtime().strftime('%d/%m/%y'))
+
+    def test_parse_request(self):
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + str(self.user_staff_test_token))
+        response = self.client.post(reverse('publishing-list'), msgpack.packb({'name': 'Издательство2'}),
+                                    content_type='application/msgpack')
+        self.assertEquals(response.status_code, status.HTTP_201_CREATED)
+        response = self.client.post(reverse('publishing-list'), b'\xc1', content_type='application/msgpack')
+        self.assertEquals(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEquals(msgpack.unpackb(msgpack.packb(Decimal('1.10'), default=encode_msgpack_ext),
+                                          ext_hook=decode_msgpack_ext), Decimal('1.10'))
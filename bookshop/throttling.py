@@ -0,0 +1,85 @@
+from rest_framework.throttling import SimpleRateThrottle
+
+
+def get_request_cost(request, view):
+    """
+    Returns number of tokens the request takes from the bucket: throttle_cost of the view or its cost for the action
+    from throttle_action_costs, plus throttle_param_costs of every query parameter given in the request
+    """
+    action = getattr(view, 'action', None)
+    cost = getattr(view, 'throttle_action_costs', {}).get(action, getattr(view, 'throttle_cost', 1))
+    for param, param_cost in getattr(view, 'throttle_param_costs', {}).items():
+        if request.query_params.get(param):
+            cost += param_cost
+    return cost
+
+
+class CostRateThrottle(SimpleRateThrottle):
+    """
+    Token bucket throttle. The rate from DEFAULT_THROTTLE_RATES is the bucket size and how many tokens are refilled
+    per period, every request takes as many tokens as it costs. The bucket is kept in the cache backend and is
+    changed under a lock taken with cache.add, so that parallel requests of one client do not spend the same tokens.
+    A request which finds the lock taken is throttled at once instead of waiting for it
+    """
+
+    cache_format = 'throttle_bucket_%(scope)s_%(ident)s'
+    lock_timeout = 1
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        cost = min(get_request_cost(request, view), self.num_requests)
+        lock_key = f'{self.key}_lock'
+        if not self.cache.add(lock_key, True, self.lock_timeout):
+            self.wait_seconds = self.lock_timeout
+            request._request.throttle_budget = {'limit': self.num_requests, 'remaining': 0, 'cost': cost}
+            return False
+        try:
+            self.now = self.timer()
+            tokens, updated = self.cache.get(self.key, (self.num_requests, self.now))
+            tokens = min(self.num_requests, tokens + (self.now - updated) * self.num_requests / self.duration)
+
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+                self.wait_seconds = None
+            else:
+                self.wait_seconds = (cost - tokens) * self.duration / self.num_requests
+            self.cache.set(self.key, (tokens, self.now), self.duration)
+        finally:
+            self.cache.delete(lock_key)
+        request._request.throttle_budget = {'limit': self.num_requests, 'remaining': int(tokens), 'cost': cost}
+        return allowed
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class AnonCostRateThrottle(CostRateThrottle):
+    """
+    Limits anonymous users by IP address
+    """
+
+    scope = 'anon'
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            return None
+        return self.cache_format % {'scope': self.scope, 'ident': self.get_ident(request)}
+
+
+class UserCostRateThrottle(CostRateThrottle):
+    """
+    Limits authenticated users by user id
+    """
+
+    scope = 'user'
+
+    def get_cache_key(self, request, view):
+        if not request.user or not request.user.is_authenticated:
+            return None
+        return self.cache_format % {'scope': self.scope, 'ident': request.user.pk}
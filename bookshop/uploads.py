@@ -0,0 +1,138 @@
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ImageUpload
+
+IMAGE_FORMATS = {'JPEG': '.jpg', 'PNG': '.png', 'WEBP': '.webp'}
+
+
+class UploadError(Exception):
+    """
+    Raised when the upload can not be accepted, with the message for the client and the HTTP status
+    """
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def check_image_header(stream):
+    """
+    Returns the image format read from the image header, checking that it is a supported format and that the image
+    is not larger than BOOKSHOP_IMAGE_MAX_SIDE pixels. Does not decode the image data
+    """
+    from PIL import Image, UnidentifiedImageError
+
+    try:
+        with Image.open(stream) as image:
+            image_format, (width, height) = image.format, image.size
+    except (UnidentifiedImageError, OSError):
+        raise UploadError('Файл не является изображением')
+    if image_format not in IMAGE_FORMATS:
+        raise UploadError('Неподдерживаемый формат изображения')
+    if max(width, height) > settings.BOOKSHOP_IMAGE_MAX_SIDE:
+        raise UploadError('Слишком большое изображение')
+    return image_format
+
+
+def check_image_size(size):
+    if size > settings.BOOKSHOP_IMAGE_MAX_SIZE:
+        raise UploadError('Слишком большой файл', status_code=413)
+
+
+def start_upload(book, user, file_name, size):
+    """
+    Creates an upload of the book image and an empty temporary file for it, removing expired uploads
+    """
+    check_image_size(size)
+    expired = ImageUpload.objects.filter(
+        created_at__lt=timezone.now() - timedelta(hours=settings.BOOKSHOP_UPLOAD_EXPIRE_HOURS))[:100]
+    for upload in expired:
+        discard_upload(upload)
+
+    os.makedirs(settings.UPLOAD_TEMP_DIR, exist_ok=True)
+    upload = ImageUpload.objects.create(book=book, uploaded_by=user, file_name=file_name, size=size)
+    open(upload.temp_path, 'wb').close()
+    return upload
+
+
+def append_chunk(upload_id, offset, chunk):
+    """
+    Appends the chunk sent from the offset to the temporary file and checks the image header as soon as enough bytes
+    are received. A chunk sent from a wrong offset is rejected with the current offset, so the client can resume.
+    Returns the upload
+    """
+    error = None
+    with transaction.atomic():
+        upload = ImageUpload.objects.select_for_update().get(id=upload_id)
+        if offset != upload.received:
+            raise UploadError(f'Ожидается смещение {upload.received}', status_code=409)
+        if upload.received + len(chunk) > upload.size:
+            raise UploadError('Получено больше данных, чем заявлено', status_code=413)
+
+        with open(upload.temp_path, 'r+b') as temp_file:
+            temp_file.truncate(upload.received)
+            temp_file.seek(upload.received)
+            temp_file.write(chunk)
+        upload.received += len(chunk)
+
+        if not upload.image_format and upload.received >= min(upload.size, settings.BOOKSHOP_IMAGE_HEADER_SIZE):
+            with open(upload.temp_path, 'rb') as temp_file:
+                try:
+                    upload.image_format = check_image_header(temp_file)
+                except UploadError as exc:
+                    error = exc
+        if error is None:
+            upload.save(update_fields=['received', 'image_format'])
+
+    if error is not None:
+        discard_upload(upload)
+        raise error
+    return upload
+
+
+def complete_upload(upload_id):
+    """
+    Verifies the fully received image, stores it and attaches it to the book with one update. Returns the book
+    """
+    from PIL import Image
+
+    with transaction.atomic():
+        upload = ImageUpload.objects.select_for_update().select_related('book').get(id=upload_id)
+        if upload.received != upload.size:
+            raise UploadError(f'Получено {upload.received} из {upload.size} байт', status_code=409)
+        with open(upload.temp_path, 'rb') as temp_file:
+            try:
+                with Image.open(temp_file) as image:
+                    image.verify()
+            except Exception:
+                raise UploadError('Изображение повреждено')
+            temp_file.seek(0)
+            book = upload.book
+            name = 'upload' + IMAGE_FORMATS[upload.image_format]
+            book.image.save(name, File(temp_file, name=name), save=False)
+        book.save(update_fields=['image', 'updated_at'])
+        upload.delete()
+    _remove_temp_file(upload.temp_path)
+    return book
+
+
+def discard_upload(upload):
+    """
+    Removes the upload and its temporary file
+    """
+    ImageUpload.objects.filter(pk=upload.pk).delete()
+    _remove_temp_file(upload.temp_path)
+
+
+def _remove_temp_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -6,15 +6,25 @@ from . import views
 router = routers.SimpleRouter()
 router.register(r'books', views.BookViewSet, basename='book')
 router.register(r'publishing-houses', views.PublishingViewSet)
+router.register(r'authors', views.AuthorViewSet)
 router.register(r'orders', views.OrderViewSet, basename='order')
 router.register(r'users', views.UserViewSet, basename='users')
 router.register(r'profile', views.ProfileViewSet, basename='profile')
 router.register(r'comment', views.CommentAPIView)
 
 urlpatterns = [
+    path('books/events/', views.book_events, name='book-events'),
     path('', include(router.urls)),
+    path('quote/', views.quote_order, name='quote'),
     path('add-order/', views.add_ordered_books, name='add-order'),
     path('pay/<str:pk>/', views.update_order_to_pay, name='pay-order'),
     path('upload_image/', views.upload_image, name='upload-image'),
+    path('image-uploads/', views.start_image_upload, name='image-upload-list'),
+    path('image-uploads/<uuid:upload_id>/', views.image_upload, name='image-upload-detail'),
+    path('image-uploads/<uuid:upload_id>/complete/', views.complete_image_upload, name='image-upload-complete'),
     path('order_status/<str:pk>/', views.update_order_status, name='update-order-status'),
+    path('batch/', views.batch_requests, name='batch'),
+    path('profiles/<str:profile_id>/', views.download_profile, name='download-profile'),
+    path('slow-queries/', views.slow_queries, name='slow-query-list'),
+    path('slow-queries/<str:fingerprint>/', views.slow_query_detail, name='slow-query-detail'),
 ]
@@ -1,22 +1,125 @@
+import asyncio
+import heapq
+import json
+import os
+
 from django.contrib.auth.models import User
-from django.db.models import Avg, Count, Q
+from django.conf import settings
+from django.db import transaction
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.crypto import constant_time_compare
+from django.views.static import serve
+from django.db.models import Count, Q
+from django.shortcuts import get_object_or_404
 from rest_framework import filters, status, mixins
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
-from rest_framework.viewsets import ModelViewSet, GenericViewSet
+from rest_framework.viewsets import ModelViewSet, GenericViewSet, ReadOnlyModelViewSet
 from datetime import datetime
-from .models import Book, Publishing, Order, DeliveryAddress, OrderedBook, Comments
+from .models import Book, Publishing, Order, DeliveryAddress, OrderedBook, Comments, Author, ArchivedOrder, \
+    ImageUpload, SlowQuery
 from .serializers import PublishingDetailSerializer, BookListSerializer, BookDetailSerializer, \
     OrderDetailSerializer, OrderListSerializer, CommentCreateSerializer, MyTokenObtainPairSerializer, \
-    CustomerSerializer, CustomerSerializerWithToken, BookCreateSerializer
-
+    CustomerSerializer, CustomerSerializerWithToken, BookCreateSerializer, AuthorSerializer, OrderBulkUpdateSerializer, \
+    BatchSerializer, QuoteRequestSerializer, QuoteSerializer, CatalogChangesSerializer, ImageUploadSerializer, \
+    SlowQuerySerializer, SlowQueryDetailSerializer
+
+from .batch import execute_batch
+from .counters import view_counter
+from .events import book_state, broadcaster
+from .metrics import ORDERS_PLACED, STOCK_OUTS, TOKENS_ISSUED, render_metrics
+from .middleware import PROFILE_EXTENSIONS
+from .slowlog import SLOW_QUERY_ORDERINGS
+from .storage import is_content_addressed
+from .suggest import get_suggest_index
+from .uploads import UploadError, append_chunk, check_image_header, check_image_size, complete_upload, \
+    start_upload
+from .renderers import StreamingJSONRenderer, compress_stream, negotiate_encoding
 from .permissions import IsAdminUserOrReadOnly, IsOwner, IsOrderOwner, IsCommentOwner
-from .service import BookFilter
+from .service import BookFilter, get_book_facets, bulk_update_orders, build_quote, reserve_books, \
+    get_catalog_changes, parse_sync_token, ORDER_MAX_TOTAL
 from rest_framework_simplejwt.views import TokenObtainPairView
 
 
+class Descending:
+    """
+    Wraps a sort key so that it sorts in reverse
+    """
+
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+
+def get_ordering_key(ordering):
+    """
+    Returns the sort key of model instances for field names as in QuerySet.order_by(), "-" marking descending order.
+    Empty values sort last in ascending order, as in PostgreSQL
+    """
+    fields = [(name.lstrip('-'), name.startswith('-')) for name in ordering]
+
+    def key(instance):
+        values = []
+        for name, descending in fields:
+            value = getattr(instance, name)
+            value = (value is None, value)
+            values.append(Descending(value) if descending else value)
+        return values
+    return key
+
+
+class StreamingListMixin:
+    """
+    Streams JSON list responses item by item from the queryset iterator, compressed when the client accepts it
+    """
+
+    def get_list_querysets(self):
+        """
+        Returns filtered querysets whose items are listed together
+        """
+        return [self.filter_queryset(self.get_queryset())]
+
+    def iter_list(self, querysets):
+        """
+        Yields instances of the querysets. Instances of several querysets are merged in the order of the first one
+        """
+        chunk_size = settings.BOOKSHOP_STREAMING_CHUNK_SIZE
+        if len(querysets) == 1:
+            return querysets[0].iterator(chunk_size=chunk_size)
+        ordering = [*(querysets[0].query.order_by or querysets[0].model._meta.ordering), 'pk']
+        return heapq.merge(*[queryset.order_by(*ordering).iterator(chunk_size=chunk_size) for queryset in querysets],
+                           key=get_ordering_key(ordering))
+
+    def list(self, request, *args, **kwargs):
+        if self.paginator is not None:
+            return super().list(request, *args, **kwargs)
+
+        instances = self.iter_list(self.get_list_querysets())
+        if request.accepted_renderer.format != 'json':
+            return Response(self.get_serializer(list(instances), many=True).data)
+
+        serializer = self.get_serializer_class()(context=self.get_serializer_context())
+        items = (serializer.to_representation(instance) for instance in instances)
+        content, encoding = compress_stream(StreamingJSONRenderer().render_iter(items), negotiate_encoding(request),
+                                            settings.BOOKSHOP_STREAMING_COMPRESSION_MIN_SIZE)
+
+        response = StreamingHttpResponse(content, content_type='application/json')
+        if encoding is not None:
+            response['Content-Encoding'] = encoding
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
+
 class PublishingViewSet(ModelViewSet):
     """
     Represents a publishing house
@@ -35,9 +138,12 @@ class BookViewSet(ModelViewSet):
     """
 
     permission_classes = (IsAdminUserOrReadOnly,)
-    filter_backends = [filters.SearchFilter, DjangoFilterBackend]
+    filter_backends = [filters.SearchFilter, DjangoFilterBackend, filters.OrderingFilter]
     search_fields = ['title']
     filterset_class = BookFilter
+    ordering_fields = ['popularity', 'average_rating', 'price', 'publication_date']
+    throttle_param_costs = {'keyword': 4, 'search': 4, 'facets': 9}
+    throttle_action_costs = {'changes': 5}
 
     def get_serializer_class(self):
         if self.action in ['list']:
@@ -47,20 +153,80 @@ class BookViewSet(ModelViewSet):
         else:
             return BookDetailSerializer
 
-    def get_queryset(self):
+    def list(self, request, *args, **kwargs):
+        if request.query_params.get('facets'):
+            queryset = filters.SearchFilter().filter_queryset(request, self.get_catalog_queryset(), self)
+            scope = 'staff' if request.user.is_staff else 'public'
+            return Response(get_book_facets(queryset, request.query_params, scope))
+        return super().list(request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        response = super().retrieve(request, *args, **kwargs)
+        if not request.user.is_staff:
+            view_counter.record(response.data['id'])
+        return response
+
+    @action(detail=False)
+    def suggest(self, request):
+        """
+        Returns up to ?limit= books (10 by default) whose title or author has a word starting with ?q=,
+        consisting book id, title, author, availability
+        """
+        try:
+            limit = min(int(request.query_params.get('limit', 10)), settings.BOOKSHOP_SUGGEST_MAX_LIMIT)
+        except ValueError:
+            return Response({'detail': 'Некорректное значение limit'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(get_suggest_index().suggest(request.query_params.get('q', ''), max(limit, 1)))
+
+    @action(detail=False)
+    def changes(self, request):
+        """
+        Returns books and publishing houses changed and deleted since ?since=<token> from the previous response.
+        Without the token returns the whole catalog. Ask again with the new token while has_more is true
+        """
+        since = parse_sync_token(request.query_params.get('since'))
+        if since is None:
+            return Response({'detail': 'Некорректный токен синхронизации'}, status=status.HTTP_400_BAD_REQUEST)
+        changes = get_catalog_changes(since, settings.BOOKSHOP_SYNC_PAGE_SIZE)
+        return Response(CatalogChangesSerializer(changes, context=self.get_serializer_context()).data)
+
+    def get_catalog_queryset(self):
         query = self.request.query_params.get('keyword')
         if query is None:
             query = ''
+        keyword = Q(title__icontains=query.lower()) | Q(title__icontains=query.upper()) | \
+            Q(title__icontains=query.capitalize())
         if self.request.user.is_staff:
-            return Book.objects.filter(Q(title__icontains=query.lower()) |
-                                       Q(title__icontains=query.upper()) |
-                                       Q(title__icontains=query.capitalize()))
+            return Book.objects.filter(keyword)
+        return Book.in_stock_objects.filter(keyword)
+
+    def get_queryset(self):
+        if getattr(self, 'swagger_fake_view', False):
+            return Book.objects.none()
+        # Rating and reviews are stored in the book, so that sorted lists are read from the indexes
+        return self.get_catalog_queryset()
+
+
+class AuthorViewSet(ReadOnlyModelViewSet):
+    """
+    Represents list of all authors with number of their books or one author. Be used also for getting author books.
+    """
+
+    queryset = Author.objects.annotate(books_count=Count('books'))
+    permission_classes = (IsAdminUserOrReadOnly,)
+    serializer_class = AuthorSerializer
+    filter_backends = [filters.SearchFilter, DjangoFilterBackend]
+    search_fields = ['^surname', '^name']
+
+    @action(detail=True)
+    def books(self, request, pk=None):
+        author = self.get_object()
+        if request.user.is_staff:
+            queryset = Book.objects.filter(authors=author)
         else:
-            return Book.in_stock_objects.filter(Q(title__icontains=query.lower()) |
-                                                Q(title__icontains=query.upper()) |
-                                                Q(title__icontains=query.capitalize())).annotate(
-                rating=Avg('book_comments__rating')).annotate(
-                reviews=Count('book_comments__comment'))
+            queryset = Book.in_stock_objects.filter(authors=author)
+        serializer = BookListSerializer(queryset, many=True, context=self.get_serializer_context())
+        return Response(serializer.data)
 
 
 @api_view(['POST'])
@@ -71,29 +237,178 @@ def upload_image(request):
     data = request.data
     book_id = data['book_id']
     book = Book.objects.get(id=book_id)
-    book.image = request.FILES.get('image')
+    image = request.FILES.get('image')
+    if image is None:
+        return Response({'detail': 'Фотография не выбрана'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        check_image_size(image.size)
+        check_image_header(image)
+    except UploadError as exc:
+        return Response({'detail': exc.message}, status=exc.status_code)
+    image.seek(0)
+    book.image = image
     book.save()
     return Response('Фотография загружена')
 
 
-class OrderViewSet(mixins.RetrieveModelMixin,
+@api_view(['POST'])
+@permission_classes([IsAdminUser])
+def start_image_upload(request):
+    """
+    Starts a chunked upload of the book image. Takes book id, file name, file size in bytes.
+    Chunks are sent by PATCH to the upload with the Upload-Offset header, then the upload is completed
+    """
+    serializer = ImageUploadSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    try:
+        upload = start_upload(serializer.validated_data['book'], request.user,
+                              serializer.validated_data['file_name'], serializer.validated_data['size'])
+    except UploadError as exc:
+        return Response({'detail': exc.message}, status=exc.status_code)
+    return Response(ImageUploadSerializer(upload).data, status=status.HTTP_201_CREATED)
+
+
+@api_view(['GET', 'PATCH'])
+@permission_classes([IsAdminUser])
+def image_upload(request, upload_id):
+    """
+    Returns the upload with number of received bytes to resume from, or appends the chunk sent as the request body
+    from the offset given in the Upload-Offset header
+    """
+    upload = get_object_or_404(ImageUpload, id=upload_id)
+    if request.method == 'PATCH':
+        try:
+            offset = int(request.headers['Upload-Offset'])
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except (KeyError, ValueError):
+            return Response({'detail': 'Не указано смещение'}, status=status.HTTP_400_BAD_REQUEST)
+        if length > settings.BOOKSHOP_UPLOAD_CHUNK_MAX_SIZE:
+            return Response({'detail': 'Слишком большая часть файла'}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        try:
+            upload = append_chunk(upload.id, offset, request.stream.read(length) if length else b'')
+        except UploadError as exc:
+            response = Response({'detail': exc.message}, status=exc.status_code)
+            received = ImageUpload.objects.filter(id=upload.id).values_list('received', flat=True).first()
+            if received is not None:
+                response['Upload-Offset'] = received
+            return response
+
+    response = Response(ImageUploadSerializer(upload).data)
+    response['Upload-Offset'] = upload.received
+    return response
+
+
+@api_view(['POST'])
+@permission_classes([IsAdminUser])
+def complete_image_upload(request, upload_id):
+    """
+    Verifies the fully uploaded image and attaches it to the book
+    """
+    upload = get_object_or_404(ImageUpload, id=upload_id)
+    try:
+        book = complete_upload(upload.id)
+    except UploadError as exc:
+        return Response({'detail': exc.message}, status=exc.status_code)
+    return Response({'book': book.id, 'image': request.build_absolute_uri(book.image.url)})
+
+
+def _format_event(states):
+    data = json.dumps([{'id': book_id, **state} for book_id, state in states.items()])
+    return f'event: stock\ndata: {data}\n\n'.encode()
+
+
+async def book_events(request):
+    """
+    Streams server-sent events with number of books in stock and book price for books given by ?books=1,2,3.
+    The first event contains the current state of all the books, next ones only the changed books.
+    The stream is closed after BOOKSHOP_EVENTS_MAX_AGE seconds, EventSource clients reconnect by themselves
+    """
+    try:
+        book_ids = {int(book_id) for book_id in request.GET.get('books', '').split(',') if book_id.strip()}
+    except ValueError:
+        return JsonResponse({'detail': 'Некорректный список книг'}, status=status.HTTP_400_BAD_REQUEST)
+    if not book_ids or len(book_ids) > settings.BOOKSHOP_EVENTS_MAX_BOOKS:
+        return JsonResponse({'detail': f'Укажите от 1 до {settings.BOOKSHOP_EVENTS_MAX_BOOKS} книг'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+    async def stream():
+        subscription = broadcaster.subscribe(book_ids)
+        try:
+            books = Book.objects.filter(id__in=book_ids).values_list('id', 'count_in_stock', 'price')
+            yield _format_event({book_id: book_state(count, price) async for book_id, count, price in books})
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + settings.BOOKSHOP_EVENTS_MAX_AGE
+            while loop.time() < deadline:
+                states = await subscription.next(min(settings.BOOKSHOP_EVENTS_HEARTBEAT, deadline - loop.time()))
+                yield _format_event(states) if states else b': keep-alive\n\n'
+        finally:
+            broadcaster.unsubscribe(subscription)
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def serve_media(request, path, document_root=None, show_indexes=False):
+    """
+    Serves uploaded files, marking content-addressed files as immutable for browsers and proxies
+    """
+    response = serve(request, path, document_root=document_root, show_indexes=show_indexes)
+    if response.status_code == 200 and is_content_addressed(path):
+        patch_cache_control(response, public=True, immutable=True, max_age=settings.MEDIA_IMMUTABLE_CACHE_MAX_AGE)
+    return response
+
+
+class OrderViewSet(StreamingListMixin,
+                   mixins.RetrieveModelMixin,
                    mixins.UpdateModelMixin,
                    mixins.ListModelMixin,
                    GenericViewSet):
     """
     Represents list of all customer orders or one order. Be used also for updating the order by staff.
+    Archived orders are listed and retrieved only with ?archive=include
     """
 
     permission_classes = (IsOrderOwner,)
     filter_backends = [filters.OrderingFilter, filters.SearchFilter, DjangoFilterBackend]
     ordering_fields = ['order_date', 'is_paid', 'status', 'total_cost']
     search_fields = ['customer__surname', 'status']
+    throttle_action_costs = {'list': 10, 'bulk_update': 10}
+    throttle_param_costs = {'archive': 10}
 
     def get_queryset(self):
+        if getattr(self, 'swagger_fake_view', False):
+            return Order.objects.none()
         if self.request.user.is_authenticated and not self.request.user.is_staff:
-            return Order.objects.filter(customer=self.request.user)
+            return Order.objects.filter(customer=self.request.user).select_related('customer')
         if self.request.user.is_staff:
-            return Order.objects.all()
+            return Order.objects.select_related('customer')
+
+    def include_archive(self):
+        return self.request.query_params.get('archive') == 'include'
+
+    def get_archive_queryset(self):
+        queryset = ArchivedOrder.objects.select_related('customer')
+        if not self.request.user.is_staff:
+            queryset = queryset.filter(customer=self.request.user)
+        return queryset
+
+    def get_list_querysets(self):
+        querysets = super().get_list_querysets()
+        if self.include_archive():
+            querysets.append(self.filter_queryset(self.get_archive_queryset()))
+        return querysets
+
+    def get_object(self):
+        try:
+            return super().get_object()
+        except Http404:
+            if self.action != 'retrieve' or not self.include_archive():
+                raise
+        order = get_object_or_404(self.get_archive_queryset(), pk=self.kwargs['pk'])
+        self.check_object_permissions(self.request, order)
+        return order
 
     def get_serializer_class(self):
         if self.action in ['list']:
@@ -101,45 +416,90 @@ class OrderViewSet(mixins.RetrieveModelMixin,
         else:
             return OrderDetailSerializer
 
+    @action(detail=False, methods=['post'], url_path='bulk-update', permission_classes=[IsAdminUser])
+    def bulk_update(self, request):
+        """
+        Updates order statuses and payment statuses of many orders at once by staff.
+        Returns one result per item in the order of the request. Later items for the same order win
+        """
+        if not isinstance(request.data, list):
+            return Response({'detail': 'Ожидается список заказов'}, status=status.HTTP_400_BAD_REQUEST)
+
+        item_serializers = [OrderBulkUpdateSerializer(data=item) for item in request.data]
+        changes = [serializer.validated_data for serializer in item_serializers if serializer.is_valid()]
+        updated = bulk_update_orders(changes) if changes else {}
+
+        results = []
+        for item, serializer in zip(request.data, item_serializers):
+            if serializer.errors:
+                results.append({'id': item.get('id') if isinstance(item, dict) else None,
+                                'result': 'invalid', 'errors': serializer.errors})
+            else:
+                order_id = serializer.validated_data['id']
+                results.append({'id': order_id, 'result': updated[order_id]})
+        return Response(results)
+
+
+@api_view(['POST'])
+def quote_order(request):
+    """
+    Returns current prices, number of books in stock, line totals, shipping price and total price of the cart
+    """
+    serializer = QuoteRequestSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    quote = build_quote(serializer.validated_data['orderItems'])
+    return Response(QuoteSerializer(quote).data)
+
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def add_ordered_books(request):
     """
-    Creates a new order, adds delivery address and ordered books
+    Creates a new order, adds delivery address and ordered books.
+    Prices and totals are taken from the current catalog, not from the client
     """
     user = request.user
     data = request.data
     shipping_address = data['shippingAddress']
     ordered_books = data['orderItems']
 
-    if ordered_books and len(ordered_books) == 0:
+    if not ordered_books:
         return Response({'detail': 'Товар не выбран'}, status=status.HTTP_400_BAD_REQUEST)
 
-    order = Order.objects.create(
-        customer=user,
-        shipping_cost=data['shippingPrice'],
-        total_cost=data['totalPrice'],
-        payment_method=data['paymentMethod']
-    )
-
-    DeliveryAddress.objects.create(
-        order=order,
-        address=shipping_address['address'],
-        phone_number=shipping_address['phone_number'],
-    )
-
-    for item in ordered_books:
-        book = Book.objects.get(id=item['book'])
-        new_ord_book = OrderedBook.objects.create(
-            ord_book=book,
-            quantity=item['quantity'],
-            price=item['price'],
+    serializer = QuoteRequestSerializer(data={'orderItems': ordered_books})
+    serializer.is_valid(raise_exception=True)
+
+    with transaction.atomic():
+        quote = build_quote(serializer.validated_data['orderItems'], lock=True)
+        if not quote['is_available']:
+            return Response({'detail': 'Недостаточно товара на складе', 'quote': QuoteSerializer(quote).data},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if quote['total_price'] > ORDER_MAX_TOTAL:
+            return Response({'detail': f'Сумма заказа не может превышать {ORDER_MAX_TOTAL}',
+                             'quote': QuoteSerializer(quote).data}, status=status.HTTP_400_BAD_REQUEST)
+
+        order = Order.objects.create(
+            customer=user,
+            shipping_cost=quote['shipping_price'],
+            total_cost=quote['total_price'],
+            payment_method=data['paymentMethod']
+        )
+
+        DeliveryAddress.objects.create(
             order=order,
+            address=shipping_address['address'],
+            phone_number=shipping_address['phone_number'],
         )
-        book.count_in_stock -= new_ord_book.quantity
-        book.save()
 
+        OrderedBook.objects.bulk_create([
+            OrderedBook(ord_book_id=line['book'], title=line['title'], author=line['author'], image=line['image'],
+                        quantity=line['quantity'], price=line['price'], order=order)
+            for line in quote['items']
+        ])
+        reserve_books(quote['items'])
+
+    ORDERS_PLACED.inc()
+    STOCK_OUTS.inc(sum(1 for line in quote['items'] if line['count_in_stock'] == line['quantity']))
     serializer = OrderDetailSerializer(order)
     return Response(serializer.data)
 
@@ -155,7 +515,7 @@ def update_order_to_pay(request, pk):
 
     order.is_paid = True
     order.pay_date = datetime.now()
-    order.save()
+    order.save(update_fields=['is_paid', 'pay_date'])
     serializer = OrderDetailSerializer(order)
     return Response(serializer.data)
 
@@ -173,11 +533,95 @@ def update_order_status(request, pk):
     order.status = data
     if order.status == 'Доставлен':
         order.delivery_date = datetime.now()
-    order.save()
+    order.save(update_fields=['status', 'delivery_date'])
     serializer = OrderDetailSerializer(order)
     return Response(serializer.data)
 
 
+@api_view(['POST'])
+def batch_requests(request):
+    """
+    Executes several API requests in one round trip and returns all their responses
+    """
+    serializer = BatchSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    responses = execute_batch(request, serializer.validated_data['requests'], serializer.validated_data['parallel'])
+    return Response(responses)
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def download_profile(request, profile_id):
+    """
+    Returns the stored profile of the request by staff, or its SQL timings with ?part=sql
+    """
+    if not profile_id.isalnum():
+        raise Http404
+    if request.query_params.get('part') == 'sql':
+        extensions = ['.sql.json']
+    else:
+        extensions = PROFILE_EXTENSIONS.values()
+    for extension in extensions:
+        profile_path = os.path.join(settings.PROFILE_ROOT, profile_id + extension)
+        if os.path.exists(profile_path):
+            return FileResponse(open(profile_path, 'rb'), as_attachment=True)
+    raise Http404
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def slow_queries(request):
+    """
+    Returns up to ?limit= (50 by default) shapes of slow queries sorted by ?order= total_time, max_time or calls
+    """
+    order = request.query_params.get('order', 'total_time')
+    if order not in SLOW_QUERY_ORDERINGS:
+        return Response({'detail': 'Некорректное значение order'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        limit = min(int(request.query_params.get('limit', 50)), settings.SLOW_QUERY_MAX_LIMIT)
+    except ValueError:
+        return Response({'detail': 'Некорректное значение limit'}, status=status.HTTP_400_BAD_REQUEST)
+    queryset = SlowQuery.objects.defer('plan').order_by('-' + order)[:max(limit, 1)]
+    return Response(SlowQuerySerializer(queryset, many=True).data)
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def slow_query_detail(request, fingerprint):
+    """
+    Returns statistics of slow queries of one shape with the last captured plan
+    """
+    return Response(SlowQueryDetailSerializer(get_object_or_404(SlowQuery, fingerprint=fingerprint)).data)
+
+
+# A request carrying one of these headers came through a proxy, its REMOTE_ADDR is the address of the proxy
+PROXY_HEADERS = ('HTTP_X_FORWARDED_FOR', 'HTTP_X_REAL_IP', 'HTTP_FORWARDED')
+
+
+def is_metrics_allowed(request):
+    """
+    Returns True if the request has the bearer token METRICS_TOKEN, or comes directly, not through a proxy,
+    from one of METRICS_ALLOWED_IPS
+    """
+    if settings.METRICS_TOKEN:
+        authorization = request.META.get('HTTP_AUTHORIZATION', '')
+        if constant_time_compare(authorization, f'Bearer {settings.METRICS_TOKEN}'):
+            return True
+    if any(header in request.META for header in PROXY_HEADERS):
+        return False
+    return request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS
+
+
+def metrics(request):
+    """
+    Exposes application metrics in Prometheus text format to allowed clients
+    """
+    if not is_metrics_allowed(request):
+        raise Http404
+    content, content_type = render_metrics()
+    return HttpResponse(content, content_type=content_type)
+
+
 class CommentAPIView(mixins.RetrieveModelMixin,
                      mixins.CreateModelMixin, mixins.UpdateModelMixin,
                      mixins.DestroyModelMixin, GenericViewSet):
@@ -204,7 +648,7 @@ class MyTokenObtainPairView(TokenObtainPairView):
     serializer_class = MyTokenObtainPairSerializer
 
 
-class UserViewSet(ModelViewSet):
+class UserViewSet(StreamingListMixin, ModelViewSet):
     """
     Represents list of all users or information about one user.
     Be used also for updating user information by owner or staff
@@ -214,6 +658,7 @@ class UserViewSet(ModelViewSet):
     filter_backends = [DjangoFilterBackend]
     queryset = User.objects.all()
     serializer_class = CustomerSerializer
+    throttle_action_costs = {'list': 10}
 
 
 class ProfileViewSet(mixins.RetrieveModelMixin,
@@ -229,6 +674,18 @@ class ProfileViewSet(mixins.RetrieveModelMixin,
     serializer_class = CustomerSerializerWithToken
 
     def get_queryset(self):
+        if getattr(self, 'swagger_fake_view', False):
+            return User.objects.none()
         if self.request.user.is_authenticated:
             return User.objects.filter(id=self.request.user.pk)
 
+    def retrieve(self, request, *args, **kwargs):
+        response = super().retrieve(request, *args, **kwargs)
+        TOKENS_ISSUED.labels('profile').inc()
+        return response
+
+    def update(self, request, *args, **kwargs):
+        response = super().update(request, *args, **kwargs)
+        TOKENS_ISSUED.labels('profile').inc()
+        return response
+
@@ -0,0 +1,107 @@
+import gc
+import inspect
+import logging
+import os
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.urls import URLResolver, get_resolver
+from rest_framework import serializers as drf_serializers
+from rest_framework.settings import IMPORT_STRINGS, api_settings
+from rest_framework_simplejwt.settings import IMPORT_STRINGS as JWT_IMPORT_STRINGS, api_settings as jwt_api_settings
+
+logger = logging.getLogger(__name__)
+
+
+def compile_urls(resolver):
+    """
+    Compiles the regular expressions of all URL patterns and builds the reverse lookup of the resolver
+    """
+    resolver.reverse_dict
+    for pattern in resolver.url_patterns:
+        pattern.pattern.regex
+        if isinstance(pattern, URLResolver):
+            compile_urls(pattern)
+
+
+def build_serializers():
+    """
+    Imports the classes named in DRF and JWT settings and builds the fields of every bookshop serializer once,
+    so that model metadata and field classes are loaded before the first request
+    """
+    for name in IMPORT_STRINGS:
+        getattr(api_settings, name)
+    for name in JWT_IMPORT_STRINGS:
+        getattr(jwt_api_settings, name)
+
+    from . import serializers
+
+    for _, serializer_class in inspect.getmembers(serializers, inspect.isclass):
+        if not issubclass(serializer_class, drf_serializers.Serializer) or \
+                serializer_class.__module__ != serializers.__name__:
+            continue
+        # Base classes of model serializers have no Meta
+        if not issubclass(serializer_class, drf_serializers.ModelSerializer) or hasattr(serializer_class, 'Meta'):
+            serializer_class().fields
+
+
+def prime_catalog():
+    """
+    Loads the title autocomplete index and the publishing houses shown with every book
+    """
+    from .cache import publishing_cache
+    from .models import Publishing
+    from .suggest import get_suggest_index
+
+    get_suggest_index()
+    publishing_cache.get_many(
+        Publishing.objects.order_by('id').values_list('id', flat=True)[:settings.BOOKSHOP_OBJECT_CACHE_LOCAL_SIZE])
+
+
+def load_schemas():
+    """
+    Reads the pregenerated OpenAPI schema files, without generating missing ones
+    """
+    from bookshop_project.yasg import SCHEMA_FORMATS, get_code_version, get_schema_file, load_schema
+
+    for fmt in SCHEMA_FORMATS:
+        if os.path.exists(get_schema_file(fmt, get_code_version())):
+            load_schema(fmt)
+
+
+WARM_UP_STEPS = (
+    ('urls', lambda: compile_urls(get_resolver())),
+    ('serializers', build_serializers),
+    ('catalog', prime_catalog),
+    ('schemas', load_schemas),
+)
+
+
+def warm_up():
+    """
+    Prepares the process to serve requests, called when wsgi.py or asgi.py is loaded. With a pre-forking server
+    started with preloading (gunicorn --preload) it runs once in the master process and the workers inherit the result.
+    A failed step is logged and skipped. Database and cache connections are closed at the end, so that the forked
+    workers do not share them, and the loaded objects are moved out of the garbage collector's reach, so that
+    its passes do not copy the shared memory pages to every worker.
+    Returns seconds spent in every step
+    """
+    timings = {}
+    for name, step in WARM_UP_STEPS:
+        start = time.perf_counter()
+        try:
+            step()
+        except Exception:
+            logger.exception('Warm-up step %s failed', name)
+        timings[name] = time.perf_counter() - start
+
+    connections.close_all()
+    for cache in caches.all(initialized_only=True):
+        cache.close()
+    gc.collect()
+    gc.freeze()
+    logger.info('Warmed up in %.3f s: %s', sum(timings.values()),
+                ', '.join(f'{name} {seconds:.3f} s' for name, seconds in timings.items()))
+    return timings
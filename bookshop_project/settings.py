@@ -10,8 +10,9 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 from datetime import timedelta
+from decimal import Decimal
 from pathlib import Path
-from decouple import config
+from decouple import Csv, config
 import os.path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -35,6 +36,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     'rest_framework',
     'corsheaders',
@@ -47,6 +49,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'bookshop.middleware.SlowQueryMiddleware',
+    'bookshop.middleware.MetricsMiddleware',
+    'bookshop.middleware.ThrottleHeadersMiddleware',
     "corsheaders.middleware.CorsMiddleware",
 
     'django.middleware.security.SecurityMiddleware',
@@ -54,6 +59,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'bookshop.middleware.RequestProfilerMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -136,7 +142,7 @@ SIMPLE_JWT = {
     "SLIDING_TOKEN_REFRESH_LIFETIME": timedelta(days=1),
 
     "TOKEN_OBTAIN_SERIALIZER": "bookshop.serializers.MyTokenObtainPairSerializer",
-    "TOKEN_REFRESH_SERIALIZER": "rest_framework_simplejwt.serializers.TokenRefreshSerializer",
+    "TOKEN_REFRESH_SERIALIZER": "bookshop.serializers.MyTokenRefreshSerializer",
     "TOKEN_VERIFY_SERIALIZER": "rest_framework_simplejwt.serializers.TokenVerifySerializer",
     "TOKEN_BLACKLIST_SERIALIZER": "rest_framework_simplejwt.serializers.TokenBlacklistSerializer",
     "SLIDING_TOKEN_OBTAIN_SERIALIZER": "rest_framework_simplejwt.serializers.TokenObtainSlidingSerializer",
@@ -163,6 +169,7 @@ REST_FRAMEWORK = {
 
     "DEFAULT_RENDERER_CLASSES": [
         "rest_framework.renderers.JSONRenderer",
+        'bookshop.renderers.MessagePackRenderer',
         'rest_framework.renderers.BrowsableAPIRenderer'
     ],
 
@@ -179,6 +186,7 @@ REST_FRAMEWORK = {
 
     'DEFAULT_PARSER_CLASSES': [
         'rest_framework.parsers.JSONParser',
+        'bookshop.parsers.MessagePackParser',
         'rest_framework.parsers.FormParser',
         'rest_framework.parsers.MultiPartParser'
     ],
@@ -186,6 +194,17 @@ REST_FRAMEWORK = {
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend'
     ],
+
+    'DEFAULT_THROTTLE_CLASSES': [
+        'bookshop.throttling.AnonCostRateThrottle',
+        'bookshop.throttling.UserCostRateThrottle',
+    ],
+
+    # Tokens per period, requests take as many tokens as they cost (throttle_cost of the view)
+    'DEFAULT_THROTTLE_RATES': {
+        'anon': '600/min',
+        'user': '1800/min',
+    },
 }
 
 # Password validation
@@ -226,9 +245,163 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'api-static')
 
 MEDIA_URL = '/media/'
 
+# OpenAPI schema is generated once per code version by "manage.py generate_schema" or on the first request
+
+APP_VERSION = config('APP_VERSION', default='')
+
+OPENAPI_SCHEMA_DIR = os.path.join(STATIC_ROOT, 'openapi')
+
+OPENAPI_SCHEMA_CACHE_MAX_AGE = 60 * 60
+
+SWAGGER_SETTINGS = {
+    'SPEC_URL': ('schema-json', {'format': '.json'}),
+}
+
+REDOC_SETTINGS = {
+    'SPEC_URL': ('schema-json', {'format': '.json'}),
+}
+
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Uploaded files are stored under names derived from their content and can be cached forever
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'bookshop.storage.ContentAddressedStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
+MEDIA_IMMUTABLE_CACHE_MAX_AGE = 60 * 60 * 24 * 365
+
+# Book images are uploaded in chunks to UPLOAD_TEMP_DIR, which has to be shared by all application servers
+
+UPLOAD_TEMP_DIR = os.path.join(BASE_DIR, 'uploads')
+
+BOOKSHOP_IMAGE_MAX_SIZE = 10 * 1024 * 1024
+
+BOOKSHOP_IMAGE_MAX_SIDE = 8000
+
+BOOKSHOP_IMAGE_HEADER_SIZE = 64 * 1024
+
+BOOKSHOP_UPLOAD_CHUNK_MAX_SIZE = 1024 * 1024
+
+BOOKSHOP_UPLOAD_EXPIRE_HOURS = 24
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Bookshop
+
+BOOKSHOP_FACETS_CACHE_TIMEOUT = 60
+
+BOOKSHOP_BATCH_MAX_REQUESTS = 20
+
+BOOKSHOP_BATCH_MAX_WORKERS = 4
+
+BOOKSHOP_SHIPPING_PRICE = Decimal('300.00')
+
+BOOKSHOP_FREE_SHIPPING_FROM = Decimal('3000.00')
+
+BOOKSHOP_STREAMING_CHUNK_SIZE = 500
+
+BOOKSHOP_STREAMING_COMPRESSION_MIN_SIZE = 1024
+
+# Publishing houses are cached in the shared cache and for a few seconds in every process
+
+BOOKSHOP_OBJECT_CACHE_TIMEOUT = 300
+
+BOOKSHOP_OBJECT_CACHE_LOCAL_TIMEOUT = 5
+
+BOOKSHOP_OBJECT_CACHE_LOCAL_SIZE = 1000
+
+# Server-sent events of stock and price changes are sent at most once per interval, idle streams get a comment
+# every heartbeat seconds and are closed after max age seconds
+
+BOOKSHOP_EVENTS_INTERVAL = 1.0
+
+BOOKSHOP_EVENTS_HEARTBEAT = 15
+
+BOOKSHOP_EVENTS_MAX_AGE = 300
+
+BOOKSHOP_EVENTS_MAX_BOOKS = 100
+
+# Title autocomplete is served from an in-memory index loaded from the snapshot written by snapshot_suggest_index
+
+SNAPSHOT_ROOT = os.path.join(BASE_DIR, 'snapshots')
+
+BOOKSHOP_SUGGEST_SNAPSHOT = os.path.join(SNAPSHOT_ROOT, 'suggest.json.gz')
+
+BOOKSHOP_SUGGEST_REFRESH_INTERVAL = 60
+
+BOOKSHOP_SUGGEST_MAX_LIMIT = 50
+
+# When more books were changed since the last refresh, the index is rebuilt instead of being updated book by book
+
+BOOKSHOP_SUGGEST_MAX_CHANGES = 10000
+
+# Books in stock and publishing houses are prebuilt for anonymous clients by build_catalog_snapshot
+# as gzipped JSON shards listed in manifest.json, to be served by the front web server
+
+BOOKSHOP_CATALOG_SNAPSHOT_DIR = os.path.join(MEDIA_ROOT, 'catalog')
+
+BOOKSHOP_CATALOG_SNAPSHOT_PAGE_SIZE = 500
+
+# Catalog changes are returned by pages of at most this number of objects of each kind
+
+BOOKSHOP_SYNC_PAGE_SIZE = 1000
+
+# Popularity of books is recomputed by refresh_popularity from sales of the last days, decaying with the half-life
+
+BOOKSHOP_POPULARITY_DAYS = 90
+
+BOOKSHOP_POPULARITY_HALF_LIFE = 14
+
+BOOKSHOP_POPULARITY_RATING_WEIGHT = 2
+
+BOOKSHOP_POPULARITY_VIEW_WEIGHT = 0.05
+
+# Views of book pages are buffered by every worker and added to the counters in one statement per flush
+
+BOOKSHOP_VIEW_FLUSH_INTERVAL = 10
+
+BOOKSHOP_VIEW_BUFFER_SIZE = 5000
+
+# Delivered and cancelled orders older than this number of days are moved to the archive by archive_orders
+
+BOOKSHOP_ORDER_ARCHIVE_DAYS = 365
+
+# Staff can profile one request with the X-Profile header or the _profile query parameter
+
+PROFILE_ROOT = os.path.join(BASE_DIR, 'profiles')
+
+PROFILE_SAMPLING_INTERVAL = 0.005
+
+PROFILE_TRACEMALLOC_TOP = 50
+
+# Queries slower than the threshold are recorded per normalized SQL with their plan, captured once per interval
+
+SLOW_QUERY_THRESHOLD_MS = 200
+
+SLOW_QUERY_EXPLAIN_INTERVAL = 300
+
+SLOW_QUERY_MAX_LIMIT = 500
+
+# Prometheus metrics are exposed at /metrics to requests with the bearer token, or to these addresses when the request
+# does not come through a proxy. Set PROMETHEUS_MULTIPROC_DIR for pre-forked servers
+
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
+METRICS_ALLOWED_IPS = config('METRICS_ALLOWED_IPS', default='127.0.0.1', cast=Csv())
+
+# wsgi.py and asgi.py prepare the process before serving requests, see bookshop.warmup
+
+BOOKSHOP_WARM_UP = config('BOOKSHOP_WARM_UP', default=True, cast=bool)
+
+# Admin changelists count rows exactly up to this limit and use planner estimates above it
+
+ADMIN_EXACT_COUNT_LIMIT = 10000
@@ -20,7 +20,7 @@ from django.contrib import admin
 from django.urls import path, include
 from rest_framework_simplejwt.views import TokenRefreshView
 
-from bookshop.views import MyTokenObtainPairView
+from bookshop.views import MyTokenObtainPairView, metrics, serve_media
 from .yasg import urlpatterns as doc_urls
 
 urlpatterns = [
@@ -30,9 +30,10 @@ urlpatterns = [
     path('auth/token/', MyTokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('auth/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('auth/', include('djoser.urls')),
+    path('metrics', metrics, name='metrics'),
 ]
 
 urlpatterns += doc_urls
 
 if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    urlpatterns += static(settings.MEDIA_URL, view=serve_media, document_root=settings.MEDIA_ROOT)
@@ -1,22 +1,113 @@
-from django.urls import path
+import functools
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from django.urls import path, re_path
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.views.decorators.http import require_safe
 from rest_framework import permissions
+from drf_yasg.codecs import OpenAPICodecJson, OpenAPICodecYaml
+from drf_yasg.generators import OpenAPISchemaGenerator
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 
+info = openapi.Info(
+    title='Django bookshop',
+    default_version='v1',
+    description='Description',
+    license=openapi.License(name='BSD License'),
+)
+
 schema_view = get_schema_view(
-    openapi.Info(
-        title='Django bookshop',
-        default_version='v1',
-        description='Description',
-        license=openapi.License(name='BSD License'),
-    ),
+    info,
     public=True,
     permission_classes=[permissions.AllowAny],
 )
 
+SCHEMA_FORMATS = {
+    '.json': (OpenAPICodecJson, 'application/json'),
+    '.yaml': (OpenAPICodecYaml, 'application/yaml'),
+}
+
+_loaded_schemas = {}
+
+
+@functools.lru_cache(maxsize=None)
+def get_code_version():
+    """
+    Returns the version of the deployed code: APP_VERSION if it is set, otherwise a digest of the project sources
+    """
+    if settings.APP_VERSION:
+        return settings.APP_VERSION
+    digest = hashlib.sha1()
+    for package in ('bookshop', 'bookshop_project'):
+        for source in sorted(Path(settings.BASE_DIR, package).rglob('*.py')):
+            digest.update(str(source.relative_to(settings.BASE_DIR)).encode())
+            digest.update(source.read_bytes())
+    return digest.hexdigest()[:12]
+
+
+def get_schema_file(fmt, version):
+    return os.path.join(settings.OPENAPI_SCHEMA_DIR, f'openapi-{version}{fmt}')
+
+
+def write_schema_files(version=None):
+    """
+    Generates the OpenAPI schema once and writes it in every supported format.
+    Returns list of written file paths
+    """
+    version = version or get_code_version()
+    schema = OpenAPISchemaGenerator(info).get_schema(request=None, public=True)
+    os.makedirs(settings.OPENAPI_SCHEMA_DIR, exist_ok=True)
+
+    written = []
+    for fmt, (codec_class, _) in SCHEMA_FORMATS.items():
+        descriptor, temp_path = tempfile.mkstemp(dir=settings.OPENAPI_SCHEMA_DIR, prefix='.openapi-')
+        with os.fdopen(descriptor, 'wb') as temp_file:
+            temp_file.write(codec_class(validators=[]).encode(schema))
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, get_schema_file(fmt, version))
+        written.append(get_schema_file(fmt, version))
+    return written
+
+
+def load_schema(fmt):
+    """
+    Returns content and ETag of the schema for the current code version, generating the files if they are missing
+    """
+    version = get_code_version()
+    schema_file = get_schema_file(fmt, version)
+    if schema_file not in _loaded_schemas:
+        if not os.path.exists(schema_file):
+            write_schema_files(version)
+        with open(schema_file, 'rb') as stream:
+            content = stream.read()
+        _loaded_schemas[schema_file] = (content, f'"{hashlib.sha1(content).hexdigest()}"')
+    return _loaded_schemas[schema_file]
+
+
+@require_safe
+def schema_file_view(request, format):
+    """
+    Serves the pregenerated OpenAPI schema with ETag, without introspecting the views on every request
+    """
+    if format not in SCHEMA_FORMATS:
+        raise Http404
+    content, etag = load_schema(format)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(content, content_type=SCHEMA_FORMATS[format][1])
+    response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=settings.OPENAPI_SCHEMA_CACHE_MAX_AGE)
+    return response
+
+
 urlpatterns = [
-    path('swagger<format>/', schema_view.without_ui(cache_timeout=0), name='schema-json'),
+    re_path(r'^swagger(?P<format>\.json|\.yaml)/$', schema_file_view, name='schema-json'),
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
     path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
 ]
-